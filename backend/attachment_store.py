@@ -0,0 +1,128 @@
+"""
+Streaming attachment storage
+
+Gmail returns attachment bodies as base64url text inside a JSON response.
+JsonStringFieldReader picks that text out of the response as it streams in,
+and AttachmentSink decodes it chunk by chunk into a temporary file next to
+its destination, enforcing a size limit and hashing as it goes, then renames
+the file into place, so a large attachment never needs to be held in memory
+whole.
+"""
+import base64
+import hashlib
+import os
+import re
+import tempfile
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from config import settings
+
+
+class AttachmentTooLargeError(Exception):
+    """The attachment exceeds ATTACHMENT_MAX_BYTES"""
+
+
+class AttachmentSink:
+    """Decodes base64url chunks into a temp file, then moves it atomically into place"""
+
+    def __init__(self, dest_path: str, max_bytes: Optional[int] = None):
+        self.dest_path = dest_path
+        self.max_bytes = settings.ATTACHMENT_MAX_BYTES if max_bytes is None else max_bytes
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._pending = ""  # base64 characters not yet forming a full 4-character group
+
+        directory = os.path.dirname(dest_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=directory, prefix=".download-", suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+
+    def write_base64(self, text: str) -> None:
+        """Decode and append a chunk of base64url text (any length)"""
+        text = self._pending + text
+        usable = len(text) - len(text) % 4
+        self._pending = text[usable:]
+        if usable:
+            self._write(base64.urlsafe_b64decode(text[:usable]))
+
+    def commit(self) -> Dict:
+        """Finish decoding and rename the file to dest_path"""
+        if self._pending:
+            # Gmail may strip the trailing padding
+            self._write(base64.urlsafe_b64decode(self._pending + "=" * (-len(self._pending) % 4)))
+            self._pending = ""
+        self._file.close()
+        os.replace(self._tmp_path, self.dest_path)
+        return {"path": self.dest_path, "size": self.size, "sha256": self._sha256.hexdigest()}
+
+    def discard(self) -> None:
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def _write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.max_bytes and self.size > self.max_bytes:
+            raise AttachmentTooLargeError(f"Attachment larger than {self.max_bytes} bytes")
+        self._sha256.update(data)
+        self._file.write(data)
+
+
+class JsonStringFieldReader:
+    """
+    The value of a top-level JSON string field from a streamed response, in
+    pieces of at least min_size characters. Only fits values without escape
+    sequences, like base64url attachment data.
+    """
+
+    def __init__(self, field: str, min_size: int = 1 << 18):
+        self.field = field
+        self.min_size = min_size
+        self.closed = False  # The whole value has been read
+        self._marker = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._head = ""
+        self._in_value = False
+        self._buffer: List[str] = []
+        self._buffered = 0
+
+    def feed(self, text: str) -> List[str]:
+        """The pieces of the value this chunk of the response completes"""
+        if self.closed:
+            return []
+        if not self._in_value:
+            self._head += text
+            match = self._marker.search(self._head)
+            if not match:
+                return []
+            self._in_value = True
+            text, self._head = self._head[match.end():], ""
+
+        end = text.find('"')
+        if end != -1:
+            text, self.closed = text[:end], True
+        if text:
+            self._buffer.append(text)
+            self._buffered += len(text)
+        if not self._buffer or not (self.closed or self._buffered >= self.min_size):
+            return []
+        piece = "".join(self._buffer)
+        self._buffer, self._buffered = [], 0
+        return [piece]
+
+    def finish(self) -> None:
+        """Raise if the response ended before the value did"""
+        if not self.closed:
+            raise ValueError(f"Response has no complete '{self.field}' field")
+
+
+def iter_json_string_field(chunks: Iterable[str], field: str) -> Iterator[str]:
+    """JsonStringFieldReader over a blocking stream of response text"""
+    reader = JsonStringFieldReader(field)
+    for text in chunks:
+        yield from reader.feed(text)
+        if reader.closed:
+            return
+    reader.finish()
+
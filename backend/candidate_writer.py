@@ -0,0 +1,143 @@
+"""
+Buffered bulk writer for scanned candidates
+
+Candidates are collected and flushed as unordered bulk upserts keyed by
+gmail_message_id, either when the buffer is full or on a timer. Upserts
+with $setOnInsert make the write idempotent, so two overlapping scans of
+the same mailbox never insert the same message twice.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from config import settings
+from database import Candidate
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def _is_existing_message(write_error: Dict) -> bool:
+    """
+    Whether a write error means the message is already stored (a duplicate
+    gmail_message_id), as opposed to e.g. a unique_id shared with a different message
+    """
+    if write_error.get("code") != DUPLICATE_KEY_ERROR:
+        return False
+    key_pattern = write_error.get("keyPattern")
+    if key_pattern:
+        return "gmail_message_id" in key_pattern
+    return "gmail_message_id" in (write_error.get("errmsg") or "")
+
+
+class CandidateWriter:
+    """Buffers Candidate documents and writes them in bulk"""
+
+    def __init__(
+        self,
+        progress: Dict,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        on_written: Optional[Callable[[List[str]], Awaitable[None]]] = None,
+        count: Optional[Callable[[str, int, Any], None]] = None,
+    ):
+        self.progress = progress
+        # Called with the gmail_message_ids stored by each flush (new or already existing)
+        self.on_written = on_written
+        # Adds to a progress counter, with the tag the candidate was added with
+        self.count = count or self._count_progress
+        self.batch_size = max(1, batch_size or settings.CANDIDATE_WRITE_BATCH_SIZE)
+        self.flush_interval = flush_interval or settings.CANDIDATE_WRITE_INTERVAL
+
+        self._buffer: List[Tuple[Candidate, Any]] = []
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+
+        self.progress.setdefault("candidates_added", 0)
+        self.progress.setdefault("already_existing", 0)
+
+    def start(self) -> None:
+        """Start the periodic flush timer"""
+        if self._timer is None:
+            self._timer = asyncio.create_task(self._flush_periodically())
+
+    async def close(self) -> None:
+        """Stop the timer and write whatever is still buffered"""
+        if self._timer is not None:
+            self._timer.cancel()
+            try:
+                await self._timer
+            except asyncio.CancelledError:
+                pass
+            self._timer = None
+        await self.flush()
+
+    def _count_progress(self, key: str, count: int, tag: Any = None) -> None:
+        self.progress[key] = self.progress.get(key, 0) + count
+
+    async def add(self, candidate: Candidate, tag: Any = None) -> None:
+        """Buffer a candidate; its outcome is counted under `tag` (see count)"""
+        self._buffer.append((candidate, tag))
+        if len(self._buffer) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            entries, self._buffer = self._buffer, []
+            if not entries:
+                return
+            candidates = [candidate for candidate, _ in entries]
+
+            operations = [
+                UpdateOne(
+                    {"gmail_message_id": c.gmail_message_id},
+                    {"$setOnInsert": c.model_dump(by_alias=True, exclude={"id", "revision_id"})},
+                    upsert=True,
+                )
+                for c in candidates
+            ]
+
+            failed = set()
+            try:
+                result = await Candidate.get_motor_collection().bulk_write(operations, ordered=False)
+                upserted = set(result.upserted_ids or {})
+            except BulkWriteError as e:
+                upserted = {u.get("index") for u in e.details.get("upserted", [])}
+                # A duplicate gmail_message_id means another scan got there first; anything
+                # else (including a unique_id collision with another message) is not stored
+                failed = {
+                    err.get("index") for err in e.details.get("writeErrors", [])
+                    if not _is_existing_message(err)
+                }
+                if failed:
+                    print(f"❌ {len(failed)} candidate writes failed: {e.details.get('writeErrors', [])[:3]}")
+            except Exception as e:
+                upserted = set()
+                failed = set(range(len(candidates)))
+                print(f"❌ Error writing {len(candidates)} candidates: {str(e)}")
+            errors = len(failed)
+            inserted = len(upserted)
+
+            existing = len(candidates) - inserted - errors
+            for index, (_, tag) in enumerate(entries):
+                if index in failed:
+                    self.count("errors", 1, tag)
+                elif index in upserted:
+                    self.count("candidates_added", 1, tag)
+                else:
+                    self.count("already_existing", 1, tag)
+            print(f"💾 Wrote {len(candidates)} candidates ({inserted} new, {existing} already existed)")
+
+            if self.on_written and errors < len(candidates):
+                await self.on_written(
+                    [c.gmail_message_id for i, c in enumerate(candidates) if i not in failed]
+                )
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"❌ Error flushing candidates: {str(e)}")
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -12,6 +14,75 @@ class Settings(BaseSettings):
 
     # Files
     UPLOAD_DIR: str = "uploads"
+    # Larger attachments are not downloaded (0 = no limit)
+    ATTACHMENT_MAX_BYTES: int = 25 * 1024 * 1024
+
+    # Scan pipeline (bounded queues between stages, per-stage worker counts)
+    SCAN_QUEUE_SIZE: int = 50
+    SCAN_FETCH_CONCURRENCY: int = 8
+    SCAN_DOWNLOAD_CONCURRENCY: int = 4
+    SCAN_EXTRACT_CONCURRENCY: int = 2
+    SCAN_PARSE_CONCURRENCY: int = 2
+    SCAN_PERSIST_CONCURRENCY: int = 4
+    # Candidates are bulk-written once this many are buffered or after this many seconds
+    CANDIDATE_WRITE_BATCH_SIZE: int = 100
+    CANDIDATE_WRITE_INTERVAL: float = 2.0
+    # Overall cap on emails per scan (unset = whole result set)
+    SCAN_MAX_EMAILS: Optional[int] = None
+    # Two-phase Gmail fetch: read headers and attachment names first and only fetch
+    # full messages with a matching attachment extension or subject
+    SCAN_PREFILTER_ENABLED: bool = False
+    SCAN_PREFILTER_EXTENSIONS: list[str] = [
+        ".pdf", ".doc", ".docx", ".csv", ".xlsx", ".xls", ".jpg", ".jpeg", ".png"
+    ]
+    SCAN_PREFILTER_SUBJECT_PATTERN: Optional[str] = r"\b(resume|cv|application|applying|candidate)\b"
+    # Progress streaming and how long finished scans stay queryable
+    SCAN_PROGRESS_PUSH_INTERVAL: float = 0.5
+    SCAN_JOB_RETENTION_SECONDS: int = 3600
+
+    # Scan workers (jobs are queued in MongoDB; run `python worker.py` for standalone workers)
+    # Also run a worker inside the API process (required for IMAP scans: only the process an
+    # IMAP account logged in to holds its connection pool, so only its worker claims them)
+    SCAN_WORKER_IN_API: bool = True
+    SCAN_WORKER_CONCURRENCY: int = 2  # Jobs one worker runs at once
+    SCAN_WORKER_POLL_INTERVAL: float = 2.0
+    SCAN_JOB_LEASE_SECONDS: int = 60
+    SCAN_JOB_HEARTBEAT_SECONDS: float = 5.0
+    SCAN_JOB_MAX_ATTEMPTS: int = 3
+
+    # Scheduled scans of every user with Gmail tokens (runs inside the API process)
+    SCAN_SCHEDULER_ENABLED: bool = False
+    SCAN_SCHEDULE_INTERVAL_SECONDS: int = 900  # Per account, +/- jitter
+    SCAN_SCHEDULE_JITTER: float = 0.2  # Fraction of the interval
+    SCAN_SCHEDULE_HOURS_BACK: int = 24  # First scan / expired history window
+    SCAN_SCHEDULER_MAX_ACTIVE: int = 4  # Scheduled scans queued or running at once
+    SCAN_SCHEDULER_TICK_SECONDS: float = 30.0
+
+    # IMAP: messages per UID FETCH (structure and headers first, then only text parts)
+    IMAP_FETCH_BATCH_SIZE: int = 50
+    # Authenticated connections kept per IMAP account (servers cap these, e.g. Yahoo at ~5)
+    IMAP_POOL_SIZE: int = 4
+    IMAP_POOL_HEALTH_CHECK_SECONDS: float = 60.0  # NOOP pooled connections idle longer than this
+    IMAP_TIMEOUT_SECONDS: float = 30.0  # Per command
+    # Async IMAP client (imap_async.py) on the event loop; FETCH commands written before reading replies
+    IMAP_ASYNC_CLIENT: bool = True
+    IMAP_PIPELINE_DEPTH: int = 4
+    # Folders a scan searches, concurrently on one pooled connection each
+    IMAP_SCAN_FOLDERS: list[str] = ["INBOX"]
+    # IMAP has no attachment search; has:attachment becomes this (None = leave it to the scan)
+    IMAP_ATTACHMENT_CRITERIA: Optional[str] = 'HEADER Content-Type "multipart/mixed"'
+    # IDLE push: queue an incremental scan as soon as the server reports new mail
+    # (run by the API process's worker, see SCAN_WORKER_IN_API)
+    IMAP_IDLE_ENABLED: bool = True
+    IMAP_IDLE_RENEW_SECONDS: float = 300.0
+    IMAP_IDLE_DEBOUNCE_SECONDS: float = 2.0
+    IMAP_IDLE_MAX_BACKOFF_SECONDS: float = 60.0
+    # Window and cap of an IDLE scan for an account with no sync state yet (not the whole INBOX)
+    IMAP_IDLE_FIRST_SCAN_HOURS: int = 1
+    IMAP_IDLE_FIRST_SCAN_MAX_EMAILS: int = 100
+
+    # Resume extraction/parsing worker processes (unset = one per CPU core, 0 = thread mode)
+    PARSER_POOL_WORKERS: Optional[int] = None
 
     # Public URL for Redirects
     PUBLIC_BACKEND_URL: str = "http://crm.76.13.17.251.nip.io:8010"
@@ -31,6 +102,31 @@ class Settings(BaseSettings):
         "https://www.googleapis.com/auth/userinfo.email",
         "openid",
     ]
+    # messages.get calls per Gmail batch request (Gmail allows 100, rate-limits above ~50)
+    GMAIL_BATCH_SIZE: int = 50
+    # Label incremental (history) scans are restricted to
+    GMAIL_HISTORY_LABEL: str = "INBOX"
+    # Label ingested messages (needs gmail.modify) and leave labelled mail out of scan queries
+    GMAIL_PROCESSED_LABEL_ENABLED: bool = False
+    GMAIL_PROCESSED_LABEL: str = "CRM/Processed"
+    # Per-user scans use the async REST client (gmail_async.py) on a shared connection pool
+    GMAIL_ASYNC_CLIENT: bool = True
+    GMAIL_HTTP_MAX_CONNECTIONS: int = 50
+    GMAIL_HTTP_TIMEOUT: float = 30.0
+    GMAIL_HTTP2: bool = False  # Requires httpx[http2]
+    GMAIL_ASYNC_CONCURRENCY: int = 10  # Requests in flight per mailbox
+    # Cached user tokens are refreshed this long before they expire
+    GMAIL_TOKEN_REFRESH_MARGIN_SECONDS: int = 300
+    GMAIL_TOKEN_REFRESH_CHECK_SECONDS: float = 60.0
+    # Cached credentials unused for this long are dropped (rebuilt from the User on next use)
+    GMAIL_CREDENTIAL_IDLE_SECONDS: float = 3600.0
+    # Gmail per-user quota (units/second, see gmail_quota.QUOTA_UNITS) and retry backoff
+    GMAIL_QUOTA_UNITS_PER_SECOND: float = 250.0
+    GMAIL_MAX_RETRIES: int = 5
+    GMAIL_BACKOFF_BASE_SECONDS: float = 1.0
+    GMAIL_BACKOFF_MAX_SECONDS: float = 32.0
+    # Per-user Gmail services kept ready between scans (least recently used dropped first)
+    GMAIL_SERVICE_POOL_SIZE: int = 100
 
 
 settings = Settings()
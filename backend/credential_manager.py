@@ -0,0 +1,154 @@
+"""
+OAuth credential manager for per-user Gmail access
+
+Client secrets are read from GMAIL_CREDENTIALS_FILE once per process.
+Credentials are cached per user and, for users with a scan queued or
+running, refreshed in the background shortly before they expire, so scans
+normally start with a valid token. Entries unused for
+GMAIL_CREDENTIAL_IDLE_SECONDS are evicted. Concurrent refreshes for the same
+user share one token request, and the new token is saved to the User in a
+single write.
+"""
+import asyncio
+import functools
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set, Tuple
+
+from beanie.odm.fields import PydanticObjectId
+from google.auth.transport.requests import Request as GoogleRequest
+from google.oauth2.credentials import Credentials
+
+from config import settings
+from database import User
+from gmail_pool import gmail_services
+from scan_jobs import active_job_user_ids
+
+TOKEN_URI = 'https://oauth2.googleapis.com/token'
+
+
+@functools.lru_cache(maxsize=1)
+def load_client_secrets() -> Tuple[str, str]:
+    """(client_id, client_secret) from the OAuth credentials file"""
+    with open(settings.GMAIL_CREDENTIALS_FILE, 'r') as f:
+        creds_data = json.load(f)
+    client = creds_data.get('web', creds_data.get('installed', {}))
+    return client.get('client_id'), client.get('client_secret')
+
+
+def build_credentials(access_token: Optional[str], refresh_token: str,
+                      token_expiry: Optional[datetime] = None) -> Credentials:
+    """Credentials for stored tokens (not refreshed)"""
+    client_id, client_secret = load_client_secrets()
+    creds = Credentials(
+        token=access_token,
+        refresh_token=refresh_token,
+        token_uri=TOKEN_URI,
+        client_id=client_id,
+        client_secret=client_secret,
+        scopes=settings.GMAIL_SCOPES
+    )
+    if token_expiry:
+        creds.expiry = token_expiry
+    return creds
+
+
+class CredentialManager:
+    """Per-user Credentials cache with single-flight, ahead-of-expiry refresh"""
+
+    def __init__(self, refresh_margin: Optional[float] = None):
+        self.refresh_margin = timedelta(
+            seconds=settings.GMAIL_TOKEN_REFRESH_MARGIN_SECONDS if refresh_margin is None else refresh_margin
+        )
+        self._credentials: Dict[str, Credentials] = {}
+        self._last_used: Dict[str, float] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._running = False
+
+    async def get_credentials(self, user: User) -> Credentials:
+        """Valid credentials for a user; only waits on a refresh if the token already expired"""
+        user_id = str(user.id)
+        self._last_used[user_id] = time.monotonic()
+        creds = self._credentials.get(user_id)
+        if creds is None or creds.refresh_token != user.gmail_refresh_token:
+            creds = build_credentials(user.gmail_access_token, user.gmail_refresh_token, user.gmail_token_expiry)
+            self._credentials[user_id] = creds
+
+        if not creds.valid:
+            await self.refresh(user_id)
+        return creds
+
+    async def refresh(self, user_id: str) -> Credentials:
+        """Refresh a user's token, joining a refresh that is already in flight"""
+        self._last_used[user_id] = time.monotonic()
+        task = self._refreshing.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._refresh(user_id))
+            self._refreshing[user_id] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(user_id, None))
+        return await asyncio.shield(task)
+
+    def invalidate(self, user_id: str) -> None:
+        """Forget a user's credentials, and the pooled Gmail service holding them"""
+        self._credentials.pop(user_id, None)
+        self._last_used.pop(user_id, None)
+        # The pooled service keeps its Credentials object; rebuilding it keeps the
+        # service and this cache on the same one (a refresh updates it for both)
+        gmail_services.invalidate(user_id)
+
+    async def run(self) -> None:
+        """
+        Until stop() is called: evict idle entries and refresh the tokens of
+        users with active scans that are about to expire
+        """
+        self._running = True
+        while self._running:
+            await asyncio.sleep(settings.GMAIL_TOKEN_REFRESH_CHECK_SECONDS)
+            try:
+                active = set(await active_job_user_ids())
+            except Exception as e:
+                print(f"⚠️ Could not list active scans: {str(e)}")
+                continue
+            self._evict_idle(active)
+            expiring = [
+                uid for uid, creds in self._credentials.items()
+                if uid in active and self._expiring(creds)
+            ]
+            for user_id in expiring:
+                try:
+                    await self.refresh(user_id)
+                except Exception as e:
+                    print(f"⚠️ Background token refresh failed for user {user_id}: {str(e)}")
+
+    def stop(self) -> None:
+        self._running = False
+
+    def _evict_idle(self, active: Set[str]) -> None:
+        """Drop entries unused for GMAIL_CREDENTIAL_IDLE_SECONDS (kept while their user is scanning)"""
+        cutoff = time.monotonic() - settings.GMAIL_CREDENTIAL_IDLE_SECONDS
+        for user_id in [uid for uid, used in self._last_used.items() if used < cutoff]:
+            if user_id not in active and user_id not in self._refreshing:
+                self.invalidate(user_id)
+
+    def _expiring(self, creds: Credentials) -> bool:
+        if not creds.expiry:
+            return False
+        return creds.expiry - self.refresh_margin <= datetime.utcnow()
+
+    async def _refresh(self, user_id: str) -> Credentials:
+        creds = self._credentials.get(user_id)
+        if creds is None:
+            raise KeyError(f"No cached credentials for user {user_id}")
+        await asyncio.to_thread(creds.refresh, GoogleRequest())
+
+        # One write; skipped if the user has since logged in again with new tokens
+        await User.get_motor_collection().update_one(
+            {"_id": PydanticObjectId(user_id), "gmail_refresh_token": creds.refresh_token},
+            {"$set": {"gmail_access_token": creds.token, "gmail_token_expiry": creds.expiry}},
+        )
+        print(f"✅ Refreshed Gmail token for user {user_id}")
+        return creds
+
+
+credential_manager = CredentialManager()
@@ -22,6 +22,10 @@ class User(Document):
     gmail_refresh_token: Optional[str] = None
     gmail_token_expiry: Optional[datetime] = None
     gmail_scopes: Optional[list[str]] = None
+    # Last synced Gmail historyId (incremental scans via users.history.list)
+    gmail_history_id: Optional[str] = None
+    # IMAP accounts: {mailbox: {"uidvalidity": int, "last_uid": int}} synced so far
+    imap_sync_state: dict = Field(default_factory=dict)
 
     class Settings:
         name = "users"
@@ -39,6 +43,7 @@ class EmailConfig(Document):
 class Candidate(Document):
     unique_id: Indexed(str, unique=True)
     gmail_message_id: Indexed(str, unique=True)
+    gmail_thread_id: Optional[str] = None
 
     batch_id: Optional[str] = None
     recruiter_id: Optional[PydanticObjectId] = None  # User.id as string ObjectId
@@ -59,6 +64,7 @@ class Candidate(Document):
     resume_filename: Optional[str] = None
     resume_text: Optional[str] = None
     resume_path: Optional[str] = None
+    resume_sha256: Optional[str] = None
 
     # Store as raw dict, not JSON string
     cv_data: Optional[dict] = None
@@ -78,6 +84,51 @@ class Candidate(Document):
         name = "candidates"
 
 
+class ScanJobRecord(Document):
+    """A queued or running scan, claimed by workers through a time-limited lease"""
+    batch_id: Indexed(str, unique=True)
+    user_id: Optional[str] = None
+    recruiter_id: Optional[str] = None
+
+    # Scan request
+    search_query: Optional[str] = None
+    hours_back: Optional[int] = None
+    max_emails: Optional[int] = None
+    incremental: bool = False
+    thread_mode: bool = False  # Fetch whole conversations with threads.get
+    # Enqueued by the scan scheduler (claimed after user-triggered scans)
+    scheduled: bool = False
+    # "gmail" or "imap"; IMAP scans need the account's connection pool, which only
+    # the process the account logged in to has, so only that process claims them
+    provider: str = "gmail"
+    imap_account: Optional[str] = None
+
+    # Fixed on the first run so a resumed scan lists the same result set
+    query: Optional[str] = None
+    since_history_id: Optional[str] = None
+    new_history_id: Optional[str] = None
+    since_imap_state: Optional[dict] = None
+    new_imap_state: Optional[dict] = None
+
+    status: Indexed(str) = "queued"  # queued, running, complete, error
+    progress: dict = Field(default_factory=dict)
+    # Where listing resumes after a crash: {"source": "query" | "history", "page_token": ...,
+    # "progress": counters without the pages listed again}
+    checkpoint: Optional[dict] = None
+    dismissed: bool = False
+
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    attempts: int = 0
+
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Settings:
+        name = "scan_jobs"
+
+
 _motor_client: Optional[AsyncIOMotorClient] = None
 
 
@@ -92,7 +143,7 @@ async def init_db() -> None:
 
     await init_beanie(
         database=_motor_client[settings.MONGODB_DB_NAME],
-        document_models=[User, EmailConfig, Candidate],
+        document_models=[User, EmailConfig, Candidate, ScanJobRecord],
     )
 
 
@@ -0,0 +1,61 @@
+"""
+The interface a mailbox provider implements for scans
+
+The scan pipeline (scan_pipeline.py) reads every provider through the same
+few methods, so it holds no more than a page of message IDs plus the emails
+in its bounded queues, however large the mailbox:
+
+- iter_message_id_pages() streams the matching message IDs page by page.
+  Each page comes with the token that lists it again, which is what a scan
+  checkpoints and resumes from.
+- get_email_details_batch() loads headers, text bodies and the attachment
+  list of a page's messages when the fetch stage gets to them.
+- download_attachment() loads one attachment when the download stage picks
+  it (attachments are only listed by filename, size and attachmentId).
+
+Methods may be coroutines / async generators or blocking (the pipeline runs
+blocking ones in a worker thread, see utils.call_async and iterate_async).
+GmailService, AsyncGmailService, IMAPService and AsyncIMAPService implement
+it. The supports_* flags say which optional methods a source has, and the
+pipeline only calls those. Extras it uses when present: save_attachment()
+(stream to disk) and get_email_metadata_batch() (two-phase fetch).
+"""
+from typing import AsyncIterator, Awaitable, Dict, Iterator, List, Optional, Protocol, Tuple, Union
+
+# (page_token, message_ids) - page_token is the token that lists this page
+IdPage = Tuple[Optional[str], List[str]]
+
+
+class EmailSource(Protocol):
+    """A mailbox the scan pipeline can list, fetch and download from"""
+
+    # get_history_id() and iter_history_message_id_pages() (Gmail incremental scans)
+    supports_history: bool
+    # get_sync_state(), whose result iter_message_id_pages() takes as since_state (IMAP incremental scans)
+    supports_sync_state: bool
+    # iter_thread_id_pages() and get_threads_batch() (thread mode)
+    supports_threads: bool
+    # add_label() (processed label)
+    supports_labels: bool
+
+    def build_query(self, search_query: str = "", hours_back: Optional[int] = None) -> str:
+        """The provider's search query for a Gmail-syntax query and time filter"""
+        ...
+
+    def iter_message_id_pages(self, search_query: str = "", hours_back: Optional[int] = None,
+                              limit: Optional[int] = None, page_token: Optional[str] = None,
+                              since_state: Optional[Dict] = None) -> Union[Iterator[IdPage], AsyncIterator[IdPage]]:
+        """
+        Matching message IDs page by page, resuming at page_token; with
+        since_state (see supports_sync_state) only mail added since it
+        """
+        ...
+
+    def get_email_details_batch(self, msg_ids: List[str]) -> Union[List[Dict], Awaitable[List[Dict]]]:
+        """Email dicts ('id', 'subject', 'from', 'body', 'attachments', ...) for listed IDs"""
+        ...
+
+    def download_attachment(self, msg_id: str,
+                            attachment_id: str) -> Union[Optional[bytes], Awaitable[Optional[bytes]]]:
+        """One attachment's content by the attachmentId from its email dict"""
+        ...
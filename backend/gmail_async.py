@@ -0,0 +1,341 @@
+"""
+Async Gmail REST client
+
+Same method names as GmailService, implemented as coroutines on one pooled
+httpx.AsyncClient shared by every user, so fetches for many messages and
+accounts run concurrently on the event loop without thread hops. Message
+parsing is inherited from GmailService, so both return identical email dicts.
+"""
+import asyncio
+import base64
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+
+from attachment_store import AttachmentSink, AttachmentTooLargeError, JsonStringFieldReader
+from config import settings
+from gmail_service import (
+    BATCH_MODIFY_LIMIT, GMAIL_API_URL, METADATA_FIELDS, GmailService, HistoryExpiredError,
+)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """The process-wide keep-alive connection pool for Gmail API calls"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=GMAIL_API_URL,
+            http2=settings.GMAIL_HTTP2,
+            limits=httpx.Limits(
+                max_connections=settings.GMAIL_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.GMAIL_HTTP_MAX_CONNECTIONS,
+            ),
+            # Requests wait for a free pooled connection instead of failing
+            timeout=httpx.Timeout(settings.GMAIL_HTTP_TIMEOUT, pool=None),
+        )
+    return _client
+
+
+async def _iter_json_string_field(chunks: AsyncIterator[str], field: str) -> AsyncIterator[str]:
+    """JsonStringFieldReader over an async stream of response text"""
+    reader = JsonStringFieldReader(field)
+    async for text in chunks:
+        for piece in reader.feed(text):
+            yield piece
+        if reader.closed:
+            return
+    reader.finish()
+
+
+async def close_http_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+class AsyncGmailService(GmailService):
+    """GmailService whose API methods are coroutines on the shared async HTTP pool"""
+
+    def __init__(self, creds: Credentials, refresh: Optional[Callable[[], Awaitable[object]]] = None):
+        super().__init__()
+        self.creds = creds
+        # Refreshes self.creds in place (e.g. through the credential manager)
+        self._refresh = refresh
+        # At most this many requests in flight for this mailbox (Gmail limits concurrent requests per user)
+        self._semaphore = asyncio.Semaphore(settings.GMAIL_ASYNC_CONCURRENCY)
+        self._refresh_lock = asyncio.Lock()
+
+    async def _auth_header(self) -> Dict[str, str]:
+        if not self.creds.valid:
+            async with self._refresh_lock:
+                if not self.creds.valid:
+                    if self._refresh:
+                        await self._refresh()
+                    else:
+                        await asyncio.to_thread(self.creds.refresh, Request())
+        return {"Authorization": f"Bearer {self.creds.token}"}
+
+    async def _get(self, method: str, path: str, **params) -> Dict:
+        """GET a Gmail API path within the mailbox's quota, retrying throttled calls"""
+        params = {k: v for k, v in params.items() if v is not None}
+        return await self._request(method, "GET", path, params=params)
+
+    async def _post(self, method: str, path: str, body: Dict) -> Dict:
+        return await self._request(method, "POST", path, json=body)
+
+    async def _request(self, method: str, http_method: str, path: str, **kwargs) -> Dict:
+        async def request() -> Dict:
+            async with self._semaphore:
+                response = await get_http_client().request(
+                    http_method, path, headers=await self._auth_header(), **kwargs
+                )
+            response.raise_for_status()
+            # batchModify answers with an empty body
+            return response.json() if response.content else {}
+
+        return await self.limiter.call(method, request)
+
+    async def get_user_profile(self) -> Dict:
+        """Get Gmail user profile information"""
+        try:
+            profile = await self._get("getProfile", "/profile")
+            return {
+                'emailAddress': profile.get('emailAddress', ''),
+                'messagesTotal': profile.get('messagesTotal', 0),
+                'threadsTotal': profile.get('threadsTotal', 0)
+            }
+        except Exception as e:
+            print(f"Error getting user profile: {str(e)}")
+            return {'emailAddress': 'unknown@example.com'}
+
+    async def get_history_id(self) -> str:
+        profile = await self._get("getProfile", "/profile")
+        return str(profile['historyId'])
+
+    def iter_message_id_pages(self, search_query: str = "", hours_back: Optional[int] = None,
+                              limit: Optional[int] = None, page_token: Optional[str] = None,
+                              since_state: Optional[Dict] = None) -> AsyncIterator[Tuple[Optional[str], List[str]]]:
+        """Async version of GmailService.iter_message_id_pages"""
+        return self._iter_id_pages("messages", search_query, hours_back, limit, page_token)
+
+    def iter_thread_id_pages(self, search_query: str = "", hours_back: Optional[int] = None,
+                             limit: Optional[int] = None,
+                             page_token: Optional[str] = None) -> AsyncIterator[Tuple[Optional[str], List[str]]]:
+        """Async version of GmailService.iter_thread_id_pages"""
+        return self._iter_id_pages("threads", search_query, hours_back, limit, page_token)
+
+    async def _iter_id_pages(self, kind: str, search_query: str, hours_back: Optional[int],
+                             limit: Optional[int], page_token: Optional[str]) -> AsyncIterator[Tuple[Optional[str], List[str]]]:
+        query = self._with_time_filter(search_query or "", hours_back)
+        print(f"🔍 Gmail Query: '{query or 'ALL EMAILS'}'")
+
+        listed = 0
+        while True:
+            page_size = 500 if limit is None else min(500, limit - listed)
+            results = await self._get(
+                f"{kind}.list",
+                f"/{kind}",
+                q=query or None,
+                maxResults=page_size,
+                pageToken=page_token,
+            )
+
+            ids = [item['id'] for item in results.get(kind, [])]
+            if limit is not None:
+                ids = ids[:limit - listed]
+            listed += len(ids)
+            if ids:
+                print(f"📬 Listed {listed} {'conversations' if kind == 'threads' else 'emails'} (estimate: {results.get('resultSizeEstimate', 0)})")
+                yield page_token, ids
+
+            page_token = results.get('nextPageToken')
+            if not page_token or (limit is not None and listed >= limit):
+                return
+
+    async def estimate_result_size(self, query: str) -> int:
+        """Gmail's resultSizeEstimate for a final search query (one cheap list call)"""
+        results = await self._get("messages.list", "/messages", q=query or None, maxResults=1)
+        return int(results.get('resultSizeEstimate', 0))
+
+    async def iter_history_message_id_pages(self, start_history_id: str, label_id: Optional[str] = None,
+                                            limit: Optional[int] = None,
+                                            page_token: Optional[str] = None) -> AsyncIterator[Tuple[Optional[str], List[str]]]:
+        """Async version of GmailService.iter_history_message_id_pages"""
+        print(f"🔍 Gmail history since {start_history_id} (label: {label_id or 'ALL'})")
+
+        # Leave out mail a previous scan already labelled as processed
+        processed_label = None
+        if settings.GMAIL_PROCESSED_LABEL_ENABLED:
+            processed_label = await self.get_or_create_label_id(settings.GMAIL_PROCESSED_LABEL)
+
+        seen = set()
+        listed = 0
+        while True:
+            try:
+                results = await self._get(
+                    "history.list",
+                    "/history",
+                    startHistoryId=start_history_id,
+                    historyTypes="messageAdded",
+                    labelId=label_id,
+                    maxResults=500,
+                    pageToken=page_token,
+                )
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code == 404:
+                    raise HistoryExpiredError(f"historyId {start_history_id} is no longer available")
+                raise
+
+            message_ids = []
+            for record in results.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    msg_id = added['message']['id']
+                    if processed_label in added['message'].get('labelIds', []):
+                        continue
+                    if msg_id not in seen:
+                        seen.add(msg_id)
+                        message_ids.append(msg_id)
+
+            if limit is not None:
+                message_ids = message_ids[:limit - listed]
+            listed += len(message_ids)
+            if message_ids:
+                print(f"📬 {listed} new emails since last sync")
+                yield page_token, message_ids
+
+            page_token = results.get('nextPageToken')
+            if not page_token or (limit is not None and listed >= limit):
+                return
+
+    async def get_emails(self, search_query: str = "", hours_back: Optional[int] = None,
+                         max_results: Optional[int] = None) -> List[Dict]:
+        try:
+            emails = []
+            query = self.build_query(search_query, hours_back)
+            async for _, page in self.iter_message_id_pages(query, None, max_results):
+                emails.extend(await self.get_email_details_batch(page))
+            return emails
+        except Exception as e:
+            print(f"Error fetching emails: {str(e)}")
+            return []
+
+    async def get_email_details(self, msg_id: str) -> Optional[Dict]:
+        """Get full email details including attachments, CC, and signature"""
+        try:
+            message = await self._get("messages.get", f"/messages/{msg_id}", format="full")
+            return self._parse_message(message)
+        except Exception as e:
+            print(f"Error getting email details: {str(e)}")
+            return None
+
+    async def get_email_details_batch(self, msg_ids: List[str]) -> List[Dict]:
+        """
+        Get full email details for many messages concurrently
+
+        Requests are multiplexed over the pooled connections (bounded by
+        GMAIL_ASYNC_CONCURRENCY) instead of a multipart batch request.
+        Messages that fail are left out.
+        """
+        emails = await asyncio.gather(*(self.get_email_details(msg_id) for msg_id in msg_ids))
+        return [email_data for email_data in emails if email_data]
+
+    async def get_threads_batch(self, thread_ids: List[str]) -> List[Dict]:
+        """Whole conversations via concurrent threads.get calls; {'id', 'messages'} per thread"""
+        async def get_thread(thread_id: str) -> Optional[Dict]:
+            try:
+                thread = await self._get("threads.get", f"/threads/{thread_id}", format="full")
+                return self._parse_thread(thread)
+            except Exception as e:
+                print(f"Error getting thread: {str(e)}")
+                return None
+
+        threads = await asyncio.gather(*(get_thread(thread_id) for thread_id in thread_ids))
+        return [thread for thread in threads if thread]
+
+    async def get_email_metadata_batch(self, msg_ids: List[str]) -> List[Dict]:
+        """Subject, sender and attachment names for many messages, without bodies"""
+        async def get_metadata(msg_id: str) -> Optional[Dict]:
+            try:
+                message = await self._get("messages.get", f"/messages/{msg_id}", format="full", fields=METADATA_FIELDS)
+                return self._parse_metadata(message)
+            except Exception as e:
+                print(f"Error getting email metadata: {str(e)}")
+                return None
+
+        metadata = await asyncio.gather(*(get_metadata(msg_id) for msg_id in msg_ids))
+        return [m for m in metadata if m]
+
+    async def download_attachment(self, msg_id: str, attachment_id: str) -> Optional[bytes]:
+        """Download attachment from email"""
+        try:
+            attachment = await self._get("messages.attachments.get", f"/messages/{msg_id}/attachments/{attachment_id}")
+            return base64.urlsafe_b64decode(attachment['data'])
+        except Exception as e:
+            print(f"Error downloading attachment: {str(e)}")
+            return None
+
+    async def save_attachment(self, msg_id: str, attachment_id: str, dest_path: str,
+                              max_bytes: Optional[int] = None) -> Optional[Dict]:
+        """
+        Stream an attachment straight to dest_path
+
+        The base64 body is decoded in chunks into a temp file as it arrives
+        (file work runs in threads), then renamed into place. Returns
+        {'path', 'size', 'sha256'}, or None on failure or if the attachment is
+        larger than max_bytes (ATTACHMENT_MAX_BYTES by default).
+        """
+        async def download() -> Dict:
+            sink = await asyncio.to_thread(AttachmentSink, dest_path, max_bytes)
+            try:
+                async with self._semaphore:
+                    headers = await self._auth_header()
+                    async with get_http_client().stream(
+                        "GET", f"/messages/{msg_id}/attachments/{attachment_id}", headers=headers
+                    ) as response:
+                        if response.is_error:
+                            await response.aread()  # Error body tells the limiter whether to retry
+                        response.raise_for_status()
+                        async for chunk in _iter_json_string_field(response.aiter_text(), "data"):
+                            await asyncio.to_thread(sink.write_base64, chunk)
+                return await asyncio.to_thread(sink.commit)
+            except BaseException:
+                await asyncio.to_thread(sink.discard)
+                raise
+
+        try:
+            return await self.limiter.call("messages.attachments.get", download)
+        except AttachmentTooLargeError as e:
+            print(f"⚠️ Skipping attachment: {str(e)}")
+        except Exception as e:
+            print(f"Error downloading attachment: {str(e)}")
+        return None
+
+    async def get_or_create_label_id(self, label_name: str) -> str:
+        """ID of a user label, creating the label if it does not exist yet"""
+        if label_name in self._label_ids:
+            return self._label_ids[label_name]
+
+        labels = await self._get("labels.list", "/labels")
+        label_id = next((l['id'] for l in labels.get('labels', []) if l['name'] == label_name), None)
+        if label_id is None:
+            label = await self._post("labels.create", "/labels", {
+                'name': label_name, 'labelListVisibility': 'labelShow', 'messageListVisibility': 'show'
+            })
+            label_id = label['id']
+            print(f"🏷️  Created Gmail label {label_name}")
+
+        self._label_ids[label_name] = label_id
+        return label_id
+
+    async def add_label(self, msg_ids: List[str], label_name: str) -> None:
+        """Apply a label to many messages with messages.batchModify"""
+        label_id = await self.get_or_create_label_id(label_name)
+        for start in range(0, len(msg_ids), BATCH_MODIFY_LIMIT):
+            await self._post("messages.batchModify", "/messages/batchModify", {
+                'ids': msg_ids[start:start + BATCH_MODIFY_LIMIT], 'addLabelIds': [label_id]
+            })
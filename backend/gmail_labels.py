@@ -0,0 +1,48 @@
+"""
+Processed-label marking for Gmail scans
+
+With GMAIL_PROCESSED_LABEL_ENABLED, messages a scan has ingested (or found
+already ingested) get GMAIL_PROCESSED_LABEL, and scan queries exclude that
+label, so later scans only list unprocessed mail - even after the
+candidates collection is wiped or on a fresh deployment.
+"""
+import asyncio
+from typing import Iterable, List, Optional
+
+from config import settings
+from utils import call_async
+
+
+class ProcessedLabeler:
+    """Collects processed message IDs and labels them with batched messages.batchModify"""
+
+    def __init__(self, email_service, label_name: Optional[str] = None, batch_size: int = 500):
+        self.email_service = email_service
+        self.label_name = label_name or settings.GMAIL_PROCESSED_LABEL
+        self.batch_size = batch_size
+        self.labelled = 0
+        self._pending: List[str] = []
+        self._lock = asyncio.Lock()
+        self._disabled = False
+
+    async def add(self, msg_ids: Iterable[str]) -> None:
+        self._pending.extend(msg_ids)
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            msg_ids, self._pending = self._pending, []
+            if not msg_ids or self._disabled:
+                return
+            try:
+                await call_async(self.email_service.add_label, msg_ids, self.label_name)
+                self.labelled += len(msg_ids)
+                print(f"🏷️  Labelled {len(msg_ids)} emails {self.label_name}")
+            except Exception as e:
+                # Typically a token without the gmail.modify scope - stop trying for this scan
+                self._disabled = True
+                print(f"⚠️ Could not apply label {self.label_name}: {str(e)}")
+
+    async def close(self) -> None:
+        await self.flush()
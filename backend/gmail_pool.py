@@ -0,0 +1,50 @@
+"""
+Per-user Gmail service pool
+
+Keeps the most recently used per-user GmailService instances (with their
+credentials, HTTP transport and per-mailbox request limits) so repeated scans
+of the same account skip setting them up again. An entry is rebuilt when the
+user's refresh token changes, i.e. after they log in again.
+"""
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from config import settings
+from gmail_service import GmailService
+
+
+class GmailServicePool:
+    """LRU cache of GmailService instances keyed by user id"""
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = max(1, max_size or settings.GMAIL_SERVICE_POOL_SIZE)
+        # user id -> (refresh token, service)
+        self._services: "OrderedDict[str, Tuple[str, GmailService]]" = OrderedDict()
+
+    def get(self, user_id: str, refresh_token: str, factory: Callable[[], GmailService]) -> GmailService:
+        """The pooled service for a user, created with `factory` if missing or stale"""
+        entry = self._services.get(user_id)
+        if entry and entry[0] == refresh_token:
+            self._services.move_to_end(user_id)
+            return entry[1]
+
+        service = factory()
+        self._services[user_id] = (refresh_token, service)
+        self._services.move_to_end(user_id)
+        while len(self._services) > self.max_size:
+            self._services.popitem(last=False)
+        return service
+
+    def peek(self, user_id: str) -> Optional[GmailService]:
+        """The pooled service for a user, if any (without touching LRU order)"""
+        entry = self._services.get(user_id)
+        return entry[1] if entry else None
+
+    def invalidate(self, user_id: str) -> None:
+        self._services.pop(user_id, None)
+
+    def stats(self) -> Dict:
+        return {"size": len(self._services), "max_size": self.max_size}
+
+
+gmail_services = GmailServicePool()
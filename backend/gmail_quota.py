@@ -0,0 +1,184 @@
+"""
+Gmail quota-aware rate limiting and retries
+
+Gmail charges each method a number of quota units and allows about 250 units
+per second per user. QuotaLimiter spends units from a token bucket before
+every call, so a mailbox's requests are spread out instead of tripping the
+limit. Calls that still fail with 429, 403 rateLimitExceeded or a 5xx are
+retried with exponential backoff and full jitter. It works from both threads
+(sync client) and coroutines (async client).
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import settings
+
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    "getProfile": 1,
+    "messages.list": 5,
+    "messages.get": 5,
+    "messages.attachments.get": 5,
+    "messages.batchModify": 50,
+    "history.list": 2,
+    "threads.get": 10,
+    "threads.list": 10,
+    "labels.list": 1,
+    "labels.create": 5,
+}
+
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+
+class TokenBucket:
+    """Thread-safe token bucket; reservations may go negative and are paid back by waiting"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, units: float) -> float:
+        """Take `units` and return how many seconds the caller must wait before using them"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= units
+            return max(0.0, -self._tokens / self.rate)
+
+
+def is_retryable(status: int, reason: Optional[str] = None) -> bool:
+    if status == 429 or status >= 500:
+        return True
+    return status == 403 and reason in RATE_LIMIT_REASONS
+
+
+def error_reason(content: Any) -> Optional[str]:
+    """The `reason` of a Gmail JSON error body"""
+    try:
+        if isinstance(content, bytes):
+            content = content.decode("utf-8")
+        if isinstance(content, str):
+            content = json.loads(content)
+        return content["error"]["errors"][0]["reason"]
+    except Exception:
+        return None
+
+
+class QuotaLimiter:
+    """Per-user Gmail quota budget with retry/backoff for throttled or failed calls"""
+
+    def __init__(self, units_per_second: Optional[float] = None, max_retries: Optional[int] = None):
+        rate = units_per_second or settings.GMAIL_QUOTA_UNITS_PER_SECOND
+        self.bucket = TokenBucket(rate, capacity=rate)
+        self.max_retries = settings.GMAIL_MAX_RETRIES if max_retries is None else max_retries
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, float] = {
+            "calls": 0,
+            "units": 0,
+            "throttled_seconds": 0.0,
+            "retries": 0,
+            "rate_limited": 0,
+            "server_errors": 0,
+            "failures": 0,
+        }
+        self._calls_by_method: Dict[str, int] = {}
+
+    def execute(self, method: str, call: Callable[[], Any]) -> Any:
+        """Run a blocking Gmail call within the quota, retrying retryable errors"""
+        attempt = 0
+        while True:
+            time.sleep(self._reserve(method))
+            try:
+                return call()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    async def call(self, method: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Await a Gmail call within the quota, retrying retryable errors"""
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._reserve(method))
+            try:
+                return await call()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def reserve_batch(self, method: str, count: int) -> float:
+        """Reserve units for `count` calls sent in one batch request; returns the wait"""
+        return self._reserve(method, count)
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["calls_by_method"] = dict(self._calls_by_method)
+        stats["units_per_second"] = self.bucket.rate
+        stats["throttled_seconds"] = round(stats["throttled_seconds"], 3)
+        return stats
+
+    def _reserve(self, method: str, count: int = 1) -> float:
+        units = QUOTA_UNITS.get(method, 5) * count
+        wait = self.bucket.reserve(units)
+        with self._stats_lock:
+            self._stats["calls"] += count
+            self._stats["units"] += units
+            self._stats["throttled_seconds"] += wait
+            self._calls_by_method[method] = self._calls_by_method.get(method, 0) + count
+        return wait
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying `error`, or None if it should be raised"""
+        status, reason, retry_after = _describe_error(error)
+        retryable = status is not None and is_retryable(status, reason)
+        with self._stats_lock:
+            if status == 429 or reason in RATE_LIMIT_REASONS:
+                self._stats["rate_limited"] += 1
+            elif status is not None and status >= 500:
+                self._stats["server_errors"] += 1
+            if not retryable or attempt >= self.max_retries:
+                self._stats["failures"] += 1
+                return None
+            self._stats["retries"] += 1
+
+        # Exponential backoff with full jitter, at least what the server asked for
+        backoff = min(settings.GMAIL_BACKOFF_MAX_SECONDS, settings.GMAIL_BACKOFF_BASE_SECONDS * 2 ** attempt)
+        delay = random.uniform(0, backoff)
+        if retry_after:
+            delay = max(delay, retry_after)
+        print(f"⏳ Gmail {status} ({reason or 'error'}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        return delay
+
+
+def _describe_error(error: Exception):
+    """(status, reason, retry_after) for googleapiclient and httpx errors"""
+    response = getattr(error, "response", None)  # httpx.HTTPStatusError
+    if response is not None and hasattr(response, "status_code"):
+        return response.status_code, error_reason(response.content), _retry_after(response.headers.get("retry-after"))
+
+    resp = getattr(error, "resp", None)  # googleapiclient HttpError
+    if resp is not None and hasattr(resp, "status"):
+        return int(resp.status), error_reason(getattr(error, "content", None)), _retry_after(resp.get("retry-after"))
+
+    return None, None, None
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
@@ -1,20 +1,102 @@
 import os
 import base64
 import email
+import functools
+import json
 import re
-from typing import List, Dict, Optional
+import threading
+import time
+from typing import Iterator, List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
-from google.auth.transport.requests import Request
+from google.auth.transport.requests import AuthorizedSession, Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+from google_auth_httplib2 import AuthorizedHttp
 from config import settings
+from attachment_store import AttachmentSink, AttachmentTooLargeError, iter_json_string_field
+from gmail_quota import QuotaLimiter
+import codecs
+import httplib2
 import io
 
+GMAIL_API_URL = "https://gmail.googleapis.com/gmail/v1/users/me"
+
+# Partial response for the metadata phase: headers and the part tree
+# (filenames, MIME types, sizes) without any body data
+METADATA_FIELDS = (
+    'id,threadId,payload(mimeType,filename,headers,body/size,'
+    'parts(mimeType,filename,body/size,parts(mimeType,filename,body/size,'
+    'parts(mimeType,filename,body/size))))'
+)
+
+
+# messages.batchModify accepts up to 1000 message IDs
+BATCH_MODIFY_LIMIT = 1000
+
+
+def label_search_name(label_name: str) -> str:
+    """How a label is written in a Gmail search (`CRM/Processed` -> `crm-processed`)"""
+    return re.sub(r'[\s/]+', '-', label_name.strip()).lower()
+
+
+class HistoryExpiredError(Exception):
+    """The stored historyId is too old for users.history.list - a full sync is needed"""
+
+
+@functools.lru_cache(maxsize=1)
+def _gmail_discovery_document() -> Optional[Dict]:
+    """The Gmail v1 discovery document, read and parsed once per process"""
+    document = get_static_doc('gmail', 'v1')
+    return json.loads(document) if document else None
+
+
+def build_gmail_service(creds):
+    """Build a Gmail API resource from the cached discovery document"""
+    document = _gmail_discovery_document()
+    if document is None:
+        return build('gmail', 'v1', credentials=creds)
+    return build_from_document(document, credentials=creds)
+
+
 class GmailService:
+    # EmailSource capabilities
+    supports_history = True
+    supports_sync_state = False
+    supports_threads = True
+    supports_labels = True
+    
     def __init__(self):
         self.creds = None
         self.service = None
+        # httplib2 connections are not thread-safe - one transport per worker thread
+        self._local = threading.local()
+        # Gmail quota budget and retries for this mailbox
+        self.limiter = QuotaLimiter()
+        # Label name -> id
+        self._label_ids: Dict[str, str] = {}
+    
+    def _http(self) -> AuthorizedHttp:
+        """Get the authorized HTTP transport for the calling thread"""
+        http = getattr(self._local, 'http', None)
+        if http is None or http.credentials is not self.creds:
+            http = AuthorizedHttp(self.creds, http=httplib2.Http())
+            self._local.http = http
+        return http
+    
+    def _session(self) -> AuthorizedSession:
+        """Get the authorized requests session for the calling thread (streamed downloads)"""
+        session = getattr(self._local, 'session', None)
+        if session is None or session.credentials is not self.creds:
+            session = AuthorizedSession(self.creds)
+            self._local.session = session
+        return session
+    
+    def _execute(self, method: str, request):
+        """Execute an API request within the mailbox's quota, retrying throttled calls"""
+        return self.limiter.execute(method, lambda: request.execute(http=self._http()))
         
     def authenticate(self):
         """Authenticate with Gmail API - uses existing token or fails gracefully"""
@@ -89,7 +171,7 @@ class GmailService:
                     token.write(self.creds.to_json())
                 token.write(self.creds.to_json())
         
-        self.service = build('gmail', 'v1', credentials=self.creds)
+        self.service = build_gmail_service(self.creds)
         return True
     
     def get_user_profile(self) -> Dict:
@@ -108,41 +190,168 @@ class GmailService:
             print(f"Error getting user profile: {str(e)}")
             return {'emailAddress': 'unknown@example.com'}
     
-    def get_emails(self, search_query: str = "", hours_back: Optional[int] = None) -> List[Dict]:
-        """Get emails based on custom search query - incoming emails from all folders"""
+    def build_query(self, search_query: str = "", hours_back: Optional[int] = None) -> str:
+        """Build Gmail search query with optional time filter"""
+        # Search all emails, not just inbox (to catch Promotions, Updates, etc)
+        query = search_query or ""
+        
+        # Add time filter if specified
+        query = self._with_time_filter(query, hours_back)
+        
+        # Leave out mail a previous scan already labelled as processed
+        if settings.GMAIL_PROCESSED_LABEL_ENABLED:
+            query = f'{query} -label:{label_search_name(settings.GMAIL_PROCESSED_LABEL)}'.strip()
+        
+        return query
+    
+    @staticmethod
+    def _with_time_filter(query: str, hours_back: Optional[int]) -> str:
+        if hours_back is None:
+            return query
+        after_date = datetime.now() - timedelta(hours=hours_back)
+        return f'{query} after:{int(after_date.timestamp())}'.strip()
+    
+    def iter_message_id_pages(self, search_query: str = "", hours_back: Optional[int] = None,
+                              limit: Optional[int] = None, page_token: Optional[str] = None,
+                              since_state: Optional[Dict] = None) -> Iterator[Tuple[Optional[str], List[str]]]:
+        """
+        Yield (page_token, message_ids) pages, following nextPageToken through the whole result set
+        
+        search_query is a final Gmail query (see build_query) and is sent as
+        is; hours_back only adds an after: filter to it. page_token is the
+        token that fetched the page (None for the first), so a listing can be
+        resumed from any page by passing it back in. since_state is not used
+        (Gmail scans incrementally through iter_history_message_id_pages).
+        """
+        return self._iter_id_pages('messages', search_query, hours_back, limit, page_token)
+    
+    def iter_thread_id_pages(self, search_query: str = "", hours_back: Optional[int] = None,
+                             limit: Optional[int] = None,
+                             page_token: Optional[str] = None) -> Iterator[Tuple[Optional[str], List[str]]]:
+        """Like iter_message_id_pages, for the IDs of matching conversations (threads)"""
+        return self._iter_id_pages('threads', search_query, hours_back, limit, page_token)
+    
+    def _iter_id_pages(self, kind: str, search_query: str, hours_back: Optional[int],
+                       limit: Optional[int], page_token: Optional[str]) -> Iterator[Tuple[Optional[str], List[str]]]:
         if not self.service:
             self.authenticate()
         
-        # Build query - search all emails, not just inbox (to catch Promotions, Updates, etc)
-        query = ""
-        if search_query:
-            query = search_query
-        
-        # Add time filter if specified
-        if hours_back is not None:
-            after_date = datetime.now() - timedelta(hours=hours_back)
-            after_timestamp = int(after_date.timestamp())
-            query = f'{query} after:{after_timestamp}'.strip()
+        query = self._with_time_filter(search_query or "", hours_back)
+        print(f"🔍 Gmail Query: '{query or 'ALL EMAILS'}'")
         
-        try:
-            print(f"🔍 Gmail Query: '{query or 'ALL EMAILS'}'")
-            results = self.service.users().messages().list(
+        resource = self.service.users().threads() if kind == 'threads' else self.service.users().messages()
+        listed = 0
+        while True:
+            page_size = 500 if limit is None else min(500, limit - listed)
+            results = self._execute(f'{kind}.list', resource.list(
                 userId='me',
                 q=query if query else None,
-                maxResults=500
-            ).execute()
+                maxResults=page_size,
+                pageToken=page_token
+            ))
+            
+            ids = [item['id'] for item in results.get(kind, [])]
+            if limit is not None:
+                ids = ids[:limit - listed]
+            listed += len(ids)
+            if ids:
+                print(f"📬 Listed {listed} {'conversations' if kind == 'threads' else 'emails'} (estimate: {results.get('resultSizeEstimate', 0)})")
+                yield page_token, ids
+            
+            page_token = results.get('nextPageToken')
+            if not page_token or (limit is not None and listed >= limit):
+                return
+    
+    def estimate_result_size(self, query: str) -> int:
+        """Gmail's resultSizeEstimate for a final search query (one cheap list call)"""
+        if not self.service:
+            self.authenticate()
+        
+        results = self._execute('messages.list', self.service.users().messages().list(
+            userId='me',
+            q=query or None,
+            maxResults=1
+        ))
+        return int(results.get('resultSizeEstimate', 0))
+    
+    def iter_emails(self, search_query: str = "", hours_back: Optional[int] = None,
+                    limit: Optional[int] = None) -> Iterator[Dict]:
+        """Yield emails lazily, one Gmail batch request at a time"""
+        batch_size = max(1, min(settings.GMAIL_BATCH_SIZE, 100))
+        query = self.build_query(search_query, hours_back)
+        for _, page in self.iter_message_id_pages(query, None, limit):
+            for start in range(0, len(page), batch_size):
+                yield from self.get_email_details_batch(page[start:start + batch_size])
+    
+    def get_history_id(self) -> str:
+        """Get the mailbox's current historyId (the starting point for the next incremental sync)"""
+        if not self.service:
+            self.authenticate()
+        
+        profile = self._execute('getProfile', self.service.users().getProfile(userId='me'))
+        return str(profile['historyId'])
+    
+    def iter_history_message_id_pages(self, start_history_id: str, label_id: Optional[str] = None,
+                                      limit: Optional[int] = None,
+                                      page_token: Optional[str] = None) -> Iterator[Tuple[Optional[str], List[str]]]:
+        """
+        Yield (page_token, message_ids) pages of messages added since start_history_id
+        
+        Raises HistoryExpiredError if Gmail no longer has history that far back.
+        """
+        if not self.service:
+            self.authenticate()
+        
+        print(f"🔍 Gmail history since {start_history_id} (label: {label_id or 'ALL'})")
+        
+        # Leave out mail a previous scan already labelled as processed
+        processed_label = None
+        if settings.GMAIL_PROCESSED_LABEL_ENABLED:
+            processed_label = self.get_or_create_label_id(settings.GMAIL_PROCESSED_LABEL)
+        
+        seen = set()
+        listed = 0
+        while True:
+            try:
+                results = self._execute('history.list', self.service.users().history().list(
+                    userId='me',
+                    startHistoryId=start_history_id,
+                    historyTypes=['messageAdded'],
+                    labelId=label_id,
+                    maxResults=500,
+                    pageToken=page_token
+                ))
+            except HttpError as e:
+                if e.resp.status == 404:
+                    raise HistoryExpiredError(f"historyId {start_history_id} is no longer available")
+                raise
             
-            messages = results.get('messages', [])
-            print(f"📬 Found {len(messages)} emails")
-            emails = []
+            message_ids = []
+            for record in results.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    msg_id = added['message']['id']
+                    if processed_label in added['message'].get('labelIds', []):
+                        continue
+                    if msg_id not in seen:
+                        seen.add(msg_id)
+                        message_ids.append(msg_id)
             
-            for i, msg in enumerate(messages):
-                print(f"   Loading email {i+1}/{len(messages)}...")
-                email_data = self.get_email_details(msg['id'])
-                if email_data:
-                    emails.append(email_data)
+            if limit is not None:
+                message_ids = message_ids[:limit - listed]
+            listed += len(message_ids)
+            if message_ids:
+                print(f"📬 {listed} new emails since last sync")
+                yield page_token, message_ids
             
-            return emails
+            page_token = results.get('nextPageToken')
+            if not page_token or (limit is not None and listed >= limit):
+                return
+    
+    def get_emails(self, search_query: str = "", hours_back: Optional[int] = None,
+                   max_results: Optional[int] = None) -> List[Dict]:
+        """Get emails based on custom search query - incoming emails from all folders"""
+        try:
+            return list(self.iter_emails(search_query, hours_back, max_results))
         
         except Exception as e:
             print(f"Error fetching emails: {str(e)}")
@@ -156,46 +365,157 @@ class GmailService:
     
     def get_email_details(self, msg_id: str) -> Optional[Dict]:
         """Get full email details including attachments, CC, and signature"""
+        return self._get_one(msg_id, 'messages.get', self._message_request(format='full'), self._parse_message)
+    
+    def get_email_details_batch(self, msg_ids: List[str]) -> List[Dict]:
+        """
+        Get full email details for many messages using Gmail batch requests
+        
+        Sends up to GMAIL_BATCH_SIZE (max 100) messages.get calls per HTTP round trip.
+        Messages that fail inside a batch are retried one by one; messages that
+        still fail are left out. Returns dicts in the same shape as get_email_details.
+        """
+        return self._get_batch(msg_ids, 'messages.get', self._message_request(format='full'), self._parse_message)
+    
+    def get_email_metadata_batch(self, msg_ids: List[str]) -> List[Dict]:
+        """
+        Get subject, sender and attachment names for many messages, without bodies
+        
+        The cheap first phase of a two-phase fetch: a partial response
+        (METADATA_FIELDS) leaves out all body and attachment data.
+        """
+        request = self._message_request(format='full', fields=METADATA_FIELDS)
+        return self._get_batch(msg_ids, 'messages.get', request, self._parse_metadata)
+    
+    def get_threads_batch(self, thread_ids: List[str]) -> List[Dict]:
+        """
+        Get whole conversations with threads.get, batched like get_email_details_batch
+        
+        Returns {'id': thread_id, 'messages': [email dicts]} per thread.
+        """
+        def request(thread_id):
+            return self.service.users().threads().get(userId='me', id=thread_id, format='full')
+        return self._get_batch(thread_ids, 'threads.get', request, self._parse_thread)
+    
+    def _message_request(self, **params):
+        return lambda msg_id: self.service.users().messages().get(userId='me', id=msg_id, **params)
+    
+    def _get_one(self, item_id: str, method: str, request, parse) -> Optional[Dict]:
         try:
-            message = self.service.users().messages().get(
-                userId='me',
-                id=msg_id,
-                format='full'
-            ).execute()
-            
-            headers = message['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), '')
-            from_email = next((h['value'] for h in headers if h['name'].lower() == 'from'), '')
-            to_email = next((h['value'] for h in headers if h['name'].lower() == 'to'), '')
-            cc_email = next((h['value'] for h in headers if h['name'].lower() == 'cc'), '')
-            date_str = next((h['value'] for h in headers if h['name'].lower() == 'date'), '')
-            
-            # Parse email body (both plain text and HTML)
-            body_plain, body_html = self._get_body_full(message['payload'])
-            
-            # Extract signature from email body
-            signature = self._extract_signature(body_plain)
-            
-            # Get attachments
-            attachments = self._get_attachments(message['payload'], msg_id)
-            
-            return {
-                'id': msg_id,
-                'subject': subject,
-                'from': from_email,
-                'to': to_email,
-                'cc': cc_email,
-                'date': date_str,
-                'body': body_plain,
-                'body_html': body_html,
-                'signature': signature,
-                'attachments': attachments
-            }
+            return parse(self._execute(method, request(item_id)))
         
         except Exception as e:
             print(f"Error getting email details: {str(e)}")
             return None
     
+    def _get_batch(self, ids: List[str], method: str, request, parse) -> List[Dict]:
+        if not self.service:
+            self.authenticate()
+        
+        batch_size = max(1, min(settings.GMAIL_BATCH_SIZE, 100))
+        results: Dict[str, Dict] = {}
+        failed: List[str] = []
+        
+        def callback(request_id, response, exception):
+            if exception is not None:
+                print(f"   ⚠️ Batch fetch failed for {request_id}: {exception}")
+                failed.append(request_id)
+                return
+            try:
+                results[request_id] = parse(response)
+            except Exception as e:
+                print(f"   ⚠️ Could not parse email {request_id}: {str(e)}")
+                failed.append(request_id)
+        
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            batch = self.service.new_batch_http_request(callback=callback)
+            for item_id in chunk:
+                batch.add(request(item_id), request_id=item_id)
+            
+            # Every call in a batch is charged separately
+            time.sleep(self.limiter.reserve_batch(method, len(chunk)))
+            try:
+                batch.execute(http=self._http())
+            except Exception as e:
+                print(f"Error executing batch request: {str(e)}")
+                failed.extend(i for i in chunk if i not in results and i not in failed)
+        
+        # Retry per-item failures individually
+        for item_id in failed:
+            data = self._get_one(item_id, method, request, parse)
+            if data:
+                results[item_id] = data
+        
+        return [results[item_id] for item_id in ids if item_id in results]
+    
+    def _parse_thread(self, thread: Dict) -> Dict:
+        return {
+            'id': thread['id'],
+            'messages': [self._parse_message(message) for message in thread.get('messages', [])]
+        }
+    
+    def _parse_metadata(self, message: Dict) -> Dict:
+        """Convert a METADATA_FIELDS response into a lightweight email dict"""
+        payload = message.get('payload', {})
+        headers = payload.get('headers', [])
+        subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), '')
+        from_email = next((h['value'] for h in headers if h['name'].lower() == 'from'), '')
+        
+        attachments = []
+        
+        def process_parts(part):
+            if part.get('filename'):
+                attachments.append({
+                    'filename': part['filename'],
+                    'mimeType': part.get('mimeType', ''),
+                    'size': part.get('body', {}).get('size', 0)
+                })
+            for subpart in part.get('parts', []):
+                process_parts(subpart)
+        
+        process_parts(payload)
+        
+        return {
+            'id': message['id'],
+            'subject': subject,
+            'from': from_email,
+            'attachments': attachments
+        }
+    
+    def _parse_message(self, message: Dict) -> Dict:
+        """Convert a messages.get(format='full') response into an email dict"""
+        msg_id = message['id']
+        headers = message['payload']['headers']
+        subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), '')
+        from_email = next((h['value'] for h in headers if h['name'].lower() == 'from'), '')
+        to_email = next((h['value'] for h in headers if h['name'].lower() == 'to'), '')
+        cc_email = next((h['value'] for h in headers if h['name'].lower() == 'cc'), '')
+        date_str = next((h['value'] for h in headers if h['name'].lower() == 'date'), '')
+        
+        # Parse email body (both plain text and HTML)
+        body_plain, body_html = self._get_body_full(message['payload'])
+        
+        # Extract signature from email body
+        signature = self._extract_signature(body_plain)
+        
+        # Get attachments
+        attachments = self._get_attachments(message['payload'], msg_id)
+        
+        return {
+            'id': msg_id,
+            'thread_id': message.get('threadId'),
+            'subject': subject,
+            'from': from_email,
+            'to': to_email,
+            'cc': cc_email,
+            'date': date_str,
+            'body': body_plain,
+            'body_html': body_html,
+            'signature': signature,
+            'attachments': attachments
+        }
+    
     def _extract_signature(self, body: str) -> str:
         """Extract email signature from body"""
         if not body:
@@ -300,11 +620,11 @@ class GmailService:
     def download_attachment(self, msg_id: str, attachment_id: str) -> Optional[bytes]:
         """Download attachment from email"""
         try:
-            attachment = self.service.users().messages().attachments().get(
+            attachment = self._execute('messages.attachments.get', self.service.users().messages().attachments().get(
                 userId='me',
                 messageId=msg_id,
                 id=attachment_id
-            ).execute()
+            ))
             
             data = attachment['data']
             file_data = base64.urlsafe_b64decode(data)
@@ -313,3 +633,69 @@ class GmailService:
         except Exception as e:
             print(f"Error downloading attachment: {str(e)}")
             return None
+    
+    def save_attachment(self, msg_id: str, attachment_id: str, dest_path: str,
+                        max_bytes: Optional[int] = None) -> Optional[Dict]:
+        """
+        Stream an attachment straight to dest_path
+        
+        The base64 body is decoded in chunks into a temp file as it arrives,
+        then renamed into place. Returns {'path', 'size', 'sha256'}, or None
+        on failure or if the attachment is larger than max_bytes
+        (ATTACHMENT_MAX_BYTES by default).
+        """
+        def download() -> Dict:
+            sink = AttachmentSink(dest_path, max_bytes)
+            try:
+                with self._session().get(
+                    f"{GMAIL_API_URL}/messages/{msg_id}/attachments/{attachment_id}",
+                    stream=True,
+                    timeout=settings.GMAIL_HTTP_TIMEOUT,
+                ) as response:
+                    if not response.ok:
+                        response.content  # Error body tells the limiter whether to retry
+                    response.raise_for_status()
+                    text = codecs.iterdecode(response.iter_content(chunk_size=1 << 16), 'utf-8')
+                    for chunk in iter_json_string_field(text, 'data'):
+                        sink.write_base64(chunk)
+                return sink.commit()
+            except BaseException:
+                sink.discard()
+                raise
+        
+        try:
+            return self.limiter.execute('messages.attachments.get', download)
+        
+        except AttachmentTooLargeError as e:
+            print(f"⚠️ Skipping attachment: {str(e)}")
+            return None
+        except Exception as e:
+            print(f"Error downloading attachment: {str(e)}")
+            return None
+    
+    def get_or_create_label_id(self, label_name: str) -> str:
+        """ID of a user label, creating the label if it does not exist yet"""
+        if label_name in self._label_ids:
+            return self._label_ids[label_name]
+        
+        labels = self._execute('labels.list', self.service.users().labels().list(userId='me'))
+        label_id = next((l['id'] for l in labels.get('labels', []) if l['name'] == label_name), None)
+        if label_id is None:
+            label = self._execute('labels.create', self.service.users().labels().create(
+                userId='me',
+                body={'name': label_name, 'labelListVisibility': 'labelShow', 'messageListVisibility': 'show'}
+            ))
+            label_id = label['id']
+            print(f"🏷️  Created Gmail label {label_name}")
+        
+        self._label_ids[label_name] = label_id
+        return label_id
+    
+    def add_label(self, msg_ids: List[str], label_name: str) -> None:
+        """Apply a label to many messages with messages.batchModify"""
+        label_id = self.get_or_create_label_id(label_name)
+        for start in range(0, len(msg_ids), BATCH_MODIFY_LIMIT):
+            self._execute('messages.batchModify', self.service.users().messages().batchModify(
+                userId='me',
+                body={'ids': msg_ids[start:start + BATCH_MODIFY_LIMIT], 'addLabelIds': [label_id]}
+            ))
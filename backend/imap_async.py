@@ -0,0 +1,498 @@
+"""
+Async IMAP client
+
+Same method names as IMAPService, implemented as coroutines on asyncio
+streams, so IMAP accounts are scanned concurrently on the event loop instead
+of each blocking call holding up the API. Message parsing is inherited from
+IMAPService, so both return identical email dicts.
+
+- Every command has a timeout (IMAP_TIMEOUT_SECONDS); a connection that
+  times out is closed rather than reused with a half-read response.
+- FETCHes are pipelined: up to IMAP_PIPELINE_DEPTH commands are written
+  before the first reply is read, so a scan does not pay a round trip per
+  batch. Untagged responses are attributed to the oldest pending command,
+  which matches servers that answer commands in order.
+
+Responses are handed back in imaplib's shape (bytes lines, with each literal
+as a (prefix, literal) tuple), so imap_protocol parses both alike.
+"""
+import asyncio
+import imaplib
+import re
+import ssl
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from config import settings
+from imap_pool import IMAPPoolRegistry
+from imap_protocol import parse_fetch_response, quote_string, uid_sets
+from imap_service import SEARCH_CHARSET, STRUCTURE_ITEMS, IMAPService
+
+_LITERAL_END = re.compile(rb'\{(\d+)\}\r\n$')
+_UIDVALIDITY = re.compile(rb'\[UIDVALIDITY (\d+)\]', re.IGNORECASE)
+
+# (type, data) of one untagged response, e.g. (b'FETCH', [(b'12 (UID 40 BODY[1] {5}', b'hello'), b')'])
+Untagged = Tuple[bytes, List]
+
+
+class _Command:
+    def __init__(self, tag: bytes):
+        self.tag = tag
+        self.untagged: List[Untagged] = []
+        loop = asyncio.get_running_loop()
+        self.done: asyncio.Future = loop.create_future()
+        self.continuation: asyncio.Future = loop.create_future()
+        self.activity = asyncio.Event()  # Set on every untagged response
+
+    def data(self, kind: bytes) -> List:
+        """imaplib-style data of every untagged response of one type"""
+        return [item for response_type, items in self.untagged if response_type == kind for item in items]
+
+
+class AsyncIMAPConnection:
+    """One IMAP connection; commands may be pipelined"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, timeout: float):
+        self._reader = reader
+        self._writer = writer
+        self.timeout = timeout
+        self._tag_number = 0
+        self._pending: "OrderedDict[bytes, _Command]" = OrderedDict()
+        self._closed = False
+        self._read_task = asyncio.create_task(self._read_loop())
+        self.selected: Optional[str] = None
+        self.uid_validity: Optional[int] = None
+        self.last_used = time.monotonic()
+
+    @classmethod
+    async def open(cls, host: str, port: int, timeout: Optional[float] = None) -> "AsyncIMAPConnection":
+        timeout = timeout or settings.IMAP_TIMEOUT_SECONDS
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl.create_default_context()), timeout
+        )
+        try:
+            greeting = await asyncio.wait_for(reader.readline(), timeout)
+        except BaseException:
+            writer.close()
+            raise
+        if not greeting.startswith(b'* OK') and not greeting.startswith(b'* PREAUTH'):
+            writer.close()
+            raise imaplib.IMAP4.error(f"Unexpected greeting: {greeting.strip().decode(errors='ignore')}")
+        return cls(reader, writer, timeout)
+
+    # ------------------------------------------------------------------
+    # Commands
+    # ------------------------------------------------------------------
+
+    def _send(self, *args: str) -> _Command:
+        if self._closed:
+            raise imaplib.IMAP4.abort("connection closed")
+        self._tag_number += 1
+        command = _Command(f"A{self._tag_number:04d}".encode())
+        self._pending[command.tag] = command
+        line = ' '.join(args).encode('utf-8')
+        self._writer.write(command.tag + b' ' + line + b'\r\n')
+        return command
+
+    async def _wait(self, command: _Command, timeout: Optional[float] = None) -> _Command:
+        try:
+            await asyncio.wait_for(asyncio.shield(command.done), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            # The reply may still arrive - the connection cannot be trusted any more
+            self.close()
+            raise
+        return command
+
+    async def command(self, *args: str, timeout: Optional[float] = None) -> _Command:
+        """Run one command; raises imaplib.IMAP4.error unless it completes OK"""
+        command = self._send(*args)
+        await self._writer.drain()
+        return self._check(await self._wait(command, timeout), args)
+
+    async def pipeline(self, commands: List[Tuple[str, ...]],
+                       timeout: Optional[float] = None) -> List[object]:
+        """
+        Write several commands before reading any reply; one completed command
+        (or the exception it failed with) per entry, in order
+        """
+        sent = [(self._send(*args), args) for args in commands]
+        await self._writer.drain()
+        results = []
+        for command, args in sent:
+            try:
+                results.append(self._check(await self._wait(command, timeout), args))
+            except imaplib.IMAP4.error as e:
+                if isinstance(e, imaplib.IMAP4.abort):
+                    raise
+                results.append(e)
+        return results
+
+    @staticmethod
+    def _check(command: _Command, args: Tuple[str, ...]) -> _Command:
+        status, text = command.done.result()
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"{' '.join(args[:2])} failed: {status} {text}")
+        return command
+
+    async def login(self, user: str, password: str) -> None:
+        await self.command('LOGIN', quote_string(user), quote_string(password))
+
+    async def select(self, mailbox: str) -> None:
+        """SELECT a mailbox read-only (EXAMINE; a no-op if it is already selected)"""
+        if self.selected == mailbox:
+            return
+        command = await self.command('EXAMINE', quote_string(mailbox))
+        self.uid_validity = None
+        for line in command.data(b'OK'):
+            match = _UIDVALIDITY.search(line if isinstance(line, bytes) else line[0])
+            if match:
+                self.uid_validity = int(match.group(1))
+        self.selected = mailbox
+
+    async def uid(self, name: str, *args: str, timeout: Optional[float] = None) -> Tuple[str, List]:
+        """UID SEARCH / FETCH, returned like imaplib's IMAP4.uid()"""
+        command = await self.command('UID', name, *(a for a in args if a), timeout=timeout)
+        return 'OK', command.data(name.upper().encode())
+
+    async def status(self, mailbox: str, items: str) -> Tuple[str, List]:
+        command = await self.command('STATUS', quote_string(mailbox), items)
+        return 'OK', command.data(b'STATUS')
+
+    async def idle(self, timeout: float) -> bool:
+        """
+        IDLE until the server sends an untagged response or `timeout` passes;
+        True if it reported new mail (EXISTS/RECENT)
+        """
+        command = self._send('IDLE')
+        await self._writer.drain()
+        await asyncio.wait_for(asyncio.shield(command.continuation), self.timeout)
+        try:
+            await asyncio.wait_for(command.activity.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._writer.write(b'DONE\r\n')
+        await self._writer.drain()
+        await self._wait(command)
+        return any(kind in (b'EXISTS', b'RECENT') for kind, _ in command.untagged)
+
+    async def is_healthy(self) -> bool:
+        try:
+            await self.command('NOOP')
+            return True
+        except Exception:
+            return False
+
+    async def logout(self) -> None:
+        try:
+            await self.command('LOGOUT')
+        except Exception:
+            pass
+        self.close()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._read_task.cancel()
+        self._writer.close()
+        self._fail_pending(imaplib.IMAP4.abort("connection closed"))
+
+    # ------------------------------------------------------------------
+    # Responses
+    # ------------------------------------------------------------------
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                pieces = await self._read_response()
+                head = pieces[0] if isinstance(pieces[0], bytes) else pieces[0][0]
+                if head.startswith(b'+'):
+                    self._on_continuation()
+                elif head.startswith(b'* '):
+                    self._on_untagged(pieces, head[2:])
+                else:
+                    self._on_tagged(head)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._closed = True
+            self._writer.close()
+            self._fail_pending(imaplib.IMAP4.abort(f"connection lost: {str(e) or type(e).__name__}"))
+
+    async def _read_response(self) -> List:
+        """One response line with its literals, as imaplib returns them"""
+        line = await self._reader.readline()
+        if not line:
+            raise EOFError("server closed the connection")
+        pieces = []
+        while True:
+            match = _LITERAL_END.search(line)
+            if not match:
+                pieces.append(line.rstrip(b'\r\n'))
+                return pieces
+            literal = await self._reader.readexactly(int(match.group(1)))
+            pieces.append((line[:-2], literal))
+            line = await self._reader.readline()
+
+    def _oldest(self) -> Optional[_Command]:
+        return next(iter(self._pending.values()), None)
+
+    def _on_continuation(self) -> None:
+        for command in self._pending.values():
+            if not command.continuation.done():
+                command.continuation.set_result(True)
+                return
+
+    def _on_untagged(self, pieces: List, head: bytes) -> None:
+        # '* 12 FETCH (...)' -> (b'FETCH', b'12 (...)'); '* SEARCH 1 2' -> (b'SEARCH', b'1 2')
+        words = head.split(b' ', 2)
+        if words[0].isdigit() and len(words) > 1:
+            kind = words[1].upper()
+            data_head = words[0] + (b' ' + words[2] if len(words) > 2 else b'')
+        else:
+            kind = words[0].upper()
+            data_head = b' '.join(words[1:])
+        first = pieces[0]
+        pieces[0] = data_head if isinstance(first, bytes) else (data_head, first[1])
+
+        command = self._oldest()
+        if command:
+            command.untagged.append((kind, pieces))
+            command.activity.set()
+
+    def _on_tagged(self, head: bytes) -> None:
+        tag, _, rest = head.partition(b' ')
+        command = self._pending.pop(tag, None)
+        if command and not command.done.done():
+            status, _, text = rest.partition(b' ')
+            command.done.set_result((status.decode(errors='ignore').upper(), text.decode(errors='ignore')))
+
+    def _fail_pending(self, error: Exception) -> None:
+        for command in self._pending.values():
+            for future in (command.done, command.continuation):
+                if not future.done():
+                    future.set_exception(error)
+                    future.exception()  # Mark retrieved - nobody may be waiting
+        self._pending.clear()
+
+
+class AsyncIMAPAccountPool:
+    """Authenticated async connections for one IMAP account (see imap_pool.IMAPAccountPool)"""
+
+    def __init__(self, email: str, password: str, host: str, port: int, max_size: Optional[int] = None):
+        self.email = email
+        self.host = host
+        self.port = port
+        self._password = password
+        self.max_size = max(1, max_size or settings.IMAP_POOL_SIZE)
+        self._idle: List[AsyncIMAPConnection] = []
+        self._slots = asyncio.Semaphore(self.max_size)
+        self._closed = False
+        self.logins = 0
+
+    async def open_connection(self) -> AsyncIMAPConnection:
+        """Log in on a new connection (outside the pool's limit - the caller owns it)"""
+        conn = await AsyncIMAPConnection.open(self.host, self.port)
+        try:
+            await conn.login(self.email, self._password)
+        except BaseException:
+            conn.close()
+            raise
+        self.logins += 1
+        return conn
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[AsyncIMAPConnection]:
+        """
+        Borrow a healthy connection; it goes back to the pool only if the
+        caller finished without an error or cancellation (either may leave
+        a command's responses unread on the connection)
+        """
+        if self._closed:
+            raise ValueError(f"IMAP connection pool for {self.email} is closed")
+
+        async with self._slots:
+            conn = await self._take_idle() or await self.open_connection()
+            try:
+                yield conn
+            except BaseException:
+                conn.close()
+                raise
+            else:
+                conn.last_used = time.monotonic()
+                if self._closed or conn._closed:
+                    conn.close()
+                else:
+                    self._idle.append(conn)
+
+    async def _take_idle(self) -> Optional[AsyncIMAPConnection]:
+        while self._idle:
+            conn = self._idle.pop()
+            if time.monotonic() - conn.last_used < settings.IMAP_POOL_HEALTH_CHECK_SECONDS or await conn.is_healthy():
+                return conn
+            print(f"🔌 Dropping stale IMAP connection for {self.email}")
+            conn.close()
+        return None
+
+    def close(self) -> None:
+        """Close every idle connection; borrowed ones are closed when returned"""
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> Dict:
+        return {"idle": len(self._idle), "max_size": self.max_size, "logins": self.logins}
+
+
+async_imap_pools = IMAPPoolRegistry(AsyncIMAPAccountPool)
+
+
+class AsyncIMAPService(IMAPService):
+    """IMAPService whose mailbox methods are coroutines on async connections"""
+
+    pools = async_imap_pools
+
+    async def connect(self, email: str, password: str, provider: str = None) -> bool:
+        """Connect to IMAP server"""
+        try:
+            provider, config = self.resolve_provider(email, provider)
+
+            print(f"📧 Connecting to {config['host']}...")
+            pool = self.pools.open(email, password, config['host'], config['port'])
+            print(f"🔐 Authenticating {email}...")
+            try:
+                async with pool.connection():
+                    pass
+            except BaseException:
+                self.pools.close(email)
+                raise
+
+            self.pool = pool
+            self.email_address = email
+            print(f"✅ Connected successfully to {provider}")
+            return True
+
+        except imaplib.IMAP4.error as e:
+            print(f"❌ IMAP authentication failed: {str(e)}")
+            if "authentication failed" in str(e).lower():
+                raise ValueError("Authentication failed. Please check your email and app password.")
+            raise
+        except Exception as e:
+            print(f"❌ Connection error: {str(e) or type(e).__name__}")
+            raise
+
+    async def iter_message_id_pages(self, search_query: str = "ALL", hours_back: Optional[int] = None,
+                                    limit: Optional[int] = None, page_token: Optional[str] = None,
+                                    since_state: Optional[Dict] = None) -> AsyncIterator[Tuple[Optional[str], List[str]]]:
+        """See IMAPService.iter_message_id_pages"""
+        if not self.pool:
+            raise ValueError("Not connected to IMAP server")
+
+        if hours_back is not None:
+            search_query = f"{search_query} {self.build_query('', hours_back)}"
+        start_mailbox, start_uid = self._page_position(page_token)
+
+        results = await asyncio.gather(*(
+            self._search_folder(mailbox, search_query, since_state)
+            for mailbox in self._folders_from(start_mailbox)
+        ))
+        for page in self._id_pages(results, limit, start_mailbox, start_uid):
+            yield page
+
+    async def _search_folder(self, mailbox: str, search_query: str,
+                             since_state: Optional[Dict]) -> Tuple[str, Optional[str], List[int]]:
+        """See IMAPService._search_folder"""
+        try:
+            async with self.pool.connection() as conn:
+                uids = await self._search_uids(conn, mailbox, search_query, since_state, None)
+                return mailbox, self._folder_prefix(conn), uids
+        except Exception as e:
+            print(f"❌ Error searching {mailbox}: {str(e) or type(e).__name__}")
+            return mailbox, None, []
+
+    async def get_email_details_batch(self, msg_ids: List[str]) -> List[Dict]:
+        """See IMAPService.get_email_details_batch; each folder's FETCHes are pipelined"""
+        if not self.pool:
+            raise ValueError("Not connected to IMAP server")
+
+        emails = {}
+        batch_size = max(1, settings.IMAP_FETCH_BATCH_SIZE)
+        async with self.pool.connection() as conn:
+            for mailbox, uids in self._uids_by_folder(msg_ids).items():
+                await conn.select(mailbox)
+                batches = uid_sets(uids, batch_size)
+                depth = max(1, settings.IMAP_PIPELINE_DEPTH)
+                for start in range(0, len(batches), depth):
+                    for email_data in await self._fetch_batches(conn, batches[start:start + depth]):
+                        emails[email_data['id']] = email_data
+        return [emails[msg_id] for msg_id in msg_ids if msg_id in emails]
+
+    async def _search_uids(self, conn: AsyncIMAPConnection, mailbox: str, search_query: str,
+                           since_state: Optional[Dict], max_results: Optional[int]) -> List[int]:
+        """See IMAPService._search_uids"""
+        await conn.select(mailbox)
+        last_uid = self._last_synced_uid(conn, since_state)
+        search_query = self._search_criteria(search_query, last_uid)
+
+        print(f"🔍 Searching {mailbox} with query: {search_query}")
+        charset = () if search_query.isascii() else SEARCH_CHARSET
+        _, messages = await conn.uid('SEARCH', *charset, search_query)
+        return self._newest_uids(messages, last_uid, max_results)
+
+    async def _fetch_batches(self, conn: AsyncIMAPConnection, batches: List[Tuple[List[int], str]]) -> List[Dict]:
+        """Pipelined _fetch_batch() over several batches"""
+        structures = await conn.pipeline([('UID', 'FETCH', message_set, STRUCTURE_ITEMS) for _, message_set in batches])
+        messages = []
+        for (_, message_set), result in zip(batches, structures):
+            if isinstance(result, Exception):
+                print(f"⚠️ Error loading emails {message_set}: {str(result)}")
+                continue
+            messages.extend(m for m in parse_fetch_response(result.data(b'FETCH')) if 'UID' in m)
+
+        emails, text_fetches = self._plan_text_fetches(conn, messages)
+        bodies = await conn.pipeline([('UID', 'FETCH', section_set, items) for section_set, items in text_fetches])
+        for result in bodies:
+            if isinstance(result, Exception):
+                print(f"⚠️ Error loading email bodies: {str(result)}")
+                continue
+            self._fill_bodies(emails, [m for m in parse_fetch_response(result.data(b'FETCH')) if 'UID' in m])
+
+        return [emails[uid][0] for batch, _ in batches for uid in batch if uid in emails]
+
+    async def get_sync_state(self) -> Dict[str, Dict[str, int]]:
+        """See IMAPService.get_sync_state"""
+        if not self.pool:
+            raise ValueError("Not connected to IMAP server")
+
+        state = {}
+        async with self.pool.connection() as conn:
+            for mailbox in self.mailboxes:
+                _, data = await conn.status(mailbox, '(UIDVALIDITY UIDNEXT)')
+                state[mailbox] = self._sync_state(data)
+        return state
+
+    async def download_attachment(self, msg_id: str, attachment_id: str) -> Optional[bytes]:
+        """Download one attachment part with BODY.PEEK[section]"""
+        try:
+            mailbox, uid, section, items = self._attachment_items(attachment_id)
+            async with self.pool.connection() as conn:
+                await conn.select(mailbox)
+                _, data = await conn.uid('FETCH', uid, items)
+            messages = [m for m in parse_fetch_response(data) if 'UID' in m]
+            return self._decode_attachment(messages, section)
+        except Exception as e:
+            print(f"Error downloading attachment: {str(e) or type(e).__name__}")
+            return None
+
+
+def connected_imap_service(email: Optional[str]) -> Optional[IMAPService]:
+    """The IMAP service of an account connected in this process (async or blocking client)"""
+    return AsyncIMAPService.for_account(email) or IMAPService.for_account(email)
+
+
+def connected_imap_accounts() -> List[str]:
+    """Addresses of the IMAP accounts connected in this process (async or blocking client)"""
+    return AsyncIMAPService.pools.accounts() + IMAPService.pools.accounts()
@@ -0,0 +1,210 @@
+"""
+IMAP IDLE push listener
+
+One thread per connected IMAP account keeps a logged-in connection in IDLE
+(RFC 2177) on its inbox. When the server reports new mail (an untagged
+EXISTS) the listener calls back into the event loop, which queues an
+incremental scan, so new candidates arrive within seconds instead of waiting
+for a live-mode poll.
+
+- IDLE is re-issued every IMAP_IDLE_RENEW_SECONDS (servers drop idle
+  connections after ~30 minutes).
+- Bursts of notifications are coalesced over IMAP_IDLE_DEBOUNCE_SECONDS.
+- A dropped connection is re-established with exponential backoff.
+
+imaplib has no IDLE support before Python 3.14, so the command is driven by
+hand on the connection's socket. Accounts on the async client (imap_async.py)
+are watched by a task on the event loop instead of a thread.
+"""
+import asyncio
+import select
+import socket
+import threading
+from typing import Awaitable, Callable, Dict, Optional, Set, Union
+
+from config import settings
+from imap_async import AsyncIMAPAccountPool, AsyncIMAPConnection
+from imap_pool import IMAPAccountPool, IMAPConnection
+
+OnNewMail = Callable[[str], Awaitable[None]]
+
+
+class IMAPIdleListener:
+    """Keeps one account's mailbox in IDLE and reports new mail"""
+
+    def __init__(self, pool: IMAPAccountPool, mailbox: str, notify: Callable[[], None]):
+        self.pool = pool
+        self.mailbox = mailbox
+        self.notify = notify
+        self._stop = threading.Event()
+        self._conn: Optional[IMAPConnection] = None
+        self._thread = threading.Thread(target=self._run, name=f"imap-idle-{pool.email}", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        conn = self._conn
+        if conn:
+            # Wakes the blocked select()/readline()
+            try:
+                conn.imap.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _run(self) -> None:
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                self._conn = self.pool.open_connection()
+                self._conn.select(self.mailbox)
+                print(f"👂 IMAP IDLE listening on {self.pool.email}/{self.mailbox}")
+                backoff = 1.0
+                while not self._stop.is_set():
+                    if self._idle_once(self._conn):
+                        self.notify()
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                print(f"⚠️ IMAP IDLE for {self.pool.email} failed ({str(e)}) - reconnecting in {int(backoff)}s")
+            finally:
+                if self._conn:
+                    self._conn.close()
+                    self._conn = None
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, settings.IMAP_IDLE_MAX_BACKOFF_SECONDS)
+
+    def _idle_once(self, conn: IMAPConnection) -> bool:
+        """
+        Run one IDLE command until the server sends something or it is time
+        to renew; True if new mail was reported
+        """
+        imap = conn.imap
+        tag = imap._new_tag()
+        imap.send(tag + b' IDLE\r\n')
+        new_mail = False
+        while True:
+            line = imap.readline()
+            if not line:
+                raise EOFError("connection closed")
+            if line.startswith(b'+'):
+                break
+            if line.startswith(tag):
+                raise ConnectionError(f"IDLE rejected: {line.strip().decode(errors='ignore')}")
+            new_mail = new_mail or _is_new_mail(line)
+
+        # Wait for the first untagged response (or the renewal deadline)
+        if not imap.sock.pending():
+            select.select([imap.sock], [], [], settings.IMAP_IDLE_RENEW_SECONDS)
+        if self._stop.is_set():
+            return False
+
+        # End IDLE and read everything up to the tagged completion
+        imap.send(b'DONE\r\n')
+        while True:
+            line = imap.readline()
+            if not line:
+                raise EOFError("connection closed")
+            if line.startswith(tag):
+                return new_mail
+            new_mail = new_mail or _is_new_mail(line)
+
+
+class AsyncIMAPIdleListener:
+    """IMAPIdleListener for async connections, as a task on the event loop"""
+
+    def __init__(self, pool: AsyncIMAPAccountPool, mailbox: str, notify: Callable[[], None]):
+        self.pool = pool
+        self.mailbox = mailbox
+        self.notify = notify
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self) -> None:
+        backoff = 1.0
+        while True:
+            conn: Optional[AsyncIMAPConnection] = None
+            try:
+                conn = await self.pool.open_connection()
+                await conn.select(self.mailbox)
+                print(f"👂 IMAP IDLE listening on {self.pool.email}/{self.mailbox}")
+                backoff = 1.0
+                while True:
+                    if await conn.idle(settings.IMAP_IDLE_RENEW_SECONDS):
+                        self.notify()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ IMAP IDLE for {self.pool.email} failed ({str(e) or type(e).__name__}) - "
+                      f"reconnecting in {int(backoff)}s")
+            finally:
+                if conn:
+                    conn.close()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, settings.IMAP_IDLE_MAX_BACKOFF_SECONDS)
+
+
+def _is_new_mail(line: bytes) -> bool:
+    """Untagged '* <n> EXISTS' (or RECENT) - the mailbox grew"""
+    words = line.split()
+    return len(words) >= 3 and words[0] == b'*' and words[2].upper() in (b'EXISTS', b'RECENT')
+
+
+class IMAPIdleManager:
+    """IDLE listeners per account, calling `on_new_mail(email)` on the event loop"""
+
+    def __init__(self):
+        self._listeners: Dict[str, Union[IMAPIdleListener, AsyncIMAPIdleListener]] = {}
+        self._pending: Set[str] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def start(self, pool: Union[IMAPAccountPool, AsyncIMAPAccountPool], on_new_mail: OnNewMail,
+              mailbox: str = 'INBOX') -> None:
+        """Start (or restart) the listener for an account; call from the event loop"""
+        self._loop = asyncio.get_running_loop()
+        self.stop(pool.email)
+
+        def notify():
+            asyncio.run_coroutine_threadsafe(self._coalesce(pool.email, on_new_mail), self._loop)
+
+        if isinstance(pool, AsyncIMAPAccountPool):
+            listener = AsyncIMAPIdleListener(pool, mailbox, notify)
+        else:
+            listener = IMAPIdleListener(pool, mailbox, notify)
+        self._listeners[pool.email.lower()] = listener
+        listener.start()
+
+    def stop(self, email: Optional[str]) -> None:
+        listener = self._listeners.pop((email or '').lower(), None)
+        if listener:
+            listener.stop()
+
+    def stop_all(self) -> None:
+        for email in list(self._listeners):
+            self.stop(email)
+
+    async def _coalesce(self, email: str, on_new_mail: OnNewMail) -> None:
+        """Collapse a burst of notifications for one account into one callback"""
+        if email in self._pending:
+            return
+        self._pending.add(email)
+        try:
+            await asyncio.sleep(settings.IMAP_IDLE_DEBOUNCE_SECONDS)
+            await on_new_mail(email)
+        except Exception as e:
+            print(f"⚠️ Could not handle new IMAP mail for {email}: {str(e)}")
+        finally:
+            self._pending.discard(email)
+
+    def listening(self) -> Set[str]:
+        return set(self._listeners)
+
+
+imap_idle = IMAPIdleManager()
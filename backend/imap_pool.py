@@ -0,0 +1,180 @@
+"""
+Per-account IMAP connection pool
+
+IMAP logins are slow (TLS handshake plus LOGIN), so each connected account
+keeps up to IMAP_POOL_SIZE authenticated connections that scans, attachment
+downloads and the IDLE listener borrow instead of logging in again. A
+connection idle for longer than IMAP_POOL_HEALTH_CHECK_SECONDS is checked with
+NOOP before it is handed out, and one that fails (dropped by the server,
+network error) is discarded and replaced by a fresh login on next use.
+"""
+import imaplib
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+from config import settings
+from imap_protocol import quote_string
+
+class IMAPConnection:
+    """An authenticated imaplib connection and the mailbox it has selected"""
+
+    def __init__(self, imap: imaplib.IMAP4):
+        self.imap = imap
+        self.selected: Optional[str] = None
+        self.uid_validity: Optional[int] = None
+        self.last_used = time.monotonic()
+
+    def select(self, mailbox: str) -> None:
+        """SELECT a mailbox read-only (a no-op if it is already selected)"""
+        if self.selected == mailbox:
+            return
+        status, data = self.imap.select(quote_string(mailbox), readonly=True)
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"SELECT {mailbox} failed: {data}")
+        _, uid_validity = self.imap.response('UIDVALIDITY')
+        self.uid_validity = int(uid_validity[0]) if uid_validity and uid_validity[0] else None
+        self.selected = mailbox
+
+    def is_healthy(self) -> bool:
+        try:
+            return self.imap.noop()[0] == 'OK'
+        except Exception:
+            return False
+
+    def close(self) -> None:
+        try:
+            self.imap.logout()
+        except Exception:
+            pass
+
+
+class IMAPAccountPool:
+    """Authenticated connections for one IMAP account"""
+
+    def __init__(self, email: str, password: str, host: str, port: int, max_size: Optional[int] = None):
+        self.email = email
+        self.host = host
+        self.port = port
+        self._password = password
+        self.max_size = max(1, max_size or settings.IMAP_POOL_SIZE)
+        self._idle: List[IMAPConnection] = []
+        self._lock = threading.Lock()
+        # Connections handed out at once (IMAP servers cap connections per account)
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._closed = False
+        self.logins = 0
+
+    def open_connection(self) -> IMAPConnection:
+        """Log in on a new connection (outside the pool's limit - the caller owns it)"""
+        imap = imaplib.IMAP4_SSL(self.host, self.port, timeout=settings.IMAP_TIMEOUT_SECONDS)
+        try:
+            imap.login(self.email, self._password)
+        except Exception:
+            try:
+                imap.shutdown()
+            except Exception:
+                pass
+            raise
+        self.logins += 1
+        return IMAPConnection(imap)
+
+    @contextmanager
+    def connection(self) -> Iterator[IMAPConnection]:
+        """
+        Borrow a healthy connection; it goes back to the pool only if the
+        caller finished without an error (a command interrupted by one may
+        have left unread responses on the connection)
+        """
+        if self._closed:
+            raise ValueError(f"IMAP connection pool for {self.email} is closed")
+
+        self._slots.acquire()
+        try:
+            conn = self._take_idle() or self.open_connection()
+            try:
+                yield conn
+            except BaseException:
+                conn.close()
+                raise
+            else:
+                conn.last_used = time.monotonic()
+                self._put_back(conn)
+        finally:
+            self._slots.release()
+
+    def _take_idle(self) -> Optional[IMAPConnection]:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn = self._idle.pop()
+            if time.monotonic() - conn.last_used < settings.IMAP_POOL_HEALTH_CHECK_SECONDS or conn.is_healthy():
+                return conn
+            print(f"🔌 Dropping stale IMAP connection for {self.email}")
+            conn.close()
+
+    def _put_back(self, conn: IMAPConnection) -> None:
+        with self._lock:
+            if not self._closed:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        """Log out every idle connection; borrowed ones are logged out when returned"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> Dict:
+        return {"idle": len(self._idle), "max_size": self.max_size, "logins": self.logins}
+
+
+class IMAPPoolRegistry:
+    """Connection pools keyed by account address"""
+
+    def __init__(self, pool_class: Callable[..., IMAPAccountPool] = IMAPAccountPool):
+        self.pool_class = pool_class
+        self._pools: Dict[str, IMAPAccountPool] = {}
+        self._lock = threading.Lock()
+
+    def open(self, email: str, password: str, host: str, port: int) -> IMAPAccountPool:
+        """Register an account, replacing (and closing) any pool it already had"""
+        pool = self.pool_class(email, password, host, port)
+        with self._lock:
+            old = self._pools.get(email.lower())
+            self._pools[email.lower()] = pool
+        if old:
+            old.close()
+        return pool
+
+    def get(self, email: Optional[str]) -> Optional[IMAPAccountPool]:
+        if not email:
+            return None
+        return self._pools.get(email.lower())
+
+    def close(self, email: str) -> None:
+        with self._lock:
+            pool = self._pools.pop(email.lower(), None)
+        if pool:
+            pool.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
+
+    def accounts(self) -> List[str]:
+        """Addresses (lowercased) of the registered accounts"""
+        return list(self._pools)
+
+    def stats(self) -> Dict[str, Dict]:
+        return {email: pool.stats() for email, pool in self._pools.items()}
+
+
+imap_pools = IMAPPoolRegistry()
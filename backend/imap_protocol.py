@@ -0,0 +1,242 @@
+"""
+IMAP FETCH response and BODYSTRUCTURE parsing
+
+imaplib returns FETCH responses as raw bytes with literals split out.
+parse_fetch_response() turns them back into one dict per message
+(UID, BODYSTRUCTURE, BODY[...] sections), and body_parts() flattens a
+BODYSTRUCTURE into leaf parts with their section numbers, so a scan can
+decide which parts to download before fetching any message body.
+"""
+import base64
+import email
+import quopri
+import re
+from email.header import decode_header
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+_LITERAL = re.compile(rb'\{(\d+)\}\r\n')
+
+
+class _Reader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def skip_space(self) -> None:
+        while self.pos < len(self.data) and self.data[self.pos:self.pos + 1] in (b' ', b'\r', b'\n'):
+            self.pos += 1
+
+    def at_end(self) -> bool:
+        self.skip_space()
+        return self.pos >= len(self.data)
+
+    def value(self) -> Any:
+        self.skip_space()
+        char = self.data[self.pos:self.pos + 1]
+        if char == b'(':
+            self.pos += 1
+            items = []
+            while True:
+                self.skip_space()
+                if self.pos >= len(self.data):
+                    return items  # Truncated response
+                if self.data[self.pos:self.pos + 1] == b')':
+                    self.pos += 1
+                    return items
+                items.append(self.value())
+        if char == b'"':
+            return self._quoted()
+        if char == b'{':
+            match = _LITERAL.match(self.data, self.pos)
+            if match:
+                start = match.end()
+                self.pos = start + int(match.group(1))
+                return self.data[start:self.pos]
+        return self._atom()
+
+    def _quoted(self) -> bytes:
+        self.pos += 1
+        out = bytearray()
+        while self.pos < len(self.data):
+            char = self.data[self.pos:self.pos + 1]
+            if char == b'\\':
+                out += self.data[self.pos + 1:self.pos + 2]
+                self.pos += 2
+                continue
+            self.pos += 1
+            if char == b'"':
+                break
+            out += char
+        return bytes(out)
+
+    def _atom(self) -> Optional[bytes]:
+        start = self.pos
+        depth = 0
+        while self.pos < len(self.data):
+            char = self.data[self.pos:self.pos + 1]
+            if char == b'[':
+                depth += 1
+            elif char == b']':
+                depth -= 1
+            elif depth == 0 and char in (b' ', b'(', b')', b'\r', b'\n'):
+                break
+            self.pos += 1
+        if self.pos == start:
+            self.pos += 1  # Stray character - skip it rather than stall
+        atom = self.data[start:self.pos]
+        return None if atom.upper() == b'NIL' else atom
+
+
+def parse_fetch_response(data: List) -> List[Dict[str, Any]]:
+    """
+    Parse imaplib FETCH data into one dict per message, keyed by item name
+    (e.g. 'UID', 'BODYSTRUCTURE', 'BODY[1]', 'BODY[HEADER.FIELDS (SUBJECT)]').
+    """
+    # Rebuild the wire format: imaplib drops the CRLF after each {n} literal marker
+    chunks = []
+    for item in data:
+        if isinstance(item, tuple):
+            chunks.append(item[0] + b'\r\n' + item[1])
+        elif isinstance(item, bytes):
+            chunks.append(item)
+    reader = _Reader(b''.join(chunks))
+
+    messages = []
+    while not reader.at_end():
+        reader.value()  # Sequence number
+        items = reader.value()
+        if not isinstance(items, list):
+            continue
+        message = {}
+        for i in range(0, len(items) - 1, 2):
+            key = items[i].decode('ascii', errors='ignore').upper()
+            # BODY.PEEK[...] is answered as BODY[...]; drop any partial <origin>
+            message[re.sub(r'<\d+>$', '', key)] = items[i + 1]
+        if 'UID' in message:
+            message['UID'] = int(message['UID'])
+        messages.append(message)
+    return messages
+
+
+def _text(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='ignore')
+    return str(value)
+
+
+def _params(value) -> Dict[str, str]:
+    if not isinstance(value, list):
+        return {}
+    return {_text(value[i]).lower(): _text(value[i + 1]) for i in range(0, len(value) - 1, 2)}
+
+
+def decode_mime_header(value: str) -> str:
+    """Decode an RFC 2047 encoded header value"""
+    if not value:
+        return ''
+    text = ''
+    for part, encoding in decode_header(value):
+        if isinstance(part, bytes):
+            text += part.decode(encoding or 'utf-8', errors='ignore')
+        else:
+            text += str(part)
+    return text
+
+
+def _filename(disposition_params: Dict[str, str], type_params: Dict[str, str]) -> str:
+    for params in (disposition_params, type_params):
+        for key in ('filename', 'name'):
+            if params.get(key):
+                return decode_mime_header(params[key])
+            if params.get(key + '*'):
+                # RFC 2231: charset'language'percent-encoded
+                charset, _, value = params[key + '*'].partition("''")
+                return unquote(value or charset, encoding='utf-8', errors='ignore')
+    return ''
+
+
+def body_parts(structure: list, section: str = '') -> List[Dict]:
+    """
+    Flatten a parsed BODYSTRUCTURE into leaf parts:
+    {'section', 'type' ('text/plain', ...), 'charset', 'encoding', 'size', 'filename', 'attachment'}
+    """
+    if structure and isinstance(structure[0], list):
+        # Multipart: child parts first, then the subtype and extension data
+        parts = []
+        index = 0
+        for child in structure:
+            if not isinstance(child, list):
+                break
+            index += 1
+            parts.extend(body_parts(child, f"{section}.{index}" if section else str(index)))
+        return parts
+
+    mime_type = f"{_text(structure[0])}/{_text(structure[1])}".lower()
+    type_params = _params(structure[2])
+    encoding = _text(structure[5]).lower() or '7bit'
+    size = int(structure[6] or 0) if len(structure) > 6 else 0
+
+    if mime_type.startswith('text/'):
+        extension_start = 8
+    elif mime_type == 'message/rfc822':
+        extension_start = 10
+    else:
+        extension_start = 7
+    disposition = structure[extension_start + 1] if len(structure) > extension_start + 1 else None
+    disposition_type = ''
+    disposition_params: Dict[str, str] = {}
+    if isinstance(disposition, list) and disposition:
+        disposition_type = _text(disposition[0]).lower()
+        disposition_params = _params(disposition[1] if len(disposition) > 1 else None)
+
+    filename = _filename(disposition_params, type_params)
+    return [{
+        'section': section or '1',
+        'type': mime_type,
+        'charset': type_params.get('charset', 'utf-8'),
+        'encoding': encoding,
+        'size': size,
+        'filename': filename,
+        'attachment': disposition_type == 'attachment' or bool(filename),
+    }]
+
+
+def decode_part(data: Optional[bytes], encoding: str) -> bytes:
+    """Undo a part's Content-Transfer-Encoding"""
+    if not data:
+        return b''
+    encoding = (encoding or '').lower()
+    if encoding == 'base64':
+        return base64.b64decode(re.sub(rb'\s+', b'', data) + b'==', validate=False)
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(data)
+    return data
+
+
+def parse_headers(data: Optional[bytes]) -> Dict[str, str]:
+    """Decoded header values from a BODY[HEADER.FIELDS (...)] response"""
+    message = email.message_from_bytes(data or b'')
+    return {key.lower(): decode_mime_header(value) for key, value in message.items()}
+
+
+def decoded_size(part: Dict) -> int:
+    """Approximate decoded size of a part (BODYSTRUCTURE reports the encoded size)"""
+    if part['encoding'] == 'base64':
+        return part['size'] * 3 // 4
+    return part['size']
+
+
+def quote_string(value: str) -> str:
+    """An IMAP quoted string (mailbox names, LOGIN arguments)"""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def uid_sets(uids: List[int], size: int) -> List[Tuple[List[int], str]]:
+    """Split UIDs into batches of `size`, each with its comma-separated message set"""
+    return [
+        (uids[i:i + size], ','.join(str(uid) for uid in uids[i:i + size]))
+        for i in range(0, len(uids), size)
+    ]
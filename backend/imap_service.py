@@ -1,12 +1,52 @@
+import codecs
+import hashlib
 import imaplib
-import email
-from email.header import decode_header
-from typing import List, Dict, Optional
 import re
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Iterator, List, Dict, Optional, Tuple
+
+from config import settings
+from imap_pool import IMAPAccountPool, IMAPConnection, imap_pools
+from imap_protocol import (
+    body_parts,
+    decode_mime_header,
+    decode_part,
+    decoded_size,
+    parse_fetch_response,
+    parse_headers,
+    quote_string,
+    uid_sets,
+)
+from scan_query import gmail_query_to_imap
+
+HEADER_FIELDS = "HEADER.FIELDS (SUBJECT FROM TO CC DATE)"
+STRUCTURE_ITEMS = f"(UID BODYSTRUCTURE BODY.PEEK[{HEADER_FIELDS}])"
+# Sent with SEARCH criteria that have non-ASCII terms (quoted strings in UTF-8)
+SEARCH_CHARSET = ("CHARSET", "UTF-8")
+
+
+def _charset(charset: str) -> str:
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        return 'utf-8'
+
 
 class IMAPService:
-    """IMAP service for connecting to multiple email providers"""
+    """
+    IMAP service for connecting to multiple email providers
+
+    One instance per account. Connections are borrowed from the account's
+    pool (imap_pool.py), so a scan and its attachment downloads can use
+    several connections at once without logging in again.
+    """
+    
+    # EmailSource capabilities: incremental scans by UID, no threads or labels
+    supports_history = False
+    supports_sync_state = True
+    supports_threads = False
+    supports_labels = False
     
     # Provider configurations
     PROVIDERS = {
@@ -30,38 +70,64 @@ class IMAPService:
         }
     }
     
-    def __init__(self):
-        self.connection = None
+    # Connection pools of connected accounts, by address
+    pools = imap_pools
+    
+    def __init__(self, mailboxes: Optional[List[str]] = None):
+        self.pool: Optional[IMAPAccountPool] = None
         self.email_address = None
+        # Folders a scan searches (default IMAP_SCAN_FOLDERS)
+        self.mailboxes = list(mailboxes or settings.IMAP_SCAN_FOLDERS)
+        # Message ID prefix -> folder, for the folder versions seen while listing
+        self._folders: Dict[str, str] = {}
+    
+    @classmethod
+    def for_account(cls, email: str, mailboxes: Optional[List[str]] = None) -> Optional['IMAPService']:
+        """A service on an already connected account's pool, or None if it is not connected"""
+        pool = cls.pools.get(email)
+        if pool is None:
+            return None
+        service = cls(mailboxes)
+        service.pool = pool
+        service.email_address = pool.email
+        return service
+        
+    @classmethod
+    def resolve_provider(cls, email: str, provider: Optional[str] = None) -> tuple:
+        """(provider, config), auto-detecting the provider from the email domain if not given"""
+        if not provider:
+            domain = email.split('@')[1].lower()
+            if 'gmail' in domain:
+                provider = 'gmail'
+            elif 'outlook' in domain or 'hotmail' in domain or 'live' in domain:
+                provider = 'outlook'
+            elif 'yahoo' in domain:
+                provider = 'yahoo'
+            else:
+                raise ValueError(f"Unknown email provider. Please specify provider manually.")
+        
+        if provider not in cls.PROVIDERS:
+            raise ValueError(f"Unsupported provider: {provider}")
+        
+        return provider, cls.PROVIDERS[provider]
         
     def connect(self, email: str, password: str, provider: str = None) -> bool:
         """Connect to IMAP server"""
         try:
-            # Auto-detect provider from email domain if not specified
-            if not provider:
-                domain = email.split('@')[1].lower()
-                if 'gmail' in domain:
-                    provider = 'gmail'
-                elif 'outlook' in domain or 'hotmail' in domain or 'live' in domain:
-                    provider = 'outlook'
-                elif 'yahoo' in domain:
-                    provider = 'yahoo'
-                else:
-                    raise ValueError(f"Unknown email provider. Please specify provider manually.")
-            
-            if provider not in self.PROVIDERS:
-                raise ValueError(f"Unsupported provider: {provider}")
+            provider, config = self.resolve_provider(email, provider)
             
-            config = self.PROVIDERS[provider]
-            
-            # Connect to IMAP server
+            # Register the account's pool and log in its first connection
             print(f"📧 Connecting to {config['host']}...")
-            self.connection = imaplib.IMAP4_SSL(config['host'], config['port'])
-            
-            # Login
+            pool = self.pools.open(email, password, config['host'], config['port'])
             print(f"🔐 Authenticating {email}...")
-            self.connection.login(email, password)
+            try:
+                with pool.connection():
+                    pass
+            except Exception:
+                self.pools.close(email)
+                raise
             
+            self.pool = pool
             self.email_address = email
             print(f"✅ Connected successfully to {provider}")
             return True
@@ -76,185 +142,339 @@ class IMAPService:
             raise
     
     def disconnect(self):
-        """Disconnect from IMAP server"""
-        if self.connection:
-            try:
-                self.connection.logout()
-                print("✅ Disconnected from IMAP server")
-            except:
-                pass
-            self.connection = None
+        """Disconnect from IMAP server (logs out every pooled connection of the account)"""
+        if self.pool:
+            self.pools.close(self.email_address)
+            print("✅ Disconnected from IMAP server")
+            self.pool = None
             self.email_address = None
     
-    def get_emails(self, search_query: str = "ALL", max_results: int = 500) -> List[Dict]:
-        """Fetch emails based on search criteria"""
-        if not self.connection:
+    def build_query(self, search_query: str = "", hours_back: Optional[int] = None) -> str:
+        """IMAP SEARCH criteria for a Gmail-syntax query with optional time filter"""
+        since = datetime.now() - timedelta(hours=hours_back) if hours_back is not None else None
+        return gmail_query_to_imap(search_query, since)
+    
+    def iter_message_id_pages(self, search_query: str = "ALL", hours_back: Optional[int] = None,
+                              limit: Optional[int] = None, page_token: Optional[str] = None,
+                              since_state: Optional[Dict] = None) -> Iterator[Tuple[Optional[str], List[str]]]:
+        """
+        Yield (page_token, message_ids) pages folder by folder, most recent first
+        
+        search_query is IMAP SEARCH criteria (see build_query). Every folder in
+        self.mailboxes is searched at the same time, each on its own pooled
+        connection; only UIDs are searched here - get_email_details_batch()
+        loads the messages. A page's token ('<uid>:<mailbox>') lists it again,
+        so a listing can be resumed from any page.
+        
+        With since_state (a get_sync_state() result from an earlier scan), only
+        messages with a higher UID are searched in each folder, unless the
+        folder's UIDVALIDITY has changed since. A folder that cannot be
+        searched is logged and left out.
+        """
+        if not self.pool:
             raise ValueError("Not connected to IMAP server")
         
+        if hours_back is not None:
+            search_query = f"{search_query} {self.build_query('', hours_back)}"
+        start_mailbox, start_uid = self._page_position(page_token)
+        
+        folders = self._folders_from(start_mailbox)
+        workers = min(len(folders), self.pool.max_size)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="imap-folder") as executor:
+            results = list(executor.map(
+                lambda mailbox: self._search_folder(mailbox, search_query, since_state), folders
+            ))
+        yield from self._id_pages(results, limit, start_mailbox, start_uid)
+    
+    def _search_folder(self, mailbox: str, search_query: str,
+                       since_state: Optional[Dict]) -> Tuple[str, Optional[str], List[int]]:
+        """(mailbox, message ID prefix, UIDs newest first) for one folder"""
         try:
-            # Select inbox
-            self.connection.select('INBOX')
-            
-            # Search for emails
-            print(f"🔍 Searching emails with query: {search_query}")
-            status, messages = self.connection.search(None, search_query)
-            
-            if status != 'OK':
-                print("❌ No messages found")
-                return []
-            
-            email_ids = messages[0].split()
-            total = len(email_ids)
-            
-            # Limit results
-            email_ids = email_ids[-max_results:] if total > max_results else email_ids
-            
-            print(f"📬 Found {len(email_ids)} emails (total: {total})")
-            
-            emails = []
-            for i, email_id in enumerate(reversed(email_ids)):  # Most recent first
-                try:
-                    email_data = self._fetch_email_details(email_id)
-                    if email_data:
-                        emails.append(email_data)
-                        if (i + 1) % 10 == 0:
-                            print(f"   Loaded {i + 1}/{len(email_ids)} emails...")
-                except Exception as e:
-                    print(f"⚠️ Error loading email {email_id}: {str(e)}")
-                    continue
-            
-            return emails
-            
+            with self.pool.connection() as conn:
+                uids = self._search_uids(conn, mailbox, search_query, since_state, None)
+                return mailbox, self._folder_prefix(conn), uids
         except Exception as e:
-            print(f"❌ Error fetching emails: {str(e)}")
-            return []
+            print(f"❌ Error searching {mailbox}: {str(e)}")
+            return mailbox, None, []
     
-    def _fetch_email_details(self, email_id) -> Optional[Dict]:
-        """Fetch detailed email information"""
-        try:
-            status, msg_data = self.connection.fetch(email_id, '(RFC822)')
-            
-            if status != 'OK':
-                return None
-            
-            # Parse email
-            email_body = msg_data[0][1]
-            email_message = email.message_from_bytes(email_body)
-            
-            # Decode subject
-            subject = self._decode_header(email_message['Subject'])
-            from_email = self._decode_header(email_message['From'])
-            to_email = self._decode_header(email_message['To'])
-            cc_email = self._decode_header(email_message.get('Cc', ''))
-            date_str = email_message['Date']
-            
-            # Get email body
-            body_plain, body_html = self._get_email_body(email_message)
-            
-            # Get attachments
-            attachments = self._get_attachments(email_message, email_id)
-            
-            return {
-                'id': email_id.decode() if isinstance(email_id, bytes) else str(email_id),
-                'subject': subject or '(No Subject)',
-                'from': from_email or '',
-                'to': to_email or '',
-                'cc': cc_email or '',
-                'date': date_str or '',
-                'body': body_plain or '',
-                'body_html': body_html or '',
-                'signature': '',  # Extract if needed
-                'attachments': attachments
-            }
+    @staticmethod
+    def _id_pages(results: List[Tuple[str, Optional[str], List[int]]], limit: Optional[int],
+                  start_mailbox: Optional[str], start_uid: Optional[int]) -> Iterator[Tuple[Optional[str], List[str]]]:
+        """Page per-folder search results in folder order, from a resumed page on"""
+        page_size = max(1, settings.IMAP_FETCH_BATCH_SIZE)
+        listed = 0
+        for mailbox, prefix, uids in results:
+            if limit is not None and listed >= limit:
+                return
+            if mailbox == start_mailbox:
+                uids = [uid for uid in uids if uid <= start_uid]
+            if limit is not None:
+                uids = uids[:limit - listed]
             
-        except Exception as e:
-            print(f"Error parsing email: {str(e)}")
-            return None
+            for start in range(0, len(uids), page_size):
+                page = uids[start:start + page_size]
+                listed += len(page)
+                yield f"{page[0]}:{mailbox}", [f"{prefix}-{uid}" for uid in page]
     
-    def _decode_header(self, header_value) -> str:
-        """Decode email header"""
-        if not header_value:
-            return ''
-        
-        decoded_parts = decode_header(header_value)
-        header_text = ''
-        
-        for part, encoding in decoded_parts:
-            if isinstance(part, bytes):
-                header_text += part.decode(encoding or 'utf-8', errors='ignore')
-            else:
-                header_text += str(part)
+    @staticmethod
+    def _page_position(page_token: Optional[str]) -> Tuple[Optional[str], Optional[int]]:
+        """(mailbox, highest UID) a page token resumes from"""
+        if not page_token:
+            return None, None
+        uid, _, mailbox = page_token.partition(':')
+        return mailbox, int(uid)
+    
+    def _folders_from(self, mailbox: Optional[str]) -> List[str]:
+        """The scanned folders, starting at `mailbox` when resuming"""
+        if mailbox in self.mailboxes:
+            return self.mailboxes[self.mailboxes.index(mailbox):]
+        return self.mailboxes
+    
+    def get_email_details_batch(self, msg_ids: List[str]) -> List[Dict]:
+        """
+        Load listed messages (headers, text bodies and attachment list), in
+        the order given; IDs from a folder version not listed by this service
+        (e.g. UIDVALIDITY changed since) are left out
+        """
+        if not self.pool:
+            raise ValueError("Not connected to IMAP server")
         
-        return header_text
+        emails = {}
+        batch_size = max(1, settings.IMAP_FETCH_BATCH_SIZE)
+        with self.pool.connection() as conn:
+            for mailbox, uids in self._uids_by_folder(msg_ids).items():
+                conn.select(mailbox)
+                for batch, message_set in uid_sets(uids, batch_size):
+                    for email_data in self._fetch_batch(conn, batch, message_set):
+                        emails[email_data['id']] = email_data
+        return [emails[msg_id] for msg_id in msg_ids if msg_id in emails]
     
-    def _get_email_body(self, email_message) -> tuple:
-        """Extract plain text and HTML body from email"""
-        body_plain = ''
-        body_html = ''
+    def _uids_by_folder(self, msg_ids: List[str]) -> Dict[str, List[int]]:
+        """The UIDs of message IDs, grouped by the folder they were listed from"""
+        folders: Dict[str, List[int]] = {}
+        for msg_id in msg_ids:
+            prefix, _, uid = msg_id.rpartition('-')
+            mailbox = self._folders.get(prefix)
+            if mailbox is None or not uid.isdigit():
+                print(f"⚠️ Unknown IMAP message {msg_id}")
+                continue
+            folders.setdefault(mailbox, []).append(int(uid))
+        return folders
+    
+    def _search_uids(self, conn: IMAPConnection, mailbox: str, search_query: str,
+                     since_state: Optional[Dict], max_results: Optional[int]) -> List[int]:
+        """UID SEARCH one folder, newest first (above its synced UID with since_state)"""
+        conn.select(mailbox)
+        last_uid = self._last_synced_uid(conn, since_state)
+        search_query = self._search_criteria(search_query, last_uid)
         
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get('Content-Disposition', ''))
-                
-                # Skip attachments
-                if 'attachment' in content_disposition:
-                    continue
-                
-                try:
-                    body = part.get_payload(decode=True)
-                    if body:
-                        if content_type == 'text/plain' and not body_plain:
-                            body_plain = body.decode('utf-8', errors='ignore')
-                        elif content_type == 'text/html' and not body_html:
-                            body_html = body.decode('utf-8', errors='ignore')
-                except:
-                    continue
+        # Search for emails
+        print(f"🔍 Searching {mailbox} with query: {search_query}")
+        if search_query.isascii():
+            status, messages = conn.imap.uid('SEARCH', None, search_query)
         else:
-            # Not multipart
-            content_type = email_message.get_content_type()
-            body = email_message.get_payload(decode=True)
-            if body:
-                decoded_body = body.decode('utf-8', errors='ignore')
-                if content_type == 'text/html':
-                    body_html = decoded_body
-                else:
-                    body_plain = decoded_body
+            # imaplib encodes str arguments as ASCII; bytes go out as they are
+            status, messages = conn.imap.uid('SEARCH', *SEARCH_CHARSET, search_query.encode('utf-8'))
+        
+        if status != 'OK':
+            print(f"❌ No messages found in {mailbox}")
+            return []
         
-        return body_plain, body_html
+        return self._newest_uids(messages, last_uid, max_results)
     
-    def _get_attachments(self, email_message, email_id) -> List[Dict]:
-        """Extract attachment metadata from email"""
-        attachments = []
+    def get_sync_state(self) -> Dict[str, Dict[str, int]]:
+        """
+        The position of each scanned folder to sync from next time:
+        {mailbox: {'uidvalidity': ..., 'last_uid': ...}}, read with STATUS
+        """
+        if not self.pool:
+            raise ValueError("Not connected to IMAP server")
         
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                content_disposition = str(part.get('Content-Disposition', ''))
-                
-                if 'attachment' in content_disposition:
-                    filename = part.get_filename()
-                    if filename:
-                        filename = self._decode_header(filename)
-                        attachments.append({
-                            'filename': filename,
-                            'mimeType': part.get_content_type(),
-                            'attachmentId': f"{email_id}_{len(attachments)}",
-                            'size': len(part.get_payload(decode=True) or b''),
-                            '_part': part  # Store part for later download
-                        })
+        state = {}
+        with self.pool.connection() as conn:
+            for mailbox in self.mailboxes:
+                status, data = conn.imap.status(quote_string(mailbox), '(UIDVALIDITY UIDNEXT)')
+                if status != 'OK':
+                    raise imaplib.IMAP4.error(f"STATUS {mailbox} failed: {data}")
+                state[mailbox] = self._sync_state(data)
+        return state
+    
+    @staticmethod
+    def _sync_state(status_data: List) -> Dict[str, int]:
+        values = re.findall(rb'(UIDVALIDITY|UIDNEXT) (\d+)', b' '.join(d for d in status_data if d))
+        items = {key.decode(): int(value) for key, value in values}
+        return {
+            'uidvalidity': items['UIDVALIDITY'],
+            'last_uid': items['UIDNEXT'] - 1,
+        }
+    
+    @staticmethod
+    def _search_criteria(search_query: str, last_uid: Optional[int]) -> str:
+        if last_uid is None:
+            return search_query
+        return f"UID {last_uid + 1}:* {search_query}"
+    
+    @staticmethod
+    def _newest_uids(search_data: List, last_uid: Optional[int], max_results: Optional[int]) -> List[int]:
+        """UIDs from a UID SEARCH response, at most max_results, most recent first"""
+        uids = [int(uid) for line in search_data if line for uid in line.split()]
+        if last_uid is not None:
+            # n:* always matches the highest UID, even when it is below n
+            uids = [uid for uid in uids if uid > last_uid]
+        total = len(uids)
         
-        return attachments
+        uids = uids[-max_results:] if max_results is not None and total > max_results else uids
+        uids.reverse()
+        
+        print(f"📬 Found {len(uids)} emails (total: {total})")
+        return uids
     
-    def download_attachment(self, attachment_data: Dict) -> Optional[bytes]:
-        """Download attachment from email"""
-        try:
-            if '_part' in attachment_data:
-                return attachment_data['_part'].get_payload(decode=True)
+    def _last_synced_uid(self, conn: IMAPConnection, since_state: Optional[Dict]) -> Optional[int]:
+        """The highest UID already synced for the selected mailbox, if still valid"""
+        state = (since_state or {}).get(conn.selected)
+        if not state:
+            return None
+        if state.get('uidvalidity') != conn.uid_validity:
+            print(f"⚠️ UIDVALIDITY of {conn.selected} changed - rescanning the whole mailbox")
             return None
+        return state.get('last_uid')
+    
+    def _message_id(self, conn: IMAPConnection, uid: int) -> str:
+        """
+        Stable message ID: the UID qualified by account, mailbox and UIDVALIDITY,
+        since UIDs are only unique within one mailbox version
+        """
+        return f"{self._folder_prefix(conn)}-{uid}"
+    
+    def _folder_prefix(self, conn: IMAPConnection) -> str:
+        """The message ID prefix of the selected mailbox version (remembered for get_email_details_batch)"""
+        scope = f"{(self.email_address or '').lower()}\0{conn.selected}\0{conn.uid_validity}"
+        prefix = f"imap-{hashlib.sha1(scope.encode('utf-8')).hexdigest()[:12]}"
+        self._folders[prefix] = conn.selected
+        return prefix
+    
+    @staticmethod
+    def _uid_fetch(conn: IMAPConnection, message_set: str, items: str) -> List[Dict]:
+        status, data = conn.imap.uid('FETCH', message_set, items)
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"UID FETCH {items} failed: {status}")
+        return [m for m in parse_fetch_response(data) if 'UID' in m]
+    
+    def _fetch_batch(self, conn: IMAPConnection, uids: List[int], message_set: str) -> List[Dict]:
+        """Fetch a batch of messages: structure and headers, then just the text parts"""
+        emails, text_fetches = self._plan_text_fetches(conn, self._uid_fetch(conn, message_set, STRUCTURE_ITEMS))
+        for section_set, items in text_fetches:
+            self._fill_bodies(emails, self._uid_fetch(conn, section_set, items))
+        return [emails[uid][0] for uid in uids if uid in emails]
+    
+    def _plan_text_fetches(self, conn: IMAPConnection, messages: List[Dict]) -> tuple:
+        """
+        Email dicts (without bodies) for fetched structures, keyed by UID with
+        their text parts, and the (message set, items) FETCHes for the bodies
+        """
+        # Messages with the same text sections share one FETCH
+        emails = {}
+        by_sections: Dict[tuple, List[int]] = {}
+        for message in messages:
+            uid = message['UID']
+            parts = body_parts(message.get('BODYSTRUCTURE') or [])
+            email_data = self._email_details(conn, uid, message, parts)
+            emails[uid] = (email_data, self._text_parts(parts))
+            sections = tuple(part['section'] for part in emails[uid][1].values())
+            if sections:
+                by_sections.setdefault(sections, []).append(uid)
+        
+        fetches = [
+            (
+                ','.join(str(uid) for uid in section_uids),
+                "(UID " + ' '.join(f"BODY.PEEK[{section}]" for section in sections) + ")",
+            )
+            for sections, section_uids in by_sections.items()
+        ]
+        return emails, fetches
+    
+    @staticmethod
+    def _fill_bodies(emails: Dict[int, tuple], messages: List[Dict]) -> None:
+        """Decode fetched text sections into the planned email dicts"""
+        for message in messages:
+            if message['UID'] not in emails:
+                continue
+            email_data, text_parts = emails[message['UID']]
+            for kind, part in text_parts.items():
+                body = decode_part(message.get(f"BODY[{part['section']}]"), part['encoding'])
+                email_data['body' if kind == 'text/plain' else 'body_html'] = body.decode(
+                    _charset(part['charset']), errors='ignore'
+                )
+    
+    def _email_details(self, conn: IMAPConnection, uid: int, message: Dict, parts: List[Dict]) -> Dict:
+        """Email dict from fetched headers and BODYSTRUCTURE (bodies filled in later)"""
+        headers = parse_headers(message.get(f"BODY[{HEADER_FIELDS}]"))
+        return {
+            'id': self._message_id(conn, uid),
+            'subject': headers.get('subject') or '(No Subject)',
+            'from': headers.get('from', ''),
+            'to': headers.get('to', ''),
+            'cc': headers.get('cc', ''),
+            'date': headers.get('date', ''),
+            'body': '',
+            'body_html': '',
+            'signature': '',  # Extract if needed
+            'attachments': self._get_attachments(conn, uid, parts),
+        }
+    
+    @staticmethod
+    def _text_parts(parts: List[Dict]) -> Dict[str, Dict]:
+        """The first inline text/plain and text/html parts"""
+        text_parts = {}
+        for part in parts:
+            if part['attachment'] or part['type'] not in ('text/plain', 'text/html'):
+                continue
+            text_parts.setdefault(part['type'], part)
+        return text_parts
+    
+    def _decode_header(self, header_value) -> str:
+        """Decode email header"""
+        return decode_mime_header(header_value)
+    
+    def _get_attachments(self, conn: IMAPConnection, uid: int, parts: List[Dict]) -> List[Dict]:
+        """Attachment metadata from BODYSTRUCTURE; attachmentId is '<mailbox>:<uid>:<section>'"""
+        return [
+            {
+                'filename': part['filename'],
+                'mimeType': part['type'],
+                'attachmentId': f"{conn.selected}:{uid}:{part['section']}",
+                'size': decoded_size(part),
+            }
+            for part in parts
+            if part['attachment'] and part['filename']
+        ]
+    
+    def download_attachment(self, msg_id: str, attachment_id: str) -> Optional[bytes]:
+        """Download one attachment part with BODY.PEEK[section]"""
+        try:
+            mailbox, uid, section, items = self._attachment_items(attachment_id)
+            with self.pool.connection() as conn:
+                conn.select(mailbox)
+                messages = self._uid_fetch(conn, uid, items)
+            return self._decode_attachment(messages, section)
         except Exception as e:
             print(f"Error downloading attachment: {str(e)}")
             return None
     
+    def _attachment_items(self, attachment_id: str) -> tuple:
+        """(mailbox, uid, section, FETCH items) for an attachmentId"""
+        # Mailbox names may contain ':' - UIDs and section numbers never do
+        rest, _, section = attachment_id.rpartition(':')
+        mailbox, _, uid = rest.rpartition(':')
+        return mailbox or self.mailboxes[0], uid, section, f"(UID BODY.PEEK[{section}.MIME] BODY.PEEK[{section}])"
+    
+    @staticmethod
+    def _decode_attachment(messages: List[Dict], section: str) -> Optional[bytes]:
+        if not messages:
+            return None
+        mime_headers = parse_headers(messages[0].get(f"BODY[{section}.MIME]"))
+        return decode_part(messages[0].get(f"BODY[{section}]"), mime_headers.get('content-transfer-encoding', ''))
+    
     def get_user_profile(self) -> Dict:
         """Get user profile information"""
         return {
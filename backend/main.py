@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.responses import FileResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from typing import List, Optional
@@ -11,39 +11,36 @@ import uuid
 from datetime import datetime
 from pathlib import Path
 import asyncio
+import json
 from bson import ObjectId
 
 from database import init_db, shutdown_db, Candidate, EmailConfig, User
 from beanie.odm.fields import PydanticObjectId
 from gmail_service import GmailService
 from imap_service import IMAPService
-from extractor import DataExtractor
+from imap_async import AsyncIMAPService, async_imap_pools
+from imap_idle import imap_idle
+from imap_pool import imap_pools
+from parser_pool import ParserPool
 from config import settings
-from utils import generate_unique_id, check_duplicate_candidate
+from scan_jobs import (
+    enqueue_scan, find_scan_job, has_active_job, get_job_progress, dismiss_finished_jobs,
+    new_progress, progress_deltas,
+)
+from worker import ScanWorker
+from gmail_async import close_http_client
+from gmail_pool import gmail_services
+from credential_manager import credential_manager
+from scan_scheduler import ScanScheduler
+from scan_query import ScanQueryOptions, to_gmail_query, to_imap_criteria, estimate_scan_cost
+from scan_runner import create_user_gmail_service
+from scan_pipeline import DEFAULT_QUERY
+from utils import call_async
 from oauth_handler import WebOAuthHandler
 from session_manager import SessionManager
 
 app = FastAPI(title="Email-to-Candidate Automation")
 
-# Store current batch_id for tracking
-current_batch_id: Optional[str] = None
-
-# Scan progress tracking
-scan_progress = {
-    "batch_id": None,
-    "status": "idle",  # idle, fetching, processing, complete, error
-    "total_emails": 0,
-    "processed_emails": 0,
-    "current_subject": "",
-    "candidates_added": 0,
-    "skipped": 0,
-    "errors": 0,
-    "message": ""
-}
-
-# Current recruiter ID for tracking who is scanning
-current_recruiter_id: Optional[str] = None
-
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -85,6 +82,17 @@ async def current_user_dependency(
     
     return user
 
+async def optional_user_dependency(
+    authorization: Optional[str] = Header(None),
+) -> Optional[User]:
+    """Like current_user_dependency, but returns None instead of failing when unauthenticated"""
+    if not authorization:
+        return None
+    try:
+        return await current_user_dependency(authorization)
+    except HTTPException:
+        return None
+
 # Create upload directory
 Path(settings.UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
 
@@ -94,7 +102,11 @@ class EmailConfigRequest(BaseModel):
 
 class ScanRequest(BaseModel):
     search_query: Optional[str] = None
+    options: Optional[ScanQueryOptions] = None  # Structured filters, compiled server-side (overrides search_query)
     hours_back: Optional[int] = None
+    max_emails: Optional[int] = None  # Overall cap for this scan (default: SCAN_MAX_EMAILS)
+    incremental: bool = False  # Only scan mail added since the last sync (Gmail history; no query or time range)
+    thread_mode: bool = False  # Fetch whole conversations (one threads.get per thread)
     recruiter_id: Optional[str] = None  # Who is performing the scan (Allow int or str)
 
 class CVDataUpdate(BaseModel):
@@ -164,11 +176,21 @@ class CandidateDetailResponse(BaseModel):
 
 # Services
 gmail_service = GmailService()
-imap_service = IMAPService()
-extractor = DataExtractor()
+parser_pool = ParserPool()
 
 # Store current email service being used
-current_email_service = None  # Will be gmail_service or imap_service
+current_email_service = None  # Will be gmail_service or the last logged-in IMAPService
+
+# Scan worker inside the API process (see SCAN_WORKER_IN_API)
+scan_worker = ScanWorker(parser_pool, fallback_service=lambda: gmail_service)
+scan_worker_task: Optional[asyncio.Task] = None
+
+# Periodic scans of all connected Gmail accounts (see SCAN_SCHEDULER_ENABLED)
+scan_scheduler = ScanScheduler()
+scan_scheduler_task: Optional[asyncio.Task] = None
+
+# Ahead-of-expiry refresh of cached Gmail credentials
+token_refresh_task: Optional[asyncio.Task] = None
 
 @app.on_event("startup")
 async def startup_event():
@@ -176,10 +198,32 @@ async def startup_event():
     print("🚀 Starting Email-to-Candidate Automation System...")
     await init_db()
     print("✅ MongoDB/Beanie initialized")
+    await parser_pool.start()
+    
+    global scan_worker_task, scan_scheduler_task, token_refresh_task
+    token_refresh_task = asyncio.create_task(credential_manager.run())
+    if settings.SCAN_WORKER_IN_API:
+        scan_worker_task = asyncio.create_task(scan_worker.run())
+    if settings.SCAN_SCHEDULER_ENABLED:
+        scan_scheduler_task = asyncio.create_task(scan_scheduler.run())
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    credential_manager.stop()
+    if token_refresh_task:
+        token_refresh_task.cancel()
+    scan_scheduler.stop()
+    if scan_scheduler_task:
+        scan_scheduler_task.cancel()
+    scan_worker.stop()
+    if scan_worker_task:
+        scan_worker_task.cancel()
+    imap_idle.stop_all()
+    imap_pools.close_all()
+    async_imap_pools.close_all()
+    parser_pool.shutdown()
+    await close_http_client()
     await shutdown_db()
 
 
@@ -243,13 +287,10 @@ async def configure_email(
 
 @app.post("/api/scan")
 async def trigger_scan(
-    background_tasks: BackgroundTasks, 
     request: ScanRequest = None,
     current_user: User = Depends(current_user_dependency),
 ):
     """Manually trigger email scan - uses current user's Gmail tokens"""
-    global current_batch_id, current_recruiter_id
-    
     print(f"📧 Scan initiated by user: {current_user.email}")
     
     # Verify user has Gmail connected with proper tokens
@@ -268,33 +309,131 @@ async def trigger_scan(
     
     search_query = request.search_query if request else None
     hours_back = request.hours_back if request else None
+    if request and request.options:
+        # The compiled query carries its own date range
+        search_query = to_gmail_query(request.options)
+        hours_back = None
+    max_emails = request.max_emails if request else None
+    incremental = request.incremental if request else False
+    if incremental and (search_query or hours_back is not None):
+        # History scans list everything new in GMAIL_HISTORY_LABEL, so a filter would be ignored
+        raise HTTPException(
+            status_code=400,
+            detail="Incremental scans cover all new mail since the last sync and cannot be combined with a search query or time range."
+        )
     recruiter_id = str(current_user.id)  # Use current user's ID
     
     # Generate new batch ID for this scan
-    current_batch_id = str(uuid.uuid4())[:8]
-    current_recruiter_id = recruiter_id
+    batch_id = str(uuid.uuid4())[:8]
     
-    # Pass user id to background task
-    background_tasks.add_task(
-        scan_emails_task, 
-        search_query, 
-        hours_back, 
-        current_batch_id, 
-        recruiter_id,
-        str(current_user.id),  # user_id
+    # Queue the scan - a scan worker picks it up
+    await enqueue_scan(
+        batch_id,
+        user_id=str(current_user.id),
+        recruiter_id=recruiter_id,
+        search_query=search_query,
+        hours_back=hours_back,
+        max_emails=max_emails,
+        incremental=incremental,
+        thread_mode=request.thread_mode if request else False,
     )
     
     return {
         "success": True, 
         "message": f"Email scan started for {current_user.email}", 
         "search_query": search_query,
-        "batch_id": current_batch_id
+        "batch_id": batch_id
+    }
+
+@app.post("/api/scan/plan")
+async def plan_scan(
+    request: ScanRequest,
+    current_user: User = Depends(current_user_dependency),
+):
+    """
+    Compile a scan's query and estimate its size and Gmail API cost without running it
+    
+    Uses Gmail's resultSizeEstimate, which is approximate for large result sets.
+    """
+    if not current_user.gmail_access_token or not current_user.gmail_refresh_token:
+        raise HTTPException(status_code=400, detail="Gmail not connected")
+    
+    if request.options:
+        search_query, hours_back = to_gmail_query(request.options), None
+        imap_query = to_imap_criteria(request.options)
+    else:
+        search_query, hours_back = request.search_query or DEFAULT_QUERY, request.hours_back
+        imap_query = IMAPService().build_query(search_query, hours_back)
+    
+    try:
+        service = await create_user_gmail_service(current_user)
+        query = service.build_query(search_query, hours_back)
+        estimate = await call_async(service.estimate_result_size, query)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Could not query Gmail: {str(e)}")
+    
+    if request.max_emails is not None:
+        estimate = min(estimate, request.max_emails)
+    
+    return {
+        "query": query,
+        "imap_query": imap_query,
+        "result_size_estimate": estimate,
+        "cost": estimate_scan_cost(estimate),
     }
 
 @app.get("/api/scan-progress")
-async def get_scan_progress():
-    """Get real-time scan progress"""
-    return scan_progress
+async def get_scan_progress(
+    batch_id: Optional[str] = Query(None),
+    current_user: Optional[User] = Depends(optional_user_dependency),
+):
+    """Get scan progress for a batch (defaults to the latest scan)"""
+    record = await find_scan_job(batch_id, str(current_user.id) if current_user else None)
+    if not record:
+        if batch_id:
+            raise HTTPException(status_code=404, detail="Scan not found")
+        return new_progress()
+    return await get_job_progress(record)
+
+@app.get("/api/scan/quota-stats")
+async def get_quota_stats(
+    current_user: Optional[User] = Depends(optional_user_dependency),
+):
+    """Gmail quota limiter stats (units spent, throttling, retries) for the user's mailbox"""
+    service = gmail_services.peek(str(current_user.id)) if current_user else None
+    if service is None:
+        service = current_email_service or gmail_service
+    limiter = getattr(service, "limiter", None)
+    return limiter.stats() if limiter else {}
+
+@app.get("/api/scan-progress/stream")
+async def stream_scan_progress(
+    batch_id: Optional[str] = Query(None),
+    session_token: Optional[str] = Query(None),
+):
+    """
+    Server-Sent Events stream of scan progress
+    
+    The first event carries the full progress, later events only the fields that
+    changed. The stream ends once the scan is complete or failed. EventSource
+    cannot send headers, so the session token is passed as a query parameter.
+    """
+    user = None
+    if session_token:
+        user = await optional_user_dependency(f"Bearer {session_token}")
+    record = await find_scan_job(batch_id, str(user.id) if user else None)
+    if not record:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    
+    async def events():
+        async for delta in progress_deltas(lambda: get_job_progress(record)):
+            yield f"data: {json.dumps(delta, default=str)}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 class DeleteCandidatesRequest(BaseModel):
     """Request to delete selected candidates from database"""
@@ -602,9 +741,12 @@ async def login(request: LoginRequest = LoginRequest()):
         if request.method == 'imap' and request.email and request.password:
             print(f"🔐 IMAP login attempt for {request.email}")
             
-            # Connect via IMAP
-            imap_service.connect(request.email, request.password, request.provider)
+            # Connect via IMAP (opens the account's connection pool)
+            imap_service = AsyncIMAPService() if settings.IMAP_ASYNC_CLIENT else IMAPService()
+            await call_async(imap_service.connect, request.email, request.password, request.provider)
             current_email_service = imap_service
+            if settings.IMAP_IDLE_ENABLED:
+                imap_idle.start(imap_service.pool, _scan_new_imap_mail)
             
             # Get user profile
             user_info = imap_service.get_user_profile()
@@ -681,6 +823,8 @@ async def logout():
     
     # Disconnect from email service
     if current_email_service:
+        if isinstance(current_email_service, IMAPService):
+            imap_idle.stop(current_email_service.email_address)
         if hasattr(current_email_service, 'disconnect'):
             current_email_service.disconnect()
         current_email_service = None
@@ -773,6 +917,9 @@ async def google_oauth_callback(
             }
         )
         
+        # New tokens - drop the user's cached credentials and pooled Gmail service
+        credential_manager.invalidate(str(user.id))
+        
         # Create session
         session_token = SessionManager.create_session(user)
         
@@ -883,6 +1030,8 @@ async def disconnect_email():
     
     # Disconnect from email service
     if current_email_service:
+        if isinstance(current_email_service, IMAPService):
+            imap_idle.stop(current_email_service.email_address)
         if hasattr(current_email_service, 'disconnect'):
             current_email_service.disconnect()
         current_email_service = None
@@ -890,23 +1039,12 @@ async def disconnect_email():
     return {"success": True, "message": "Email disconnected"}
 
 @app.post("/api/reset-session")
-async def reset_session():
+async def reset_session(
+    current_user: Optional[User] = Depends(optional_user_dependency),
+):
     """Reset scan session without logging out"""
-    global scan_progress, current_batch_id
-    
-    # Reset scan progress
-    scan_progress = {
-        "batch_id": None,
-        "status": "idle",
-        "total_emails": 0,
-        "processed_emails": 0,
-        "current_subject": "",
-        "candidates_added": 0,
-        "skipped": 0,
-        "errors": 0,
-        "message": ""
-    }
-    current_batch_id = None
+    # Hide finished scans so progress starts from idle again
+    await dismiss_finished_jobs(str(current_user.id) if current_user else None)
     
     return {"success": True, "message": "Session reset successfully"}
 
@@ -949,16 +1087,32 @@ async def get_status():
 
 @app.post("/api/live-scan")
 async def live_scan(
-    background_tasks: BackgroundTasks,
+    current_user: Optional[User] = Depends(optional_user_dependency),
 ):
-    """Quick scan for new emails in the last 5 minutes (for live mode)"""
-    global current_batch_id
-    
+    """Quick scan for new emails (for live mode) - incremental via Gmail history when logged in"""
     # Use a special live batch ID
     live_batch_id = f"live-{str(uuid.uuid4())[:4]}"
     
-    # Scan only last 5 minutes of emails
-    background_tasks.add_task(scan_emails_task, "in:inbox", 1, live_batch_id, None, None)
+    if current_user and current_user.gmail_access_token and current_user.gmail_refresh_token:
+        # Only mail added since the last sync; falls back to the last hour if history expired
+        await enqueue_scan(
+            live_batch_id,
+            user_id=str(current_user.id),
+            recruiter_id=str(current_user.id),
+            search_query="in:inbox",
+            hours_back=1,
+            incremental=True,
+        )
+    else:
+        # Scan only the last hour of emails (IMAP: only UIDs above the last synced one)
+        imap_account = current_email_service.email_address if isinstance(current_email_service, IMAPService) else None
+        await enqueue_scan(
+            live_batch_id,
+            search_query="in:inbox",
+            hours_back=1,
+            incremental=imap_account is not None,
+            imap_account=imap_account,
+        )
     
     return {
         "success": True,
@@ -966,6 +1120,28 @@ async def live_scan(
         "batch_id": live_batch_id
     }
 
+async def _scan_new_imap_mail(email: str) -> None:
+    """IDLE callback: queue an incremental scan of an IMAP account that just received mail"""
+    user = await User.find_one(User.email == email)
+    if not user:
+        return
+    # One scan per account at a time; a scan queued after the running one picks up everything new
+    while await has_active_job(str(user.id), email):
+        await asyncio.sleep(settings.SCAN_WORKER_POLL_INTERVAL)
+    # Never synced: only recent mail, the scan then records where INBOX stands
+    first_sync = "INBOX" not in user.imap_sync_state
+    await enqueue_scan(
+        f"idle-{str(uuid.uuid4())[:8]}",
+        user_id=str(user.id),
+        recruiter_id=str(user.id),
+        search_query="in:inbox",
+        hours_back=settings.IMAP_IDLE_FIRST_SCAN_HOURS if first_sync else None,
+        max_emails=settings.IMAP_IDLE_FIRST_SCAN_MAX_EMAILS if first_sync else None,
+        incremental=True,
+        imap_account=email,
+    )
+    print(f"📬 New mail for {email} - incremental IMAP scan queued")
+
 @app.get("/api/latest-candidates")
 async def get_latest_candidates(
     since_id: Optional[str] = Query(None, description="Get candidates with _id greater than this"),
@@ -988,272 +1164,6 @@ async def get_latest_candidates(
     }
 
 
-# Background task
-async def scan_emails_task(
-    search_query: str = None,
-    hours_back: int = None,
-    batch_id: str = None,
-    recruiter_id: str | None = None,
-    user_id: str | None = None,
-):
-    """Scan emails using current user's Gmail tokens and save to database"""
-    global scan_progress, current_recruiter_id, current_email_service
-    
-    try:
-        # Import here to avoid circular dependency
-        from googleapiclient.discovery import build
-        
-        # Create user-specific Gmail service
-        user = None
-        if user_id:
-            try:
-                user = await User.get(PydanticObjectId(user_id))
-            except Exception:
-                user = None
-
-        if user and user.gmail_access_token and user.gmail_refresh_token:
-            print(f"📧 Creating Gmail service for {user.email}")
-            oauth_handler = WebOAuthHandler()
-            
-            try:
-                # Get user's credentials
-                creds = oauth_handler.get_credentials_from_tokens(
-                    access_token=user.gmail_access_token,
-                    refresh_token=user.gmail_refresh_token,
-                    token_expiry=user.gmail_token_expiry
-                )
-                
-                # Check if token was refreshed
-                if creds.token != user.gmail_access_token:
-                    await user.set({User.gmail_access_token: creds.token, User.gmail_token_expiry: creds.expiry})
-                    print(f"✅ Refreshed token for {user.email}")
-                
-                # Create GmailService with user's credentials
-                user_gmail_service = GmailService()
-                user_gmail_service.creds = creds
-                user_gmail_service.service = build('gmail', 'v1', credentials=creds)
-                email_service = user_gmail_service
-                current_email_service = user_gmail_service
-                print(f"✅ Gmail service created for {user.email}")
-                
-            except Exception as e:
-                print(f"❌ Failed to create Gmail service: {e}")
-                scan_progress = {
-                    "batch_id": batch_id,
-                    "status": "error",
-                    "message": f"Gmail authentication failed: {str(e)}"
-                }
-                return
-        else:
-            # Fallback to global email service (legacy)
-            email_service = current_email_service or gmail_service
-        
-        # Store recruiter_id for tracking
-        current_recruiter_id = recruiter_id
-        scan_progress = {
-            "batch_id": batch_id,
-            "status": "fetching",
-            "total_emails": 0,
-            "processed_emails": 0,
-            "current_subject": f"Connecting to {user.email if user else 'Gmail'}...",
-            "candidates_added": 0,
-            "skipped": 0,
-            "errors": 0,
-            "message": f"Fetching emails from {user.email if user else 'Gmail'}..."
-        }
-        
-        print(f"📧 Scanning for emails... (Batch: {batch_id})")
-        print(f"🔍 Search Query: '{search_query or 'None (using default job filter)'}'")
-        
-        # Get emails based on search query or default to job-related
-        if search_query:
-            emails = email_service.get_emails(search_query=search_query, hours_back=hours_back)
-        else:
-            # No query provided - use a basic job-related search
-            default_query = "(job OR application OR resume OR cv OR hiring)"
-            print(f"   Using default query: {default_query}")
-            emails = email_service.get_emails(search_query=default_query, hours_back=hours_back)
-        
-        total = len(emails)
-        scan_progress["total_emails"] = total
-        scan_progress["status"] = "processing"
-        scan_progress["message"] = f"Found {total} emails. Processing..."
-        print(f"Found {total} emails")
-        
-        for idx, email_data in enumerate(emails):
-            try:
-                # Update progress
-                scan_progress["processed_emails"] = idx + 1
-                scan_progress["current_subject"] = email_data.get('subject', 'No subject')[:50]
-                scan_progress["message"] = f"Processing {idx + 1}/{total}: {email_data.get('subject', '')[:30]}..."
-                
-                # Check if this email was already processed (by Gmail message ID)
-                existing_message = await check_duplicate_candidate(email_data["id"])
-                
-                if existing_message:
-                    scan_progress["skipped"] += 1
-                    print(f"⏭️  Skipping duplicate email ID: {email_data['id'][:20]}... (Unique ID: {existing_message.unique_id})")
-                    continue
-                
-                print(f"📨 Processing: {email_data['subject']}")
-                
-                # Extract info from email
-                email_extracted = extractor.extract_from_email(
-                    email_data.get('body', ''),
-                    email_data.get('signature', '')
-                )
-                
-                # Download attachment and extract data
-                resume_text = ""
-                resume_path = None
-                resume_filename = None
-                cv_data = None
-                spreadsheet_data = None
-                
-                attachments_list = email_data.get('attachments', [])
-                print(f"   📎 Attachments found: {len(attachments_list)}")
-                for att in attachments_list:
-                    print(f"      - {att.get('filename', 'unknown')}")
-                
-                for attachment in attachments_list:
-                    filename = attachment['filename'].lower()
-                    original_filename = attachment['filename']
-                    
-                    # Check for supported file types
-                    is_resume = filename.endswith(('.pdf', '.doc', '.docx'))
-                    is_spreadsheet = filename.endswith(('.csv', '.xlsx', '.xls'))
-                    is_image = filename.endswith(('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.gif'))
-                    
-                    print(f"   📄 Processing: {original_filename} (resume={is_resume}, spreadsheet={is_spreadsheet}, image={is_image})")
-                    
-                    if is_resume or is_spreadsheet or is_image:
-                        # Download attachment
-                        print(f"   ⬇️  Downloading attachment...")
-                        file_data = email_service.download_attachment(
-                            email_data['id'],
-                            attachment['attachmentId']
-                        )
-                        
-                        if file_data:
-                            print(f"   ✅ Downloaded {len(file_data)} bytes")
-                            # Save file
-                            resume_filename = attachment['filename']
-                            safe_filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{resume_filename}"
-                            resume_path = os.path.join(settings.UPLOAD_DIR, safe_filename)
-                            
-                            with open(resume_path, 'wb') as f:
-                                f.write(file_data)
-                            
-                            # Extract text based on file type
-                            print(f"   📄 Extracting text from {filename}...")
-                            if filename.endswith('.pdf'):
-                                resume_text = extractor.extract_text_from_pdf(resume_path)
-                            elif filename.endswith(('.doc', '.docx')):
-                                resume_text = extractor.extract_text_from_docx(resume_path)
-                            elif filename.endswith(('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.gif')):
-                                print(f"   🖼️  Running OCR on image...")
-                                resume_text = extractor.extract_text_from_image(resume_path)
-                                print(f"   ✅ OCR extracted {len(resume_text)} characters")
-                            
-                            # Always extract as RESUME (no document type detection)
-                            if resume_text:
-                                print(f"   🔍 Parsing resume data...")
-                                cv_data = extractor.extract_from_resume(resume_text)
-                                print(f"   ✅ Extracted: {cv_data.get('personal_info', {}).get('full_name', 'Unknown')}")
-                            else:
-                                print(f"   ⚠️ No text extracted from file")
-                                cv_data = None
-                            
-                            break  # Use first attachment found
-                
-                # Parse sender email for candidate email
-                from_email = email_data.get('from', '')
-                # Extract email from "Name <email@domain.com>" format
-                import re
-                email_match = re.search(r'<([^>]+)>', from_email)
-                candidate_email = email_match.group(1) if email_match else from_email
-                
-                # Try to get name from CV data, email extraction, or sender
-                candidate_name = ""
-                if cv_data and cv_data.get('personal_info', {}).get('full_name'):
-                    candidate_name = cv_data['personal_info']['full_name']
-                elif email_extracted.get('name'):
-                    candidate_name = email_extracted['name']
-                else:
-                    # Extract name from "Name <email>" format
-                    name_match = re.match(r'^([^<]+)', from_email)
-                    candidate_name = name_match.group(1).strip() if name_match else "Unknown"
-                
-                # Get phone from CV data or email extraction
-                candidate_phone = ""
-                if cv_data and cv_data.get('contact_details', {}).get('mobile_numbers'):
-                    candidate_phone = ', '.join(cv_data['contact_details']['mobile_numbers'])
-                elif email_extracted.get('phones'):
-                    candidate_phone = ', '.join(email_extracted['phones'])
-                
-                # Generate unique 10-character ID
-                email_date = email_data.get('date', datetime.now())
-                if isinstance(email_date, str):
-                    email_date = datetime.now()
-                
-                unique_id = generate_unique_id(
-                    email_data.get('subject', 'no-subject'),
-                    email_date,
-                    candidate_email
-                )
-                print(f"   🆔 Generated unique ID: {unique_id}")
-                
-                # Save candidate directly to database
-                candidate = Candidate(
-                    unique_id=unique_id,
-                    gmail_message_id=email_data['id'],
-                    batch_id=batch_id,
-                    recruiter_id=recruiter_id,
-                    name=candidate_name,
-                    email=candidate_email,
-                    phone=candidate_phone,
-                    email_subject=email_data.get('subject', ''),
-                    email_from=email_data.get('from', ''),
-                    email_to=email_data.get('to', ''),
-                    email_cc=email_data.get('cc', ''),
-                    email_body=email_data.get('body', ''),
-                    email_body_html=email_data.get('body_html', ''),
-                    email_signature=email_data.get('signature', ''),
-                    email_date=datetime.now(),
-                    resume_path=resume_path,
-                    resume_filename=resume_filename,
-                    resume_text=resume_text,
-                    cv_data=cv_data,
-                    extracted_phones=email_extracted.get('phones', []) or [],
-                    extracted_emails=email_extracted.get('emails', []) or [],
-                    extracted_links=email_extracted.get('other_links', []) or [],
-                    tags=['Scanned'],  # Auto-tag as scanned
-                )
-                
-                await candidate.insert()
-                scan_progress["candidates_added"] += 1
-                print(f"✅ Saved candidate to DB: {candidate_name} (ID: {unique_id})")
-            
-            except Exception as e:
-                scan_progress["errors"] += 1
-                print(f"❌ Error processing email: {str(e)}")
-                continue
-        
-        # Update last scan time
-        config = await EmailConfig.find_one()
-        if config:
-            await config.set({EmailConfig.last_scan: datetime.now()})
-        
-        # Mark scan as complete
-        scan_progress["status"] = "complete"
-        scan_progress["message"] = f"Scan complete! {scan_progress['candidates_added']} candidates saved to database."
-        print("✅ Email scan completed - all candidates saved to database")
-    
-    except Exception as e:
-        scan_progress["status"] = "error"
-        scan_progress["message"] = f"Error: {str(e)}"
-        print(f"❌ Scan error: {str(e)}")
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -8,9 +8,9 @@ from typing import Optional, Dict
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from google.auth.transport.requests import Request as GoogleRequest
-from googleapiclient.discovery import build
+from gmail_service import build_gmail_service
+from credential_manager import build_credentials
 from config import settings
-import json
 
 class WebOAuthHandler:
     """Handles web-based OAuth flow for multi-user authentication"""
@@ -77,7 +77,7 @@ class WebOAuthHandler:
         creds = flow.credentials
         
         # Get user info
-        service = build('gmail', 'v1', credentials=creds)
+        service = build_gmail_service(creds)
         profile = service.users().getProfile(userId='me').execute()
         user_email = profile.get('emailAddress')
         
@@ -99,14 +99,7 @@ class WebOAuthHandler:
         Returns:
             dict with new access token and expiry
         """
-        creds = Credentials(
-            token=None,
-            refresh_token=refresh_token,
-            token_uri='https://oauth2.googleapis.com/token',
-            client_id=self._get_client_id(),
-            client_secret=self._get_client_secret(),
-            scopes=self.scopes
-        )
+        creds = build_credentials(None, refresh_token)
         
         # Refresh the token
         creds.refresh(GoogleRequest())
@@ -129,32 +122,10 @@ class WebOAuthHandler:
         Returns:
             Google Credentials object ready for API calls
         """
-        creds = Credentials(
-            token=access_token,
-            refresh_token=refresh_token,
-            token_uri='https://oauth2.googleapis.com/token',
-            client_id=self._get_client_id(),
-            client_secret=self._get_client_secret(),
-            scopes=self.scopes
-        )
-        
-        if token_expiry:
-            creds.expiry = token_expiry
+        creds = build_credentials(access_token, refresh_token, token_expiry)
         
         # Auto-refresh if expired
         if creds.expired and creds.refresh_token:
             creds.refresh(GoogleRequest())
         
         return creds
-    
-    def _get_client_id(self) -> str:
-        """Extract client ID from credentials file"""
-        with open(settings.GMAIL_CREDENTIALS_FILE, 'r') as f:
-            creds_data = json.load(f)
-            return creds_data.get('web', creds_data.get('installed', {})).get('client_id')
-    
-    def _get_client_secret(self) -> str:
-        """Extract client secret from credentials file"""
-        with open(settings.GMAIL_CREDENTIALS_FILE, 'r') as f:
-            creds_data = json.load(f)
-            return creds_data.get('web', creds_data.get('installed', {})).get('client_secret')
@@ -0,0 +1,121 @@
+"""
+Process pool for resume text extraction and parsing
+
+PDF/DOCX/OCR extraction and the regex parser are CPU bound. Running them
+directly in the scan blocks the FastAPI event loop, so they run in worker
+processes that each build a ResumeParser once at start-up, and the scan
+awaits the results.
+"""
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+
+from config import settings
+from extractor import ResumeParser
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.gif')
+
+# One parser per process (built by the pool initializer in worker processes)
+_parser: Optional[ResumeParser] = None
+
+
+def _get_parser() -> ResumeParser:
+    global _parser
+    if _parser is None:
+        _parser = ResumeParser()
+    return _parser
+
+
+def _init_worker() -> None:
+    _get_parser()
+
+
+def _warm_up() -> int:
+    return os.getpid()
+
+
+def extract_text_from_file(file_path: str) -> str:
+    """Extract text from a saved attachment based on its extension"""
+    parser = _get_parser()
+    file_lower = file_path.lower()
+
+    if file_lower.endswith('.pdf'):
+        return parser.extract_text_from_pdf(file_path)
+    if file_lower.endswith(('.doc', '.docx')):
+        return parser.extract_text_from_docx(file_path)
+    if file_lower.endswith(IMAGE_EXTENSIONS):
+        return parser.extract_text_from_image(file_path)
+    return ""
+
+
+def parse_resume(resume_text: str) -> Dict:
+    return _get_parser().extract_from_resume(resume_text)
+
+
+def parse_email(email_body: str, email_signature: str = "") -> Dict:
+    return _get_parser().extract_from_email(email_body, email_signature)
+
+
+class ParserPool:
+    """
+    Runs ResumeParser work in a pool of pre-warmed worker processes.
+
+    With 0 workers the same functions run in a thread instead, which keeps
+    the event loop free but stays on one core.
+    """
+
+    def __init__(self, workers: Optional[int] = None):
+        if workers is None:
+            workers = settings.PARSER_POOL_WORKERS
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = max(0, workers)
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def mode(self) -> str:
+        return "process" if self.workers > 0 else "thread"
+
+    async def start(self) -> None:
+        """Start worker processes and wait until each has built its parser"""
+        if self.workers == 0 or self._executor is not None:
+            return
+
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(
+            *(loop.run_in_executor(self._executor, _warm_up) for _ in range(self.workers))
+        )
+        print(f"✅ Parser pool ready ({len(set(pids))} worker processes)")
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def extract_text(self, file_path: str) -> str:
+        return await self._run(extract_text_from_file, file_path)
+
+    async def parse(self, resume_text: str) -> Dict:
+        return await self._run(parse_resume, resume_text)
+
+    async def parse_email(self, email_body: str, email_signature: str = "") -> Dict:
+        return await self._run(parse_email, email_body, email_signature)
+
+    async def _run(self, fn, *args):
+        if self._executor is None:
+            return await asyncio.to_thread(fn, *args)
+
+        executor = self._executor
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OCR ran out of memory) - replace the pool for later items
+            if self._executor is executor:
+                print("⚠️ Parser worker crashed, restarting pool...")
+                self.shutdown()
+                await self.start()
+            raise
@@ -0,0 +1,316 @@
+"""
+Scan job queue and progress registry
+
+Scans are queued as ScanJobRecord documents and claimed by workers through a
+time-limited lease (see worker.py). A worker keeps the live progress of the
+jobs it runs in the in-process registry and periodically saves progress,
+lease and checkpoint to MongoDB, so progress is visible from any process and
+a crashed scan is picked up again once its lease expires.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from pymongo import ReturnDocument
+
+from config import settings
+from database import ScanJobRecord
+from scan_pipeline import new_stage_progress
+
+TERMINAL_STATUSES = ("complete", "error")
+
+
+def new_progress(batch_id: Optional[str] = None) -> Dict:
+    return {
+        "batch_id": batch_id,
+        "status": "idle",  # idle, queued, fetching, processing, complete, error
+        "total_emails": 0,
+        "processed_emails": 0,
+        "current_subject": "",
+        "candidates_added": 0,
+        "already_existing": 0,
+        "skipped": 0,
+        "errors": 0,
+        "message": "",
+        "stages": new_stage_progress(),
+    }
+
+
+class ScanJob:
+    def __init__(self, batch_id: str, user_id: Optional[str] = None):
+        self.batch_id = batch_id
+        self.user_id = user_id
+        self.progress = new_progress(batch_id)
+        self.created_at = time.time()
+
+    @property
+    def finished(self) -> bool:
+        return self.progress.get("status") in TERMINAL_STATUSES
+
+
+class ScanJobRegistry:
+    """Scan jobs running in this process, by batch id"""
+
+    def __init__(self):
+        self._jobs: Dict[str, ScanJob] = {}
+
+    def create(self, batch_id: str, user_id: Optional[str] = None) -> ScanJob:
+        self._prune()
+        job = ScanJob(batch_id, user_id)
+        self._jobs[batch_id] = job
+        return job
+
+    def get(self, batch_id: str) -> Optional[ScanJob]:
+        return self._jobs.get(batch_id)
+
+    def active(self) -> List[ScanJob]:
+        return [job for job in self._jobs.values() if not job.finished]
+
+    def _prune(self) -> None:
+        """Drop finished jobs past the retention window"""
+        cutoff = time.time() - settings.SCAN_JOB_RETENTION_SECONDS
+        for batch_id in [b for b, j in self._jobs.items() if j.finished and j.created_at < cutoff]:
+            del self._jobs[batch_id]
+
+
+local_jobs = ScanJobRegistry()
+
+
+# ----------------------------------------------------------------------
+# Queue
+# ----------------------------------------------------------------------
+
+async def enqueue_scan(
+    batch_id: str,
+    user_id: Optional[str] = None,
+    recruiter_id: Optional[str] = None,
+    search_query: Optional[str] = None,
+    hours_back: Optional[int] = None,
+    max_emails: Optional[int] = None,
+    incremental: bool = False,
+    scheduled: bool = False,
+    thread_mode: bool = False,
+    imap_account: Optional[str] = None,
+) -> ScanJobRecord:
+    """Queue a scan; with imap_account it scans that connected IMAP account instead of Gmail"""
+    progress = new_progress(batch_id)
+    progress.update({"status": "queued", "message": "Waiting for a scan worker..."})
+
+    record = ScanJobRecord(
+        batch_id=batch_id,
+        user_id=user_id,
+        recruiter_id=recruiter_id,
+        search_query=search_query,
+        hours_back=hours_back,
+        max_emails=max_emails,
+        incremental=incremental,
+        scheduled=scheduled,
+        thread_mode=thread_mode,
+        provider="imap" if imap_account else "gmail",
+        imap_account=imap_account.lower() if imap_account else None,
+        progress=progress,
+    )
+    await record.insert()
+    return record
+
+
+async def claim_next_job(owner: str, imap_accounts: Iterable[str] = ()) -> Optional[ScanJobRecord]:
+    """
+    Atomically take the oldest queued job, or a running one whose lease expired.
+    User-triggered scans are claimed before scheduled ones. IMAP scans are only
+    claimed for the accounts in imap_accounts (those connected in this process).
+    """
+    now = datetime.utcnow()
+    doc = await ScanJobRecord.get_motor_collection().find_one_and_update(
+        {
+            "$and": [
+                {"$or": [
+                    {"status": "queued"},
+                    {"status": "running", "lease_expires_at": {"$lt": now}},
+                ]},
+                {"$or": [
+                    {"provider": {"$ne": "imap"}},
+                    {"imap_account": {"$in": [account.lower() for account in imap_accounts]}},
+                ]},
+            ],
+            "attempts": {"$lt": settings.SCAN_JOB_MAX_ATTEMPTS},
+        },
+        {
+            "$set": {
+                "status": "running",
+                "lease_owner": owner,
+                "lease_expires_at": now + timedelta(seconds=settings.SCAN_JOB_LEASE_SECONDS),
+                "started_at": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("scheduled", 1), ("created_at", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+    return await ScanJobRecord.get(doc["_id"]) if doc else None
+
+
+async def fail_abandoned_jobs() -> int:
+    """Give up on jobs whose lease expired after their last allowed attempt"""
+    result = await ScanJobRecord.get_motor_collection().update_many(
+        {
+            "status": "running",
+            "lease_expires_at": {"$lt": datetime.utcnow()},
+            "attempts": {"$gte": settings.SCAN_JOB_MAX_ATTEMPTS},
+        },
+        {
+            "$set": {
+                "status": "error",
+                "progress.status": "error",
+                "progress.message": "Scan stopped responding and was abandoned",
+                "finished_at": datetime.utcnow(),
+            }
+        },
+    )
+    return result.modified_count
+
+
+async def active_job_user_ids() -> List[str]:
+    """Users with a scan queued or running"""
+    user_ids = await ScanJobRecord.get_motor_collection().distinct(
+        "user_id", {"status": {"$in": ["queued", "running"]}}
+    )
+    return [uid for uid in user_ids if uid]
+
+
+async def has_active_job(user_id: Optional[str] = None, imap_account: Optional[str] = None) -> bool:
+    """
+    Whether a scan of this user's mailbox or of this IMAP account is queued or
+    running (live scans of an IMAP account carry no user id)
+    """
+    mailbox = []
+    if user_id:
+        mailbox.append({"user_id": user_id})
+    if imap_account:
+        mailbox.append({"imap_account": imap_account.lower()})
+    if not mailbox:
+        return False
+    return await ScanJobRecord.get_motor_collection().count_documents(
+        {"status": {"$in": ["queued", "running"]}, "$or": mailbox}, limit=1
+    ) > 0
+
+
+async def count_active_scheduled_jobs() -> int:
+    return await ScanJobRecord.get_motor_collection().count_documents(
+        {"status": {"$in": ["queued", "running"]}, "scheduled": True}
+    )
+
+
+async def save_job_state(
+    record: ScanJobRecord,
+    owner: str,
+    progress: Dict,
+    checkpoint: Optional[Dict] = None,
+    **fields,
+) -> bool:
+    """Renew the lease and save progress (and checkpoint); False if the lease was lost"""
+    update = {
+        "progress": progress,
+        "lease_expires_at": datetime.utcnow() + timedelta(seconds=settings.SCAN_JOB_LEASE_SECONDS),
+        **fields,
+    }
+    if checkpoint is not None:
+        update["checkpoint"] = checkpoint
+
+    result = await ScanJobRecord.get_motor_collection().update_one(
+        {"_id": record.id, "lease_owner": owner},
+        {"$set": update},
+    )
+    return result.matched_count == 1
+
+
+async def finish_job(record: ScanJobRecord, owner: str, progress: Dict) -> None:
+    status = progress.get("status")
+    await ScanJobRecord.get_motor_collection().update_one(
+        {"_id": record.id, "lease_owner": owner},
+        {
+            "$set": {
+                "status": status if status in TERMINAL_STATUSES else "error",
+                "progress": progress,
+                "lease_owner": None,
+                "lease_expires_at": None,
+                "finished_at": datetime.utcnow(),
+            }
+        },
+    )
+
+
+# ----------------------------------------------------------------------
+# Progress lookup
+# ----------------------------------------------------------------------
+
+async def find_scan_job(batch_id: Optional[str], user_id: Optional[str] = None) -> Optional[ScanJobRecord]:
+    """
+    A scan by batch id, else the user's latest undismissed scan
+
+    Anonymous callers (user_id None) only see scans without a user (legacy
+    single-mailbox scans); a user's scans need that user's session.
+    """
+    if batch_id:
+        record = await ScanJobRecord.find_one(ScanJobRecord.batch_id == batch_id)
+    else:
+        query = {"dismissed": False, "user_id": user_id}
+        record = await ScanJobRecord.find(query).sort(-ScanJobRecord.created_at).first_or_none()
+
+    if record and record.user_id and record.user_id != user_id:
+        return None
+    return record
+
+
+async def get_job_progress(record: ScanJobRecord) -> Dict:
+    """Live progress if the job runs in this process, else the last saved progress"""
+    job = local_jobs.get(record.batch_id)
+    if job:
+        return job.progress
+    latest = await ScanJobRecord.get(record.id)
+    return (latest or record).progress or new_progress(record.batch_id)
+
+
+async def dismiss_finished_jobs(user_id: Optional[str] = None) -> None:
+    """Hide a user's finished scans (anonymous ones without a user) from 'latest scan' lookups"""
+    query = {"status": {"$in": list(TERMINAL_STATUSES)}, "user_id": user_id}
+    await ScanJobRecord.get_motor_collection().update_many(query, {"$set": {"dismissed": True}})
+
+
+def _diff(old: Dict, new: Dict) -> Dict:
+    """Keys of `new` whose values changed since `old` (nested dicts diffed recursively)"""
+    delta = {}
+    for key, value in new.items():
+        if isinstance(value, dict) and isinstance(old.get(key), dict):
+            sub_delta = _diff(old[key], value)
+            if sub_delta:
+                delta[key] = sub_delta
+        elif old.get(key) != value:
+            delta[key] = value
+    return delta
+
+
+def _copy(progress: Dict) -> Dict:
+    return {k: (_copy(v) if isinstance(v, dict) else v) for k, v in progress.items()}
+
+
+async def progress_deltas(
+    snapshot: Callable[[], Awaitable[Dict]],
+    interval: Optional[float] = None,
+) -> AsyncIterator[Dict]:
+    """
+    Yield the full progress once, then only the fields that changed,
+    until the scan finishes.
+    """
+    interval = interval or settings.SCAN_PROGRESS_PUSH_INTERVAL
+    last = _copy(await snapshot())
+    yield last
+
+    while last.get("status") not in TERMINAL_STATUSES:
+        await asyncio.sleep(interval)
+        current = _copy(await snapshot())
+        delta = _diff(last, current)
+        if delta:
+            yield delta
+        last = current
@@ -0,0 +1,592 @@
+"""
+Staged concurrent ingest pipeline for email scans
+
+    list -> fetch details -> download attachments -> extract text -> parse -> persist
+
+Stages are connected by bounded asyncio queues and each stage runs its own
+pool of workers, so network waits overlap with CPU work while the number of
+emails held in memory stays capped by SCAN_QUEUE_SIZE. Providers are read
+through the EmailSource interface (email_source.py), so Gmail and IMAP
+mailboxes stream through the same stages.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+from candidate_writer import CandidateWriter
+from config import settings
+from database import Candidate
+from email_source import EmailSource
+from gmail_labels import ProcessedLabeler
+from gmail_service import HistoryExpiredError
+from parser_pool import ParserPool, IMAGE_EXTENSIONS
+from utils import generate_unique_id, find_existing_message_ids, iterate_async, call_async
+
+DEFAULT_QUERY = "(job OR application OR resume OR cv OR hiring)"
+
+RESUME_EXTENSIONS = ('.pdf', '.doc', '.docx')
+SPREADSHEET_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+
+STAGES = ("list", "fetch", "download", "extract", "parse", "persist")
+
+# Progress counters attributed to the listed page their emails came from
+PAGE_COUNTERS = ("total_emails", "processed_emails", "candidates_added", "already_existing", "skipped", "errors")
+
+# Queue sentinel - a worker that receives it puts it back for its siblings and exits
+_DONE = object()
+
+
+def default_prefilter(metadata: Dict) -> bool:
+    """Whether a message is worth fetching in full, judged by its attachment names and subject"""
+    extensions = tuple(ext.lower() for ext in settings.SCAN_PREFILTER_EXTENSIONS)
+    if any(a.get('filename', '').lower().endswith(extensions) for a in metadata.get('attachments', [])):
+        return True
+    pattern = settings.SCAN_PREFILTER_SUBJECT_PATTERN
+    return bool(pattern and re.search(pattern, metadata.get('subject', '') or '', re.IGNORECASE))
+
+
+def new_stage_progress() -> Dict[str, Dict[str, int]]:
+    """Per-stage counters reported under scan_progress['stages']"""
+    return {stage: {"active": 0, "done": 0} for stage in STAGES}
+
+
+class ScanPipeline:
+    """Runs one email scan as a pipeline of concurrent stages"""
+
+    def __init__(
+        self,
+        email_service: EmailSource,
+        parser_pool: ParserPool,
+        progress: Dict,
+        batch_id: Optional[str] = None,
+        recruiter_id: Optional[str] = None,
+        prefilter: Optional[Callable[[Dict], bool]] = None,
+    ):
+        self.email_service = email_service
+        self.parser_pool = parser_pool
+        self.progress = progress
+        self.batch_id = batch_id
+        self.recruiter_id = recruiter_id
+        # Two-phase fetch predicate (None = fetch every message in full)
+        if prefilter is None and settings.SCAN_PREFILTER_ENABLED:
+            prefilter = default_prefilter
+        self.prefilter = prefilter
+
+        self.concurrency = {
+            "fetch": max(1, settings.SCAN_FETCH_CONCURRENCY),
+            "download": max(1, settings.SCAN_DOWNLOAD_CONCURRENCY),
+            "extract": max(1, settings.SCAN_EXTRACT_CONCURRENCY),
+            "parse": max(1, settings.SCAN_PARSE_CONCURRENCY),
+            "persist": max(1, settings.SCAN_PERSIST_CONCURRENCY),
+        }
+        self.progress.setdefault("stages", new_stage_progress())
+
+        # Label ingested Gmail messages so later queries skip them
+        self.labeler = None
+        if settings.GMAIL_PROCESSED_LABEL_ENABLED and email_service.supports_labels:
+            self.labeler = ProcessedLabeler(email_service)
+        self.writer = CandidateWriter(
+            progress, on_written=self.labeler.add if self.labeler else None, count=self._count
+        )
+
+        # Listed pages in order, with how many of their emails are still in flight
+        # and what they added to the PAGE_COUNTERS
+        self._pages: List[Dict] = []
+        # IDs (or threads) listed by this run, and whether the listing ran to
+        # the end of the result set rather than stopping at max_emails
+        self._listed = 0
+        self.listed_all = False
+
+    async def run(
+        self,
+        search_query: Optional[str] = None,
+        hours_back: Optional[int] = None,
+        max_emails: Optional[int] = None,
+        since_history_id: Optional[str] = None,
+        resume_from: Optional[Dict] = None,
+        thread_mode: bool = False,
+        since_imap_state: Optional[Dict] = None,
+    ) -> None:
+        """
+        Run all stages until every listed email has been persisted, skipped or failed
+
+        With since_history_id, only messages added to GMAIL_HISTORY_LABEL since
+        that Gmail historyId (and not labelled processed) are scanned; the query
+        and hours_back only apply as a fallback when the history has expired.
+        resume_from is a checkpoint() from an interrupted run of the same scan.
+        thread_mode lists matching conversations and fetches each with one
+        threads.get call (query scans on Gmail only). since_imap_state limits an
+        IMAP scan to UIDs above those already synced (IMAPService.get_sync_state()).
+        """
+        queues = {stage: asyncio.Queue(maxsize=settings.SCAN_QUEUE_SIZE) for stage in STAGES[1:]}
+        if max_emails is None:
+            max_emails = settings.SCAN_MAX_EMAILS
+
+        self.writer.start()
+        # Let downstream stages drain what was already listed before reporting a listing error
+        results = await asyncio.gather(
+            self._list_stage(
+                queues["fetch"], search_query, hours_back, max_emails, since_history_id, resume_from, thread_mode,
+                since_imap_state,
+            ),
+            self._run_stage("fetch", self._fetch, queues["fetch"], queues["download"]),
+            self._run_stage("download", self._download, queues["download"], queues["extract"]),
+            self._run_stage("extract", self._extract, queues["extract"], queues["parse"]),
+            self._run_stage("parse", self._parse, queues["parse"], queues["persist"]),
+            self._run_stage("persist", self._persist, queues["persist"], None),
+            return_exceptions=True,
+        )
+        await self.writer.close()
+        if self.labeler:
+            await self.labeler.close()
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    def checkpoint(self) -> Optional[Dict]:
+        """
+        Where a restarted scan should resume listing: the earliest page that
+        still has emails in flight (or the last page, once everything is done).
+
+        "progress" holds the PAGE_COUNTERS without that page and the ones after
+        it, which the resumed scan lists (and counts) again.
+        """
+        return self._checkpoint_at(self._checkpoint_page())
+
+    async def durable_checkpoint(self) -> Optional[Dict]:
+        """checkpoint(), after writing out every candidate it covers"""
+        index = self._checkpoint_page()
+        await self.writer.flush()
+        return self._checkpoint_at(index)
+
+    def _checkpoint_page(self) -> Optional[int]:
+        for index, page in enumerate(self._pages):
+            if page["pending"] > 0:
+                return index
+        return len(self._pages) - 1 if self._pages else None
+
+    def _checkpoint_at(self, index: Optional[int]) -> Optional[Dict]:
+        if index is None:
+            return None
+        page = self._pages[index]
+        counters = {key: self.progress.get(key, 0) for key in PAGE_COUNTERS}
+        for relisted in self._pages[index:]:
+            for key, count in relisted["counts"].items():
+                counters[key] -= count
+        return {"source": page["source"], "page_token": page["page_token"], "progress": counters}
+
+    # ------------------------------------------------------------------
+    # Stage plumbing
+    # ------------------------------------------------------------------
+
+    def _stage(self, name: str) -> Dict[str, int]:
+        return self.progress["stages"][name]
+
+    def _count(self, key: str, count: int, page: Optional[int] = None) -> None:
+        """Add to a progress counter, on behalf of a listed page"""
+        self.progress[key] = self.progress.get(key, 0) + count
+        if page is not None:
+            counts = self._pages[page]["counts"]
+            counts[key] = counts.get(key, 0) + count
+
+    @staticmethod
+    def _item_size(item: Dict) -> int:
+        """Emails an item stands for (a batch of listed IDs or threads, else one)"""
+        return len(item.get("ids") or item.get("thread_ids") or [None])
+
+    def _finish_item(self, item: Optional[Dict] = None, count: Optional[int] = None) -> None:
+        """Count emails that left the pipeline (saved, skipped or failed)"""
+        if count is None:
+            count = self._item_size(item) if item else 1
+        page = item.get("page") if item else None
+        self._count("processed_emails", count, page)
+        if page is not None:
+            self._pages[page]["pending"] -= count
+
+    async def _run_stage(
+        self,
+        name: str,
+        handler: Callable[[Dict], Awaitable[Union[Dict, List[Dict], None]]],
+        inbox: asyncio.Queue,
+        outbox: Optional[asyncio.Queue],
+    ) -> None:
+        """
+        Run `handler` over every item of `inbox` with the stage's worker count
+
+        A handler returns the item to pass on, None to drop it, or a list of
+        items to fan out (in which case it accounts for any it dropped itself).
+        """
+
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is _DONE:
+                    await inbox.put(_DONE)
+                    return
+
+                self._stage(name)["active"] += 1
+                try:
+                    result = await handler(item)
+                except Exception as e:
+                    # A failed batch fails every email in it
+                    self._count("errors", self._item_size(item), item.get("page"))
+                    print(f"❌ Error in {name} stage: {str(e)}")
+                    result = None
+                finally:
+                    self._stage(name)["active"] -= 1
+                    self._stage(name)["done"] += 1
+
+                if result is None:
+                    self._finish_item(item)
+                elif outbox is None:
+                    continue
+                elif isinstance(result, list):
+                    for sub_item in result:
+                        await outbox.put(sub_item)
+                else:
+                    await outbox.put(result)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency[name])))
+        if outbox is not None:
+            await outbox.put(_DONE)
+
+    # ------------------------------------------------------------------
+    # Stages
+    # ------------------------------------------------------------------
+
+    async def _list_stage(
+        self,
+        outbox: asyncio.Queue,
+        search_query: Optional[str],
+        hours_back: Optional[int],
+        max_emails: Optional[int],
+        since_history_id: Optional[str],
+        resume_from: Optional[Dict],
+        thread_mode: bool = False,
+        since_imap_state: Optional[Dict] = None,
+    ) -> None:
+        """Find matching emails page by page and feed them to the fetch stage"""
+        resume_source = (resume_from or {}).get("source")
+        resume_token = (resume_from or {}).get("page_token")
+        if resume_from:
+            print(f"⏯️  Resuming {resume_source} listing from checkpoint")
+
+        query = search_query
+        if not query:
+            # No query provided - use a basic job-related search
+            query = DEFAULT_QUERY
+            print(f"   Using default query: {query}")
+
+        self._stage("list")["active"] += 1
+        self.progress["status"] = "processing"
+        try:
+            use_history = since_history_id and resume_source != "query"
+            if use_history and self.email_service.supports_history:
+                pages = self.email_service.iter_history_message_id_pages(
+                    since_history_id, settings.GMAIL_HISTORY_LABEL, max_emails, page_token=resume_token
+                )
+                try:
+                    await self._put_id_pages(outbox, pages, "history")
+                except HistoryExpiredError:
+                    print("⚠️ Gmail history expired - falling back to a full query")
+                    pages = self.email_service.iter_message_id_pages(query, hours_back, max_emails)
+                    await self._put_id_pages(outbox, pages, "query")
+            elif thread_mode and self.email_service.supports_threads:
+                pages = self.email_service.iter_thread_id_pages(
+                    query, hours_back, max_emails, page_token=resume_token
+                )
+                await self._put_thread_id_pages(outbox, pages)
+            else:
+                # IMAP lists UIDs above the synced ones instead of reading a history
+                pages = self.email_service.iter_message_id_pages(
+                    query, hours_back, max_emails, page_token=resume_token, since_state=since_imap_state
+                )
+                await self._put_id_pages(outbox, pages, "query")
+
+            self.listed_all = max_emails is None or self._listed < max_emails
+            print(f"Found {self.progress['total_emails']} emails")
+        finally:
+            self._stage("list")["active"] -= 1
+            await outbox.put(_DONE)
+
+    async def _put_id_pages(self, outbox: asyncio.Queue, pages, source: str) -> None:
+        """Feed (page_token, message_ids) pages to the fetch stage in Gmail batch-sized chunks"""
+        # Pages are pulled lazily - the bounded queue holds back listing
+        # while downstream stages catch up
+        batch_size = max(1, min(settings.GMAIL_BATCH_SIZE, 100))
+        async for page_token, message_ids in iterate_async(pages):
+            page = len(self._pages)
+            self._pages.append({"source": source, "page_token": page_token, "pending": len(message_ids), "counts": {}})
+            self._listed += len(message_ids)
+            self._count_listed(len(message_ids), page)
+
+            new_ids = await self._drop_known(message_ids, page)
+            for start in range(0, len(new_ids), batch_size):
+                await outbox.put({"ids": new_ids[start:start + batch_size], "page": page})
+
+    async def _put_thread_id_pages(self, outbox: asyncio.Queue, pages) -> None:
+        """Feed (page_token, thread_ids) pages to the fetch stage; threads expand into messages there"""
+        batch_size = max(1, min(settings.GMAIL_BATCH_SIZE, 100))
+        async for page_token, thread_ids in iterate_async(pages):
+            page = len(self._pages)
+            self._pages.append({"source": "threads", "page_token": page_token, "pending": len(thread_ids), "counts": {}})
+            self._listed += len(thread_ids)
+            self._count_listed(len(thread_ids), page)
+            for start in range(0, len(thread_ids), batch_size):
+                await outbox.put({"thread_ids": thread_ids[start:start + batch_size], "page": page})
+
+    async def _drop_known(self, message_ids: List[str], page: Optional[int] = None) -> List[str]:
+        """Drop already-ingested message IDs with one bulk lookup before anything is fetched"""
+        existing = await find_existing_message_ids(message_ids)
+        if existing:
+            self._count("skipped", len(existing), page)
+            self._finish_item({"page": page}, len(existing))
+            print(f"⏭️  Skipping {len(existing)} already ingested emails")
+            if self.labeler:
+                await self.labeler.add(existing)
+        return [msg_id for msg_id in message_ids if msg_id not in existing]
+
+    def _count_listed(self, count: int, page: Optional[int] = None) -> None:
+        self._stage("list")["done"] += count
+        self._count("total_emails", count, page)
+        self.progress["total_emails"] = self._stage("list")["done"]
+        self.progress["message"] = f"Found {self.progress['total_emails']} emails. Processing..."
+
+    async def _fetch(self, item: Dict) -> List[Dict]:
+        """Load full email details for a batch of new message IDs"""
+        if "thread_ids" in item:
+            emails = await self._fetch_threads(item)
+        else:
+            message_ids = item["ids"]
+            if self.prefilter and hasattr(self.email_service, "get_email_metadata_batch"):
+                message_ids = await self._prefilter(item)
+            try:
+                emails = await call_async(self.email_service.get_email_details_batch, message_ids)
+            except Exception as e:
+                print(f"❌ Error fetching email batch: {str(e)}")
+                emails = []
+            missing = len(message_ids) - len(emails)
+            if missing:
+                self._count("errors", missing, item.get("page"))
+                self._finish_item(item, missing)
+
+        new_items = []
+        for email_data in emails:
+            subject = email_data.get('subject', '') or ''
+            self.progress["current_subject"] = subject[:50] or 'No subject'
+            self.progress["message"] = f"Processing: {subject[:30]}..."
+            print(f"📨 Processing: {subject}")
+            new_items.append({"id": email_data["id"], "email": email_data, "page": item.get("page")})
+
+        return new_items
+
+    async def _fetch_threads(self, item: Dict) -> List[Dict]:
+        """Fetch whole conversations and return their not yet ingested messages"""
+        thread_ids = item["thread_ids"]
+        try:
+            threads = await call_async(self.email_service.get_threads_batch, thread_ids)
+        except Exception as e:
+            print(f"❌ Error fetching threads: {str(e)}")
+            threads = []
+        missing = len(thread_ids) - len(threads)
+        if missing:
+            self._count("errors", missing, item.get("page"))
+            self._finish_item(item, missing)
+
+        # Each thread was counted as one email when listed - count its messages instead
+        emails = [email_data for thread in threads for email_data in thread["messages"]]
+        extra = len(emails) - len(threads)
+        self._count_listed(extra, item.get("page"))
+        if item.get("page") is not None:
+            self._pages[item["page"]]["pending"] += extra
+
+        existing = await find_existing_message_ids([e["id"] for e in emails])
+        if existing:
+            self._count("skipped", len(existing), item.get("page"))
+            self._finish_item(item, len(existing))
+            print(f"⏭️  Skipping {len(existing)} already ingested emails in {len(threads)} conversations")
+            if self.labeler:
+                await self.labeler.add(existing)
+        return [e for e in emails if e["id"] not in existing]
+
+    async def _prefilter(self, item: Dict) -> List[str]:
+        """Phase one of a two-phase fetch: the IDs whose metadata passes the prefilter"""
+        message_ids = item["ids"]
+        try:
+            metadata = await call_async(self.email_service.get_email_metadata_batch, message_ids)
+        except Exception as e:
+            print(f"❌ Error fetching email metadata: {str(e)}")
+            metadata = []
+
+        wanted = [m["id"] for m in metadata if self.prefilter(m)]
+        missing = len(message_ids) - len(metadata)
+        if missing:
+            self._count("errors", missing, item.get("page"))
+            self._finish_item(item, missing)
+        filtered = len(metadata) - len(wanted)
+        if filtered:
+            self._count("skipped", filtered, item.get("page"))
+            self._finish_item(item, filtered)
+            print(f"⏭️  Skipping {filtered} emails without resume-like attachments")
+        return wanted
+
+    async def _download(self, item: Dict) -> Dict:
+        """Download the first supported attachment and save it to UPLOAD_DIR"""
+        email_data = item["email"]
+        attachments_list = email_data.get('attachments', [])
+        print(f"   📎 Attachments found: {len(attachments_list)}")
+
+        for attachment in attachments_list:
+            filename = attachment['filename'].lower()
+            if not filename.endswith(RESUME_EXTENSIONS + SPREADSHEET_EXTENSIONS + IMAGE_EXTENSIONS):
+                continue
+
+            max_bytes = settings.ATTACHMENT_MAX_BYTES
+            if max_bytes and attachment.get('size', 0) > max_bytes:
+                print(f"   ⚠️ Skipping {attachment['filename']} ({attachment['size']} bytes, limit {max_bytes})")
+                continue
+
+            print(f"   ⬇️  Downloading {attachment['filename']}...")
+            resume_filename = attachment['filename']
+            safe_filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{email_data['id'][:8]}_{resume_filename}"
+            resume_path = os.path.join(settings.UPLOAD_DIR, safe_filename)
+
+            if hasattr(self.email_service, 'save_attachment'):
+                # Streamed to disk without holding the whole file in memory
+                saved = await call_async(
+                    self.email_service.save_attachment,
+                    email_data['id'],
+                    attachment['attachmentId'],
+                    resume_path,
+                )
+                if not saved:
+                    continue
+                print(f"   ✅ Downloaded {saved['size']} bytes")
+                item["resume_sha256"] = saved["sha256"]
+            else:
+                file_data = await call_async(
+                    self.email_service.download_attachment,
+                    email_data['id'],
+                    attachment['attachmentId'],
+                )
+                if not file_data:
+                    continue
+
+                print(f"   ✅ Downloaded {len(file_data)} bytes")
+                await asyncio.to_thread(_write_file, resume_path, file_data)
+
+            item["resume_filename"] = resume_filename
+            item["resume_path"] = resume_path
+            break  # Use first attachment found
+
+        return item
+
+    async def _extract(self, item: Dict) -> Dict:
+        """Extract text from the saved attachment in the parser pool"""
+        item["resume_text"] = ""
+        if not item.get("resume_path"):
+            return item
+
+        print(f"   📄 Extracting text from {item['resume_filename']}...")
+        resume_text = await self.parser_pool.extract_text(item["resume_path"])
+        item["resume_text"] = resume_text or ""
+        return item
+
+    async def _parse(self, item: Dict) -> Dict:
+        """Parse resume text and email body into structured data in the parser pool"""
+        email_data = item["email"]
+        item["email_extracted"] = await self.parser_pool.parse_email(
+            email_data.get('body', ''),
+            email_data.get('signature', '')
+        )
+
+        item["cv_data"] = None
+        if item["resume_text"]:
+            print(f"   🔍 Parsing resume data...")
+            item["cv_data"] = await self.parser_pool.parse(item["resume_text"])
+        elif item.get("resume_path"):
+            print(f"   ⚠️ No text extracted from file")
+
+        return item
+
+    async def _persist(self, item: Dict) -> None:
+        """Queue the candidate for the next bulk write"""
+        candidate = build_candidate(item, self.batch_id, self.recruiter_id)
+        await self.writer.add(candidate, item.get("page"))
+        return None
+
+
+def _write_file(path: str, data: bytes) -> None:
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def build_candidate(item: Dict, batch_id: Optional[str], recruiter_id: Optional[str]) -> Candidate:
+    """Build a Candidate document from a fully processed pipeline item"""
+    email_data = item["email"]
+    email_extracted = item.get("email_extracted") or {}
+    cv_data = item.get("cv_data")
+
+    # Extract email from "Name <email@domain.com>" format
+    from_email = email_data.get('from', '')
+    email_match = re.search(r'<([^>]+)>', from_email)
+    candidate_email = email_match.group(1) if email_match else from_email
+
+    # Try to get name from CV data, email extraction, or sender
+    if cv_data and cv_data.get('personal_info', {}).get('full_name'):
+        candidate_name = cv_data['personal_info']['full_name']
+    elif email_extracted.get('name'):
+        candidate_name = email_extracted['name']
+    else:
+        name_match = re.match(r'^([^<]+)', from_email)
+        candidate_name = name_match.group(1).strip() if name_match else "Unknown"
+
+    # Get phone from CV data or email extraction
+    candidate_phone = ""
+    if cv_data and cv_data.get('contact_details', {}).get('mobile_numbers'):
+        candidate_phone = ', '.join(cv_data['contact_details']['mobile_numbers'])
+    elif email_extracted.get('phones'):
+        candidate_phone = ', '.join(email_extracted['phones'])
+
+    # Generate unique 10-character ID
+    email_date = email_data.get('date', datetime.now())
+    if isinstance(email_date, str):
+        email_date = datetime.now()
+
+    unique_id = generate_unique_id(
+        email_data.get('subject', 'no-subject'),
+        email_date,
+        candidate_email
+    )
+
+    return Candidate(
+        unique_id=unique_id,
+        gmail_message_id=email_data['id'],
+        gmail_thread_id=email_data.get('thread_id'),
+        batch_id=batch_id,
+        recruiter_id=recruiter_id,
+        name=candidate_name,
+        email=candidate_email,
+        phone=candidate_phone,
+        email_subject=email_data.get('subject', ''),
+        email_from=email_data.get('from', ''),
+        email_to=email_data.get('to', ''),
+        email_cc=email_data.get('cc', ''),
+        email_body=email_data.get('body', ''),
+        email_body_html=email_data.get('body_html', ''),
+        email_signature=email_data.get('signature', ''),
+        email_date=datetime.now(),
+        resume_path=item.get("resume_path"),
+        resume_filename=item.get("resume_filename"),
+        resume_sha256=item.get("resume_sha256"),
+        resume_text=item.get("resume_text", ""),
+        cv_data=cv_data,
+        extracted_phones=email_extracted.get('phones', []) or [],
+        extracted_emails=email_extracted.get('emails', []) or [],
+        extracted_links=email_extracted.get('other_links', []) or [],
+        tags=['Scanned'],  # Auto-tag as scanned
+    )
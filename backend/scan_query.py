@@ -0,0 +1,318 @@
+"""
+Scan query compiler and cost planner
+
+Turns structured scan options (keywords, date range, attachment types,
+senders, labels, exclusions) into Gmail search syntax and IMAP SEARCH
+criteria, translates Gmail queries into IMAP SEARCH criteria so both
+providers filter the same scan server-side, and projects what a scan will
+cost in Gmail API calls and quota before it runs.
+"""
+import re
+from datetime import datetime, timedelta
+from math import ceil
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from config import settings
+from gmail_quota import QUOTA_UNITS
+from gmail_service import label_search_name
+
+DEFAULT_KEYWORDS = ["job", "application", "resume", "cv", "hiring"]
+DEFAULT_ATTACHMENT_TYPES = ["pdf", "doc", "docx"]
+
+IMAP_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+class ScanQueryOptions(BaseModel):
+    """Structured scan filters; empty fields add no condition"""
+    keywords: List[str] = Field(default_factory=lambda: list(DEFAULT_KEYWORDS))  # Any of these
+    exclude_keywords: List[str] = Field(default_factory=list)
+    attachment_types: List[str] = Field(default_factory=lambda: list(DEFAULT_ATTACHMENT_TYPES))  # Any of these extensions
+    require_attachment: bool = True
+    senders: List[str] = Field(default_factory=list)  # Any of these addresses or domains
+    exclude_senders: List[str] = Field(default_factory=list)
+    labels: List[str] = Field(default_factory=list)  # Gmail only
+    after: Optional[datetime] = None
+    before: Optional[datetime] = None
+    hours_back: Optional[int] = None  # Shorthand for after = now - hours_back
+
+    def since(self) -> Optional[datetime]:
+        if self.hours_back is not None:
+            return datetime.now() - timedelta(hours=self.hours_back)
+        return self.after
+
+
+def _gmail_term(value: str) -> str:
+    value = value.strip().replace('"', '')
+    return f'"{value}"' if any(c.isspace() for c in value) else value
+
+
+def _gmail_any(prefix: str, values: List[str]) -> Optional[str]:
+    terms = [f"{prefix}{_gmail_term(v)}" for v in values if v.strip()]
+    if not terms:
+        return None
+    return terms[0] if len(terms) == 1 else f"({' OR '.join(terms)})"
+
+
+def to_gmail_query(options: ScanQueryOptions) -> str:
+    """Gmail search syntax for the options"""
+    parts = [
+        _gmail_any("", options.keywords),
+        _gmail_any("filename:", [ext.lstrip(".") for ext in options.attachment_types]),
+        _gmail_any("from:", options.senders),
+    ]
+    if options.require_attachment or options.attachment_types:
+        parts.append("has:attachment")
+    parts += [f"label:{label_search_name(label)}" for label in options.labels if label.strip()]
+    parts += [f"-{_gmail_term(k)}" for k in options.exclude_keywords if k.strip()]
+    parts += [f"-from:{_gmail_term(s)}" for s in options.exclude_senders if s.strip()]
+
+    since = options.since()
+    if since:
+        parts.append(f"after:{int(since.timestamp())}")
+    if options.before:
+        parts.append(f"before:{int(options.before.timestamp())}")
+
+    return " ".join(p for p in parts if p)
+
+
+def _imap_date(value: datetime) -> str:
+    return f"{value.day:02d}-{IMAP_MONTHS[value.month - 1]}-{value.year}"
+
+
+def _imap_string(value: str) -> str:
+    return '"' + value.strip().replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _imap_any(key: str, values: List[str]) -> Optional[str]:
+    """OR together `key value` criteria (IMAP OR is binary and prefix)"""
+    terms = [f"{key} {_imap_string(v)}" for v in values if v.strip()]
+    if not terms:
+        return None
+    criteria = terms[-1]
+    for term in reversed(terms[:-1]):
+        criteria = f"OR {term} {criteria}"
+    return criteria
+
+
+def to_imap_criteria(options: ScanQueryOptions) -> str:
+    """
+    IMAP SEARCH criteria for the options
+
+    IMAP has no attachment or label search and only day-granular dates, so
+    those conditions are left to the scan itself (attachments are narrowed
+    down with IMAP_ATTACHMENT_CRITERIA).
+    """
+    parts = [
+        _imap_any("TEXT", options.keywords),
+        _imap_any("FROM", options.senders),
+    ]
+    if options.require_attachment or options.attachment_types:
+        parts.append(settings.IMAP_ATTACHMENT_CRITERIA)
+    parts += [f"NOT TEXT {_imap_string(k)}" for k in options.exclude_keywords if k.strip()]
+    parts += [f"NOT FROM {_imap_string(s)}" for s in options.exclude_senders if s.strip()]
+
+    since = options.since()
+    if since:
+        parts.append(f"SINCE {_imap_date(since)}")
+    if options.before:
+        parts.append(f"BEFORE {_imap_date(options.before)}")
+
+    return " ".join(p for p in parts if p) or "ALL"
+
+
+# Gmail operators with a direct IMAP SEARCH key
+_GMAIL_IMAP_KEYS = {"from": "FROM", "to": "TO", "cc": "CC", "bcc": "BCC", "subject": "SUBJECT"}
+_GMAIL_IMAP_FLAGS = {
+    "is:unread": "UNSEEN", "is:read": "SEEN", "is:starred": "FLAGGED", "is:important": "FLAGGED",
+}
+_GMAIL_TOKEN = re.compile(r'-?\(|\)|-?(?:[\w-]+:)?(?:"[^"]*"?|[^\s()"]+)')
+_GMAIL_RELATIVE = re.compile(r'^(\d+)([dmy])$', re.IGNORECASE)
+_GMAIL_SIZE = re.compile(r'^(\d+)([km]?)$', re.IGNORECASE)
+
+
+def _gmail_date(value: str) -> Optional[datetime]:
+    """after:/before: value - epoch seconds or YYYY/MM/DD"""
+    if value.isdigit() and len(value) > 8:
+        return datetime.fromtimestamp(int(value))
+    for fmt in ("%Y/%m/%d", "%Y-%m-%d", "%m/%d/%Y"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _gmail_relative(value: str) -> Optional[datetime]:
+    """newer_than:/older_than: value like 7d, 2m or 1y"""
+    match = _GMAIL_RELATIVE.match(value)
+    if not match:
+        return None
+    days = int(match.group(1)) * {"d": 1, "m": 30, "y": 365}[match.group(2).lower()]
+    return datetime.now() - timedelta(days=days)
+
+
+def _gmail_term_to_imap(token: str) -> Optional[str]:
+    """
+    One Gmail search term as IMAP criteria, or None if IMAP cannot express it
+    (filename:, label:, in:, category: ...). has:attachment is approximated by
+    IMAP_ATTACHMENT_CRITERIA.
+    """
+    if token.lower() in _GMAIL_IMAP_FLAGS:
+        return _GMAIL_IMAP_FLAGS[token.lower()]
+    if token.lower() == "has:attachment":
+        return settings.IMAP_ATTACHMENT_CRITERIA or None
+    operator, sep, value = token.partition(":")
+    if not sep or not re.fullmatch(r"[\w-]+", operator) or value.startswith("//"):
+        # A plain word or phrase (or a URL) - Gmail matches it anywhere
+        phrase = token.strip('"')
+        return f"TEXT {_imap_string(phrase)}" if phrase else None
+
+    operator = operator.lower()
+    value = value.strip('"')
+    if operator in _GMAIL_IMAP_KEYS:
+        return f"{_GMAIL_IMAP_KEYS[operator]} {_imap_string(value)}" if value else None
+    if operator in ("after", "since", "newer", "before", "older"):
+        date = _gmail_date(value)
+        if date is None:
+            return None
+        return f"{'BEFORE' if operator in ('before', 'older') else 'SINCE'} {_imap_date(date)}"
+    if operator in ("newer_than", "older_than"):
+        date = _gmail_relative(value)
+        if date is None:
+            return None
+        return f"{'SINCE' if operator == 'newer_than' else 'BEFORE'} {_imap_date(date)}"
+    if operator in ("larger", "smaller", "size"):
+        match = _GMAIL_SIZE.match(value)
+        if not match:
+            return None
+        size = int(match.group(1)) * {"": 1, "k": 1024, "m": 1024 * 1024}[match.group(2).lower()]
+        return f"{'SMALLER' if operator == 'smaller' else 'LARGER'} {size}"
+    return None
+
+
+class _GmailQueryParser:
+    """
+    Recursive descent over Gmail query tokens: juxtaposition is AND, OR binds
+    tighter, '-' negates and parentheses group.
+
+    Terms IMAP cannot express are dropped from ANDs and make an OR match
+    everything, so the translated criteria never exclude mail the Gmail query
+    would have matched; the scan filters the rest. A negated term or group
+    that lost (or only approximates) a term is dropped as a whole, since
+    negating what is left would exclude too much. Each method returns
+    (criteria, complete), complete being False once something was dropped.
+    """
+
+    def __init__(self, query: str):
+        self.tokens = _GMAIL_TOKEN.findall(query or "")
+        self.pos = 0
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def parse(self) -> Optional[str]:
+        criteria, _ = self._and()
+        while self._peek() is not None:
+            # Unbalanced ')' - skip it and keep going
+            self.pos += 1
+            more, _ = self._and()
+            criteria = " ".join(c for c in (criteria, more) if c) or None
+        return criteria
+
+    def _and(self) -> Tuple[Optional[str], bool]:
+        terms = []
+        while self._peek() not in (None, ")"):
+            terms.append(self._or())
+        complete = all(c for _, c in terms)
+        criteria = [t for t, _ in terms if t]
+        if not criteria:
+            return None, complete
+        return (criteria[0] if len(criteria) == 1 else " ".join(criteria)), complete
+
+    def _or(self) -> Tuple[Optional[str], bool]:
+        operands = [self._unary()]
+        while self._peek() in ("OR", "|"):
+            self.pos += 1
+            if self._peek() in (None, ")"):
+                break
+            operands.append(self._unary())
+        if len(operands) == 1:
+            return operands[0]
+        if any(o is None for o, _ in operands):
+            return None, False
+        criteria = _imap_group(operands[-1][0])
+        for operand, _ in reversed(operands[:-1]):
+            criteria = f"OR {_imap_group(operand)} {criteria}"
+        return criteria, all(c for _, c in operands)
+
+    def _unary(self) -> Tuple[Optional[str], bool]:
+        token = self.tokens[self.pos]
+        self.pos += 1
+        negate = token.startswith("-") and len(token) > 1
+        if negate:
+            token = token[1:]
+
+        if token == "(":
+            criteria, complete = self._and()
+            if self._peek() == ")":
+                self.pos += 1
+        else:
+            criteria = _gmail_term_to_imap(token)
+            # has:attachment is only approximated
+            complete = criteria is not None and token.lower() != "has:attachment"
+
+        if negate:
+            if criteria and complete:
+                return f"NOT {_imap_group(criteria)}", True
+            return None, False
+        return criteria, complete
+
+
+def _imap_group(criteria: str) -> str:
+    """Parenthesise multi-key criteria so they act as one OR/NOT operand"""
+    if criteria.startswith("(") and criteria.endswith(")"):
+        return criteria
+    single_key = re.fullmatch(r'(?:NOT )*(?:[A-Z]+(?: (?:"(?:[^"\\]|\\.)*"|\S+))?)', criteria)
+    return criteria if single_key and not criteria.startswith("OR ") else f"({criteria})"
+
+
+def gmail_query_to_imap(query: str, since: Optional[datetime] = None) -> str:
+    """
+    IMAP SEARCH criteria for a Gmail search query: keywords become TEXT,
+    from:/to:/subject: become FROM/TO/SUBJECT, after:/before:/newer_than:
+    become SINCE/BEFORE and OR groups become IMAP's prefix OR. `since` adds a
+    SINCE for a relative scan window (hours_back).
+    """
+    parts = [_GmailQueryParser(query).parse()]
+    if since:
+        parts.append(f"SINCE {_imap_date(since)}")
+    return " ".join(p for p in parts if p) or "ALL"
+
+
+def estimate_scan_cost(result_size: int, prefilter: Optional[bool] = None) -> Dict:
+    """
+    Projected Gmail API calls and quota units for scanning `result_size` messages
+
+    Counts a listing call per 500 messages, a messages.get per message (two
+    with the metadata prefilter) and, as an upper bound, one attachment
+    download per message.
+    """
+    if prefilter is None:
+        prefilter = settings.SCAN_PREFILTER_ENABLED
+
+    calls = {
+        "messages.list": max(1, ceil(result_size / 500)),
+        "messages.get": result_size * (2 if prefilter else 1),
+        "messages.attachments.get": result_size,
+    }
+    units = {method: count * QUOTA_UNITS[method] for method, count in calls.items()}
+    total_units = sum(units.values())
+    return {
+        "calls": calls,
+        "quota_units": units,
+        "total_quota_units": total_units,
+        # Lower bound: the per-user quota is the limit, not network time
+        "min_seconds": round(total_units / settings.GMAIL_QUOTA_UNITS_PER_SECOND, 1),
+    }
@@ -0,0 +1,204 @@
+"""
+Runs one queued scan job end to end
+
+Shared by the worker inside the API process and the standalone worker
+(worker.py): resolves the user's Gmail or IMAP service, runs the scan pipeline and
+periodically saves progress, lease and checkpoint to the job record.
+"""
+import asyncio
+from datetime import datetime
+from typing import Dict, Optional
+
+from beanie.odm.fields import PydanticObjectId
+from google.oauth2.credentials import Credentials
+
+from config import settings
+from database import EmailConfig, ScanJobRecord, User
+from gmail_async import AsyncGmailService
+from gmail_pool import gmail_services
+from gmail_service import GmailService, build_gmail_service
+from imap_async import connected_imap_service
+from credential_manager import credential_manager
+from parser_pool import ParserPool
+from scan_jobs import save_job_state
+from scan_pipeline import DEFAULT_QUERY, ScanPipeline
+from utils import call_async
+
+
+async def load_user(user_id: Optional[str]) -> Optional[User]:
+    if not user_id:
+        return None
+    try:
+        return await User.get(PydanticObjectId(user_id))
+    except Exception:
+        return None
+
+
+async def create_user_gmail_service(user: User) -> GmailService:
+    """Get the user's pooled GmailService, creating it from their stored OAuth tokens on first use"""
+    # Cached and refreshed ahead of expiry by the credential manager
+    creds = await credential_manager.get_credentials(user)
+    return gmail_services.get(
+        str(user.id), user.gmail_refresh_token, lambda: _new_user_gmail_service(user, creds)
+    )
+
+
+def _new_user_gmail_service(user: User, creds: Credentials) -> GmailService:
+    print(f"📧 Creating Gmail service for {user.email}")
+    if settings.GMAIL_ASYNC_CLIENT:
+        user_id = str(user.id)
+        user_gmail_service = AsyncGmailService(creds, refresh=lambda: credential_manager.refresh(user_id))
+    else:
+        user_gmail_service = GmailService()
+        user_gmail_service.creds = creds
+        user_gmail_service.service = build_gmail_service(creds)
+    print(f"✅ Gmail service created for {user.email}")
+    return user_gmail_service
+
+
+async def run_scan(
+    record: ScanJobRecord,
+    progress: Dict,
+    parser_pool: ParserPool,
+    owner: str,
+    fallback_service=None,
+) -> None:
+    """Run a claimed scan job, updating `progress` in place"""
+    user = await load_user(record.user_id)
+
+    if record.provider == "imap":
+        # Claimed only by the process holding the account's connection pool (claim_next_job)
+        email_service = connected_imap_service(record.imap_account)
+        if email_service is None:
+            progress.update({
+                "status": "error",
+                "message": f"IMAP account {record.imap_account} is not connected - please log in again",
+            })
+            return
+        if user is None:
+            # IMAP logins create a user per mailbox address, which holds its sync state
+            user = await User.find_one(User.email == email_service.email_address)
+    elif user and user.gmail_access_token and user.gmail_refresh_token:
+        try:
+            email_service = await create_user_gmail_service(user)
+        except Exception as e:
+            print(f"❌ Failed to create Gmail service: {e}")
+            progress.update({
+                "status": "error",
+                "message": f"Gmail authentication failed: {str(e)}"
+            })
+            return
+    elif user:
+        progress.update({
+            "status": "error",
+            "message": f"Gmail is not connected for {user.email} - please log in again",
+        })
+        return
+    else:
+        # Fallback to global Gmail service (legacy token.json login)
+        email_service = fallback_service or GmailService()
+
+    progress.update({
+        "status": "fetching",
+        "current_subject": f"Connecting to {user.email if user else 'Gmail'}...",
+        "message": f"Fetching emails from {user.email if user else 'Gmail'}...",
+    })
+
+    print(f"📧 Scanning for emails... (Batch: {record.batch_id})")
+    print(f"🔍 Search Query: '{record.search_query or 'None (using default job filter)'}'")
+
+    if record.query is None:
+        await _freeze_scan_parameters(record, user, email_service, owner, progress)
+
+    pipeline = ScanPipeline(
+        email_service,
+        parser_pool,
+        progress,
+        batch_id=record.batch_id,
+        recruiter_id=record.recruiter_id,
+    )
+    heartbeat = asyncio.create_task(_save_periodically(record, owner, pipeline, progress))
+    try:
+        await pipeline.run(
+            search_query=record.query,
+            max_emails=record.max_emails,
+            since_history_id=record.since_history_id,
+            since_imap_state=record.since_imap_state,
+            resume_from=record.checkpoint,
+            thread_mode=record.thread_mode,
+        )
+    finally:
+        heartbeat.cancel()
+
+    # Only a complete incremental listing covers everything up to the captured
+    # position - advancing after a filtered or capped scan would hide the mail it left out
+    advance_sync = user and record.incremental and pipeline.listed_all
+    if advance_sync and record.new_history_id:
+        await user.set({User.gmail_history_id: record.new_history_id})
+    if advance_sync and record.new_imap_state:
+        await user.set({User.imap_sync_state: {**user.imap_sync_state, **record.new_imap_state}})
+
+    # Update last scan time
+    config = await EmailConfig.find_one()
+    if config:
+        await config.set({EmailConfig.last_scan: datetime.now()})
+
+    # Mark scan as complete
+    progress["status"] = "complete"
+    progress["message"] = f"Scan complete! {progress['candidates_added']} candidates saved to database."
+    print("✅ Email scan completed - all candidates saved to database")
+
+
+async def _freeze_scan_parameters(
+    record: ScanJobRecord,
+    user: Optional[User],
+    email_service,
+    owner: str,
+    progress: Dict,
+) -> None:
+    """
+    Fix the exact query and history range (Gmail historyId or IMAP UIDs) on the
+    first run, so a resumed scan continues the same listing (page tokens are
+    only valid for the same query).
+    """
+    query = email_service.build_query(record.search_query or DEFAULT_QUERY, record.hours_back)
+
+    # Capture the mailbox position before listing so nothing added mid-scan is missed next time
+    new_history_id = None
+    if user and email_service.supports_history:
+        try:
+            new_history_id = await call_async(email_service.get_history_id)
+        except Exception as e:
+            print(f"⚠️ Could not read Gmail historyId: {e}")
+    new_imap_state = None
+    if user and email_service.supports_sync_state:
+        try:
+            new_imap_state = await call_async(email_service.get_sync_state)
+        except Exception as e:
+            print(f"⚠️ Could not read IMAP UIDVALIDITY/UIDNEXT: {e}")
+
+    record.query = query
+    record.new_history_id = new_history_id
+    record.since_history_id = user.gmail_history_id if (user and record.incremental) else None
+    record.new_imap_state = new_imap_state
+    record.since_imap_state = user.imap_sync_state if (user and record.incremental and new_imap_state) else None
+    await save_job_state(
+        record, owner, progress,
+        query=record.query,
+        new_history_id=record.new_history_id,
+        since_history_id=record.since_history_id,
+        new_imap_state=record.new_imap_state,
+        since_imap_state=record.since_imap_state,
+    )
+
+
+async def _save_periodically(record: ScanJobRecord, owner: str, pipeline: ScanPipeline, progress: Dict) -> None:
+    """Renew the job lease and save progress and checkpoint until cancelled"""
+    while True:
+        await asyncio.sleep(settings.SCAN_JOB_HEARTBEAT_SECONDS)
+        try:
+            checkpoint = await pipeline.durable_checkpoint()
+            if not await save_job_state(record, owner, progress, checkpoint):
+                print(f"⚠️ Lost the lease on scan {record.batch_id}")
+        except Exception as e:
+            print(f"⚠️ Could not save scan state: {str(e)}")
@@ -0,0 +1,98 @@
+"""
+Scheduled scanning of every connected Gmail account
+
+Every SCAN_SCHEDULE_INTERVAL_SECONDS (with jitter, so accounts drift apart
+instead of firing together) each user with Gmail tokens gets an incremental
+scan queued. The scheduler only queues jobs; workers run them.
+
+- At most SCAN_SCHEDULER_MAX_ACTIVE scheduled scans are queued or running.
+- An account with a scan already queued or running is skipped until it finishes,
+  so one account never holds more than one worker slot.
+- Due accounts are queued longest-waiting first, so a large mailbox that keeps
+  a slot busy delays its own next scan, not everyone else's.
+"""
+import asyncio
+import random
+import time
+import uuid
+from typing import Dict, Optional
+
+from config import settings
+from database import User
+from scan_jobs import active_job_user_ids, count_active_scheduled_jobs, enqueue_scan
+
+
+class ScanScheduler:
+    """Queues periodic incremental scans for all users with Gmail tokens"""
+
+    def __init__(
+        self,
+        interval: Optional[float] = None,
+        jitter: Optional[float] = None,
+        max_active: Optional[int] = None,
+    ):
+        self.interval = interval or settings.SCAN_SCHEDULE_INTERVAL_SECONDS
+        self.jitter = settings.SCAN_SCHEDULE_JITTER if jitter is None else jitter
+        self.max_active = max(1, max_active or settings.SCAN_SCHEDULER_MAX_ACTIVE)
+        # user id -> monotonic time the next scan is due
+        self._next_due: Dict[str, float] = {}
+        self._running = False
+
+    async def run(self) -> None:
+        """Queue due scans every tick until stop() is called"""
+        self._running = True
+        print(f"⏰ Scan scheduler started (every ~{int(self.interval)}s per account, max {self.max_active} active)")
+        while self._running:
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"⚠️ Scan scheduler error: {str(e)}")
+            await asyncio.sleep(settings.SCAN_SCHEDULER_TICK_SECONDS)
+
+    def stop(self) -> None:
+        self._running = False
+
+    async def tick(self) -> int:
+        """Queue scans for due accounts within the global cap; returns how many were queued"""
+        now = time.monotonic()
+        user_ids = await self._connected_user_ids()
+
+        # Forget disconnected accounts; spread new ones over the first interval
+        self._next_due = {uid: due for uid, due in self._next_due.items() if uid in user_ids}
+        for uid in user_ids:
+            self._next_due.setdefault(uid, now + random.uniform(0, self.interval))
+
+        busy = set(await active_job_user_ids())
+        due = sorted(
+            (due_at, uid) for uid, due_at in self._next_due.items()
+            if due_at <= now and uid not in busy
+        )
+        slots = self.max_active - await count_active_scheduled_jobs()
+        if not due or slots <= 0:
+            return 0
+
+        queued = 0
+        for _, uid in due[:slots]:
+            await enqueue_scan(
+                f"sched-{str(uuid.uuid4())[:8]}",
+                user_id=uid,
+                recruiter_id=uid,
+                search_query="in:inbox",
+                hours_back=settings.SCAN_SCHEDULE_HOURS_BACK,
+                incremental=True,
+                scheduled=True,
+            )
+            self._next_due[uid] = now + self._jittered_interval()
+            queued += 1
+
+        print(f"⏰ Queued {queued} scheduled scans ({len(due) - queued} accounts still waiting)")
+        return queued
+
+    def _jittered_interval(self) -> float:
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    async def _connected_user_ids(self) -> set:
+        users = await User.find(
+            {"is_active": True, "gmail_refresh_token": {"$ne": None}}
+        ).to_list()
+        return {str(user.id) for user in users}
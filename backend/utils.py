@@ -1,11 +1,15 @@
 from __future__ import annotations
 
+import asyncio
 import hashlib
+import inspect
 from datetime import datetime
-from typing import Optional
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator, Set, TypeVar, Union
 
 from database import Candidate
 
+T = TypeVar("T")
+
 
 def generate_unique_id(subject: str, email_date: datetime, candidate_email: str) -> str:
     """
@@ -15,11 +19,41 @@ def generate_unique_id(subject: str, email_date: datetime, candidate_email: str)
     return hashlib.sha256(base.encode("utf-8")).hexdigest()[:10]
 
 
-async def check_duplicate_candidate(gmail_message_id: str) -> Optional[Candidate]:
+async def find_existing_message_ids(gmail_message_ids: Iterable[str]) -> Set[str]:
+    """
+    Returns the subset of gmail_message_ids that already have a Candidate, in one query.
+    """
+    ids = list({m for m in gmail_message_ids if m})
+    if not ids:
+        return set()
+    # Only the indexed message id comes back (not even _id), so Mongo can answer from the index
+    docs = await Candidate.get_motor_collection().find(
+        {"gmail_message_id": {"$in": ids}}, {"gmail_message_id": 1, "_id": 0}
+    ).to_list(length=None)
+    return {doc["gmail_message_id"] for doc in docs}
+
+
+async def iterate_in_thread(iterator: Iterator[T]) -> AsyncIterator[T]:
     """
-    Returns an existing Candidate if gmail_message_id already exists.
+    Consume a blocking iterator from async code, pulling each item in a worker thread.
     """
-    if not gmail_message_id:
-        return None
-    return await Candidate.find_one(Candidate.gmail_message_id == gmail_message_id)
+    done = object()
+    while True:
+        item = await asyncio.to_thread(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+def iterate_async(iterator: Union[Iterator[T], AsyncIterator[T]]) -> AsyncIterator[T]:
+    """Iterate an async iterator directly, or a blocking one via iterate_in_thread"""
+    if hasattr(iterator, "__aiter__"):
+        return iterator
+    return iterate_in_thread(iterator)
+
 
+async def call_async(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Await a coroutine function, or run a blocking function in a worker thread"""
+    if inspect.iscoroutinefunction(func):
+        return await func(*args, **kwargs)
+    return await asyncio.to_thread(func, *args, **kwargs)
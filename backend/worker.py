@@ -0,0 +1,125 @@
+"""
+Standalone scan worker
+
+    cd backend && python worker.py
+
+Claims queued scan jobs from MongoDB and runs them, independently of the API
+process. Set SCAN_WORKER_IN_API=false on the API when running dedicated
+workers. A worker that dies mid-scan stops renewing its lease; another worker
+then claims the job and resumes listing from its last checkpoint.
+"""
+import asyncio
+import os
+import signal
+import socket
+import uuid
+from typing import Callable, Optional
+
+from config import settings
+from database import ScanJobRecord, init_db, shutdown_db
+from credential_manager import credential_manager
+from gmail_async import close_http_client
+from gmail_service import GmailService
+from imap_async import connected_imap_accounts
+from parser_pool import ParserPool
+from scan_jobs import claim_next_job, fail_abandoned_jobs, finish_job, local_jobs
+from scan_runner import run_scan
+
+
+class ScanWorker:
+    """Claims and runs scan jobs, up to SCAN_WORKER_CONCURRENCY at a time"""
+
+    def __init__(
+        self,
+        parser_pool: ParserPool,
+        fallback_service: Optional[Callable[[], object]] = None,
+        concurrency: Optional[int] = None,
+    ):
+        self.parser_pool = parser_pool
+        # Email service for jobs without a user (legacy token.json login)
+        self.fallback_service = fallback_service
+        self.concurrency = max(1, concurrency or settings.SCAN_WORKER_CONCURRENCY)
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._running = False
+
+    async def run(self) -> None:
+        """Claim and run jobs until stop() is called"""
+        self._running = True
+        print(f"👷 Scan worker {self.worker_id} started ({self.concurrency} slots)")
+        await asyncio.gather(*(self._loop() for _ in range(self.concurrency)))
+
+    def stop(self) -> None:
+        """Stop claiming new jobs; running scans finish first"""
+        self._running = False
+
+    async def _loop(self) -> None:
+        while self._running:
+            try:
+                await fail_abandoned_jobs()
+                record = await claim_next_job(self.worker_id, connected_imap_accounts())
+            except Exception as e:
+                print(f"⚠️ Could not claim scan job: {str(e)}")
+                record = None
+
+            if record is None:
+                await asyncio.sleep(settings.SCAN_WORKER_POLL_INTERVAL)
+                continue
+
+            await self.process(record)
+
+    async def process(self, record: ScanJobRecord) -> None:
+        job = local_jobs.create(record.batch_id, record.user_id)
+        progress = job.progress
+        if record.attempts > 1 and record.progress:
+            # Resuming an interrupted scan - keep its counters, except for the
+            # pages from the checkpoint on, which are listed and counted again
+            progress.update(record.progress)
+            progress.update((record.checkpoint or {}).get("progress") or {})
+            for stage in progress.get("stages", {}).values():
+                stage["active"] = 0
+            if "list" in progress.get("stages", {}):
+                progress["stages"]["list"]["done"] = progress.get("total_emails", 0)
+            print(f"⏯️  Resuming scan {record.batch_id} (attempt {record.attempts})")
+
+        try:
+            fallback = self.fallback_service() if self.fallback_service else None
+            await run_scan(record, progress, self.parser_pool, self.worker_id, fallback)
+        except Exception as e:
+            progress["status"] = "error"
+            progress["message"] = f"Error: {str(e)}"
+            print(f"❌ Scan error: {str(e)}")
+        finally:
+            try:
+                await finish_job(record, self.worker_id, progress)
+            except Exception as e:
+                print(f"⚠️ Could not save final scan state: {str(e)}")
+
+
+async def main() -> None:
+    await init_db()
+    parser_pool = ParserPool()
+    await parser_pool.start()
+
+    legacy_gmail_service = GmailService()
+    worker = ScanWorker(parser_pool, fallback_service=lambda: legacy_gmail_service)
+
+    token_refresh_task = asyncio.create_task(credential_manager.run())
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, worker.stop)
+        except NotImplementedError:
+            pass  # Windows
+
+    try:
+        await worker.run()
+    finally:
+        token_refresh_task.cancel()
+        parser_pool.shutdown()
+        await close_http_client()
+        await shutdown_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
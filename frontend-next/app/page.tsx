@@ -56,6 +56,19 @@ type ScanProgress = {
 
 const API_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000/api'
 
+type ProgressDelta = { [key: string]: unknown }
+
+// Apply a progress delta from the scan progress stream (nested objects are merged)
+const mergeProgress = (current: ProgressDelta | null, delta: ProgressDelta): ProgressDelta => {
+    const merged: ProgressDelta = { ...(current || {}) }
+    for (const [key, value] of Object.entries(delta)) {
+        merged[key] = value && typeof value === 'object' && !Array.isArray(value)
+            ? mergeProgress(merged[key] as ProgressDelta | null, value as ProgressDelta)
+            : value
+    }
+    return merged
+}
+
 export default function Home() {
     const [candidates, setCandidates] = useState<Candidate[]>([])
     const [isLoggedIn, setIsLoggedIn] = useState(false)
@@ -526,60 +539,96 @@ export default function Home() {
                 throw new Error('Scan request failed')
             }
             
-            const pollProgress = async () => {
-                try {
-                    const progressRes = await fetch(`${API_URL}/scan-progress`)
-                    if (progressRes.ok) {
-                        const progress = await progressRes.json()
-                        console.log('📊 Scan progress:', progress)
-                        setScanProgress(progress)
-                        
-                        if (progress.status === 'complete') {
-                            console.log(`✅ Scan complete! candidates_added: ${progress.candidates_added}`)
-                            setIsLoading(false)
-                            // Fetch the most recent candidates (those just added by the scan)
-                            if (progress.candidates_added > 0) {
-                                try {
-                                    console.log(`📥 Fetching candidates from ${API_URL}/candidates`)
-                                    const res = await fetch(`${API_URL}/candidates`)
-                                    console.log(`📡 Response status: ${res.status}`)
-                                    if (res.ok) {
-                                        const data = await res.json()
-                                        console.log(`📦 Received raw data:`, data)
-                                        // Backend returns a raw array, not {candidates: [...]}
-                                        const allCandidates = Array.isArray(data) ? data : []
-                                        console.log(`📦 Total candidates: ${allCandidates.length}`)
-                                        // Get the most recent N candidates where N = candidates_added
-                                        const recentCandidates = allCandidates.slice(0, progress.candidates_added)
-                                        console.log(`✂️ Sliced to ${recentCandidates.length} recent candidates`)
-                                        setScannedCandidates(recentCandidates)
-                                        console.log(`✅ Loaded ${recentCandidates.length} scanned candidates into state`)
-                                    } else {
-                                        console.error(`❌ Failed to fetch candidates: ${res.status} ${res.statusText}`)
-                                    }
-                                } catch (e) {
-                                    console.error('❌ Failed to fetch scanned candidates:', e)
-                                    alert('Scan completed but failed to load candidates. Please check the Search Database tab.')
-                                }
+            const { batch_id: batchId } = await scanRes.json()
+
+            // Returns true once the scan has finished
+            const handleProgress = async (progress: ScanProgress): Promise<boolean> => {
+                console.log('📊 Scan progress:', progress)
+                setScanProgress(progress)
+                
+                if (progress.status === 'complete') {
+                    console.log(`✅ Scan complete! candidates_added: ${progress.candidates_added}`)
+                    setIsLoading(false)
+                    // Fetch the most recent candidates (those just added by the scan)
+                    if (progress.candidates_added > 0) {
+                        try {
+                            console.log(`📥 Fetching candidates from ${API_URL}/candidates`)
+                            const res = await fetch(`${API_URL}/candidates`)
+                            console.log(`📡 Response status: ${res.status}`)
+                            if (res.ok) {
+                                const data = await res.json()
+                                console.log(`📦 Received raw data:`, data)
+                                // Backend returns a raw array, not {candidates: [...]}
+                                const allCandidates = Array.isArray(data) ? data : []
+                                console.log(`📦 Total candidates: ${allCandidates.length}`)
+                                // Get the most recent N candidates where N = candidates_added
+                                const recentCandidates = allCandidates.slice(0, progress.candidates_added)
+                                console.log(`✂️ Sliced to ${recentCandidates.length} recent candidates`)
+                                setScannedCandidates(recentCandidates)
+                                console.log(`✅ Loaded ${recentCandidates.length} scanned candidates into state`)
                             } else {
-                                console.log('ℹ️ No candidates added in this scan')
-                                setScannedCandidates([])
+                                console.error(`❌ Failed to fetch candidates: ${res.status} ${res.statusText}`)
                             }
-                            setTimeout(() => setScanProgress(null), 5000)
-                        } else if (progress.status === 'error') {
-                            console.error('❌ Scan error:', progress.message)
-                            setIsLoading(false)
-                            setTimeout(() => setScanProgress(null), 5000)
-                        } else {
-                            setTimeout(pollProgress, 500)
+                        } catch (e) {
+                            console.error('❌ Failed to fetch scanned candidates:', e)
+                            alert('Scan completed but failed to load candidates. Please check the Search Database tab.')
                         }
+                    } else {
+                        console.log('ℹ️ No candidates added in this scan')
+                        setScannedCandidates([])
+                    }
+                    setTimeout(() => setScanProgress(null), 5000)
+                    return true
+                } else if (progress.status === 'error') {
+                    console.error('❌ Scan error:', progress.message)
+                    setIsLoading(false)
+                    setTimeout(() => setScanProgress(null), 5000)
+                    return true
+                }
+                return false
+            }
+
+            const pollProgress = async () => {
+                try {
+                    const progressRes = await fetch(`${API_URL}/scan-progress?batch_id=${encodeURIComponent(batchId)}`, {
+                        headers: { 'Authorization': `Bearer ${token}` }
+                    })
+                    if (!progressRes.ok) {
+                        console.error(`❌ Failed to fetch scan progress: ${progressRes.status} ${progressRes.statusText}`)
+                        setIsLoading(false)
+                        return
+                    }
+                    const done = await handleProgress(await progressRes.json())
+                    if (!done) {
+                        setTimeout(pollProgress, 500)
                     }
                 } catch (e) {
                     console.error('❌ Error polling progress:', e)
                     setTimeout(pollProgress, 1000)
                 }
             }
-            pollProgress()
+
+            // Progress is pushed over Server-Sent Events; fall back to polling if the stream fails
+            let streamedProgress: ProgressDelta | null = null
+            let finished = false
+            const source = new EventSource(
+                `${API_URL}/scan-progress/stream?batch_id=${encodeURIComponent(batchId)}&session_token=${encodeURIComponent(token)}`
+            )
+            source.onmessage = async (event) => {
+                streamedProgress = mergeProgress(streamedProgress, JSON.parse(event.data))
+                const progress = streamedProgress as ScanProgress
+                if (progress.status === 'complete' || progress.status === 'error') {
+                    finished = true
+                    source.close()
+                }
+                await handleProgress(progress)
+            }
+            source.onerror = () => {
+                source.close()
+                if (!finished) {
+                    pollProgress()
+                }
+            }
         } catch (error) {
             console.error('Scan error:', error)
             alert('Failed to start scan. Please try again.')
@@ -849,7 +898,11 @@ export default function Home() {
                                     setCustomDateTo('')
                                     setCustomSourceEmail('')
                                     // Call backend reset
-                                    fetch(`${API_URL}/reset-session`, { method: 'POST' })
+                                    const token = getSessionToken()
+                                    fetch(`${API_URL}/reset-session`, {
+                                        method: 'POST',
+                                        headers: token ? { 'Authorization': `Bearer ${token}` } : {}
+                                    })
                                 }}
                                 className="px-3 py-1.5 bg-amber-50 hover:bg-amber-100 text-amber-700 rounded-lg text-sm border border-amber-200"
                             >